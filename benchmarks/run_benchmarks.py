@@ -0,0 +1,245 @@
+import argparse
+import functools
+import json
+import os
+import platform
+import resource
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+BASELINES_DIR = Path(__file__).resolve().parent / 'baselines'
+
+# (integrated sites, years, continuous sites) of each scale; the years cover both formats
+# of the workbooks (before and after 2010) and of the continuous files (before and after 2005)
+scales = {
+    'small': (4, [2004, 2009, 2010, 2011], 8),
+    'medium': (16, list(range(2004, 2014)), 40),
+    'large': (48, list(range(2003, 2020)), 120)
+}
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    """Serve files without logging every request"""
+    def log_message(self, format, *args):
+        pass
+
+
+def start_file_server(directory):
+    """
+    Serve a directory over HTTP on a free local port in a background thread.
+    - input: directory: a directory path (string) to serve
+    - outputs:
+        - server: the running server; call shutdown() to stop it
+        - base_url: the URL (string) of the directory
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(QuietHandler, directory=directory))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+
+def get_peak_rss_mb():
+    """Return the peak resident set size (float) in MB of this process and its finished children"""
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    unit = 1024 ** 2 if platform.system() == 'Darwin' else 1024
+    peak_self = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(peak_self, peak_children) * unit / 1024 ** 2
+
+
+def get_cpu_time():
+    """
+    Return the CPU time (float) in seconds of this process and its finished children,
+    so the work of the worker processes in parallel stages is included.
+    """
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return time.process_time() + children.ru_utime + children.ru_stime
+
+
+def run_stage(name, func, trace_memory=False):
+    """
+    Run a benchmark stage and measure it.
+    - inputs:
+        - name: the stage name (string)
+        - func: a function without arguments
+        - trace_memory: Optional. If True, measure the peak of Python allocations in the
+            stage with tracemalloc, which slows the stage down. False by default.
+    - output: a dictionary of 'stage', 'wall_s', 'cpu_s' (including worker processes),
+        'peak_rss_mb', and 'traced_peak_mb'
+    """
+    if trace_memory:
+        tracemalloc.start()
+    wall_start, cpu_start = time.perf_counter(), get_cpu_time()
+    func()
+    wall, cpu = time.perf_counter() - wall_start, get_cpu_time() - cpu_start
+
+    traced_peak = None
+    if trace_memory:
+        traced_peak = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+        tracemalloc.stop()
+
+    result = {'stage': name, 'wall_s': round(wall, 3), 'cpu_s': round(cpu, 3),
+              'peak_rss_mb': round(get_peak_rss_mb(), 1),
+              'traced_peak_mb': None if traced_peak is None else round(traced_peak, 1)}
+    print(f'{name:<20} {result["wall_s"]:>9.3f} s {result["cpu_s"]:>9.3f} s cpu {result["peak_rss_mb"]:>8.1f} MB')
+    return result
+
+
+def get_stages(generated, processes=None):
+    """
+    Return the benchmark stages in the order of the pipeline. The modules are imported
+    here, after NAPS_DATA_DIR points to the synthetic data directory.
+    - inputs:
+        - generated: a dictionary returned by generate_synthetic_dataset()
+        - processes: Optional. the number of worker processes (int) for parallel stages
+    - output: a list of (name, function) tuples
+    """
+    from src.config import INTEGRATED_PM25_DIR
+    from src.data.batch_source_apportionment import create_pmf_datasets
+    from src.data.continuous_pm25_store import is_store_available
+    from src.data.download_data import download_continuous_dataset, download_integrated_dataset, \
+    unzip_integrated_dataset
+    from src.data.extract_continuous_pm25_data import extract_continuous_pm25, ingest_continuous_pm25
+    from src.data.extract_post_2010_data import extract_post_2010
+    from src.data.extract_pre_2010_data import extract_pre_2010
+    from src.data.file_operation import ensure_directory_exists
+    from src.data.index_data import index_dataset_attributes
+    from src.data.index_query import get_all_sites, get_metadata
+    from src.data.measurement_query import clear_measurement_cache, load_measurements
+    from src.data.pm25_colocation import create_colocation_files
+    from src.utils.disk_cache import clear_disk_cache
+
+    def download():
+        download_integrated_dataset()
+        download_continuous_dataset()
+
+    def extract():
+        ensure_directory_exists(INTEGRATED_PM25_DIR)
+        extract_pre_2010()
+        extract_post_2010()
+
+    def ingest_continuous():
+        if is_store_available():
+            ingest_continuous_pm25(processes=processes)
+        else:
+            extract_continuous_pm25('all', processes=processes)
+
+    def query_index():
+        # cold queries, without results of earlier runs
+        clear_disk_cache()
+        clear_measurement_cache()
+        for year in generated['years']:
+            for site_id in get_all_sites(year=year):
+                get_metadata(site_ids=[site_id], years=[year], instrument='ICPMS')
+        sites = generated['site_ids'][:5]
+        load_measurements(sites=sites, analytes=['lead', 'iron'])
+        load_measurements(sites=sites, analytes=['lead'], date_range=(f'{generated["years"][0]}-03-01', None))
+
+    def export_pmf():
+        create_pmf_datasets(sites=generated['site_ids'], processes=processes)
+
+    def join_colocation():
+        # reads the hourly data of every paired site, not the rollups used by the PMF export
+        joined_df, _ = create_colocation_files(sites=generated['site_ids'])
+        if len(joined_df) == 0:
+            raise RuntimeError('No integrated sample was joined with continuous PM2.5')
+
+    return [
+        ('download', download),
+        ('unzip', unzip_integrated_dataset),
+        ('index', index_dataset_attributes),
+        ('extract', extract),
+        ('continuous_ingest', ingest_continuous),
+        ('index_queries', query_index),
+        ('pmf_export', export_pmf),
+        ('colocation', join_colocation)
+    ]
+
+
+def compare_with_baseline(results, baseline_path):
+    """Print the wall time of each stage relative to a recorded baseline"""
+    with open(baseline_path) as file:
+        baseline = {item['stage']: item for item in json.load(file)['results']}
+
+    print(f'\nCompared with {baseline_path}:')
+    for result in results:
+        base = baseline.get(result['stage'])
+        if (base is None) or (base['wall_s'] == 0):
+            print(f'{result["stage"]:<20} (no baseline)')
+            continue
+        ratio = result['wall_s'] / base['wall_s']
+        print(f'{result["stage"]:<20} {base["wall_s"]:>9.3f} s -> {result["wall_s"]:>9.3f} s ({ratio:.2f}x)')
+
+
+def run_benchmarks(scale='small', data_dir=None, processes=None, trace_memory=False, seed=0):
+    """
+    Generate a synthetic data set, serve it locally, and time and profile the pipeline
+    from download to the PMF export against it.
+    - inputs:
+        - scale: Optional. 'small' (default), 'medium', or 'large' (see scales)
+        - data_dir: Optional. a directory path (string) for the synthetic data; a temporary
+            directory by default
+        - processes: Optional. the number of worker processes (int) for parallel stages
+        - trace_memory: Optional. If True, also trace Python allocations (slower)
+        - seed: Optional. a random seed (int) of the synthetic data
+    - output: a dictionary of the run and the results of the stages
+    """
+    if data_dir is None:
+        data_dir = tempfile.mkdtemp(prefix='naps_benchmark_')
+    # must be set before any module of src imports src.config
+    os.environ['NAPS_DATA_DIR'] = str(data_dir)
+    from benchmarks.synthetic_naps import generate_synthetic_dataset
+
+    n_sites, years, n_continuous_sites = scales[scale]
+    archive_dir = Path(data_dir) / 'archive'
+    archive_dir.mkdir(parents=True, exist_ok=True)
+    server, base_url = start_file_server(str(archive_dir))
+
+    print(f'Synthetic data ({scale}) in {data_dir}')
+    results = []
+    try:
+        generated = {}
+        results.append(run_stage('generate', lambda: generated.update(generate_synthetic_dataset(
+            data_dir, base_url, n_sites, years, n_continuous_sites, seed=seed))))
+        for name, func in get_stages(generated, processes):
+            results.append(run_stage(name, func, trace_memory))
+    finally:
+        server.shutdown()
+
+    return {
+        'scale': scale,
+        'archive_bytes': generated.get('archive_bytes'),
+        'processes': processes,
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'recorded_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': results
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the NAPS pipeline on synthetic data.')
+    parser.add_argument('--scale', choices=list(scales), default='small', help='data size (default: small)')
+    parser.add_argument('--data-dir', default=None, help='directory for the synthetic data (default: temporary)')
+    parser.add_argument('--processes', type=int, default=None, help='the number of worker processes')
+    parser.add_argument('--trace-memory', action='store_true', help='trace Python allocations (slower)')
+    parser.add_argument('--record', action='store_true',
+                        help='save the results as the baseline of the scale in benchmarks/baselines')
+    parser.add_argument('--compare', default=None,
+                        help='a baseline JSON to compare with; the baseline of the scale if "baseline"')
+    args = parser.parse_args()
+
+    run = run_benchmarks(args.scale, args.data_dir, args.processes, args.trace_memory)
+    baseline_path = BASELINES_DIR / f'{args.scale}.json'
+
+    if args.compare is not None:
+        compare_with_baseline(run['results'], baseline_path if args.compare == 'baseline' else args.compare)
+    if args.record:
+        BASELINES_DIR.mkdir(exist_ok=True)
+        with open(baseline_path, 'w') as file:
+            json.dump(run, file, indent=2)
+        print(f'Baseline saved to {baseline_path}')
@@ -0,0 +1,333 @@
+import os
+import shutil
+import zipfile
+import numpy as np
+import openpyxl
+import pandas as pd
+from pathlib import Path
+from src.data.archive_structure_parser import get_unzipped_dir_for_pm25speciation, \
+get_unzipped_file_for_pm25speciation
+
+# xlwt is optional; it is only needed to write the .XLS workbooks before 2010
+try:
+    import xlwt
+except ImportError:
+    xlwt = None
+
+# the config files of the repository, copied into a synthetic data directory
+SOURCE_CONFIG_DIR = Path(__file__).resolve().parents[1] / 'data' / 'config'
+
+# the header row (1-based) of the worksheets in and after 2010
+HEADER_ROW_POST_2010 = 6
+
+# (raw name in and after 2010, raw name before 2010, abbreviation) of the synthetic analytes
+metals = [
+    ('Aluminum (Al)', 'Aluminum', 'Al'), ('Antimony (Sb)', 'Antimony', 'Sb'),
+    ('Arsenic (As)', 'Arsenic', 'As'), ('Barium (Ba)', 'Barium', 'Ba'),
+    ('Cadmium (Cd)', 'Cadmium', 'Cd'), ('Chromium (Cr)', 'Chromium', 'Cr'),
+    ('Copper (Cu)', 'Copper', 'Cu'), ('Iron (Fe)', 'Iron', 'Fe'),
+    ('Lead (Pb)', 'Lead', 'Pb'), ('Manganese (Mn)', 'Manganese', 'Mn'),
+    ('Nickel (Ni)', 'Nickel', 'Ni'), ('Titanium (Ti)', 'Titanium', 'Ti'),
+    ('Vanadium (V)', 'Vanadium', 'V'), ('Zinc (Zn)', 'Zinc', 'Zn')
+]
+ions = [
+    ('Ammonium', 'Ammonium', 'NH4'), ('Calcium', 'Calcium', 'Ca'),
+    ('Chloride', 'Chloride', 'Cl'), ('Magnesium', 'Magnesium', 'Mg'),
+    ('Nitrate', 'Nitrate', 'NO3'), ('Potassium', 'Potassium', 'K'),
+    ('Sodium', 'Sodium', 'Na'), ('Sulphate', 'Sulphate', 'SO4')
+]
+
+# ranges of the analyte medians in the reported units: ng/m3 for metals and ug/m3 for ions
+metal_median_range = (0.5, 200)
+ion_median_range = (0.05, 3)
+
+# columns of a sampler in the PM2.5 worksheet (see column_names_PM25 in extract_post_2010_data.py)
+pm25_sampler_columns = ['Mass (ug/m3)', 'PM2.5-MDL', 'PM2.5-Vflag', 'Pres.', 'Temp.',
+                        'Start Time', 'End Time', 'Actual Volume']
+
+
+def get_synthetic_site_ids(n_sites, offset=0):
+    """Return NAPS-like site IDs (int) of 5 or 6 digits"""
+    return [10102 + 3007 * (offset + i) for i in range(n_sites)]
+
+
+def get_sampling_dates(year, frequency=3):
+    """Return the sampling dates (a list of datetime) of a year on a 1-in-N day schedule"""
+    dates = pd.date_range(f'{year}-01-01', f'{year}-12-31', freq=f'{frequency}D')
+    return [date.to_pydatetime() for date in dates]
+
+
+def synthetic_values(rng, n_rows, median, missing_fraction=0.02):
+    """
+    Return lognormal concentrations with a few missing (None) and non-positive values.
+    - output: a list of float or None
+    """
+    values = rng.lognormal(np.log(median), 0.8, n_rows).round(4)
+    values[rng.random(n_rows) < 0.01] = -0.001
+    values = values.astype(object)
+    values[rng.random(n_rows) < missing_fraction] = None
+    return values.tolist()
+
+
+def get_analyte_blocks(rng, analytes, n_rows, post_2010, median_range):
+    """
+    Return the header and the columns of the analyte block of a worksheet: each analyte
+    is followed by its MDL and (in and after 2010) its validation flag. The median of
+    each analyte is drawn from median_range (in the reported unit).
+    - output: a tuple of (header list, list of column lists)
+    """
+    header, columns = [], []
+    for post_name, pre_name, abb in analytes:
+        name = post_name if post_2010 else pre_name
+        # ion columns in and after 2010 are named after the full name (e.g. 'Sulphate-MDL'),
+        # and the others after the abbreviation (e.g. 'Pb-MDL')
+        mdl_name = (pre_name if (post_2010 and (post_name == pre_name)) else abb) + '-MDL'
+        median = float(rng.uniform(*median_range))
+        header.extend([name, mdl_name])
+        columns.extend([synthetic_values(rng, n_rows, median), [round(median / 20, 4)] * n_rows])
+        if post_2010:
+            flags = np.where(rng.random(n_rows) < 0.01, 'V1', None).tolist()
+            header.append((pre_name if post_name == pre_name else abb) + '-VFlag')
+            columns.append(flags)
+    return header, columns
+
+
+def write_pre_2010_workbook(file_path, year, site_id, analytes, rng, with_blanks=False):
+    """
+    Write a synthetic .XLS workbook before 2010: one sheet with title rows (two in 2009),
+    a header row with 'Date' and 'NAPS ID', and dates as Excel serial numbers.
+    IC workbooks alternate regular samples and field blanks.
+    """
+    dates = get_sampling_dates(year)
+    cartridges = ['C'] * len(dates)
+    if with_blanks:
+        dates = [date for date in dates for _ in range(2)]
+        cartridges = ['C', 'FB'] * (len(dates) // 2)
+
+    median_range = ion_median_range if analytes is ions else metal_median_range
+    header, columns = get_analyte_blocks(rng, analytes, len(dates), False, median_range)
+    header = ['Date', 'NAPS ID', 'Cartridge', 'Media', 'Mass', 'PM2.5-MDL'] + header
+    columns = [dates, [site_id] * len(dates), cartridges, ['T'] * len(dates),
+               synthetic_values(rng, len(dates), 10), [0.5] * len(dates)] + columns
+
+    book = xlwt.Workbook()
+    sheet = book.add_sheet(f'S{site_id}')
+    date_style = xlwt.easyxf(num_format_str='YYYY-MM-DD')
+    title_rows = 2 if year == 2009 else 1
+    for row in range(title_rows):
+        sheet.write(row, 0, f'NAPS PM2.5 Speciation {year} - Site {site_id}')
+    for col, name in enumerate(header):
+        sheet.write(title_rows, col, name)
+    for col, values in enumerate(columns):
+        for row, value in enumerate(values):
+            if value is None:
+                continue
+            if col == 0:
+                sheet.write(title_rows + 1 + row, col, value, date_style)
+            else:
+                sheet.write(title_rows + 1 + row, col, value)
+    book.save(file_path)
+
+
+def write_sheet(sheet, sampler_row, header, columns):
+    """
+    Fill a worksheet in and after 2010: the sampler labels in the first row, a title,
+    the header row at HEADER_ROW_POST_2010, and data below it.
+    """
+    for col, label in enumerate(sampler_row, start=1):
+        if label is not None:
+            sheet.cell(row=1, column=col, value=label)
+    sheet.cell(row=2, column=1, value='National Air Pollution Surveillance Program (NAPS)')
+    for col, name in enumerate(header, start=1):
+        sheet.cell(row=HEADER_ROW_POST_2010, column=col, value=name)
+    for col, values in enumerate(columns, start=1):
+        for row, value in enumerate(values, start=HEADER_ROW_POST_2010 + 1):
+            if value is not None:
+                sheet.cell(row=row, column=col, value=value)
+
+
+def write_post_2010_workbook(file_path, year, site_id, rng, with_ws=True):
+    """
+    Write a synthetic .xlsx workbook in and after 2010 with the worksheets 'PM2.5'
+    (S-1 and S-2 sampler columns), 'Metals_ICPMS (Near-Total)', optionally
+    'Metals_ICPMS (Water-Soluble)', and 'Ions-Spec_IC'.
+    """
+    dates = get_sampling_dates(year)
+    n_rows = len(dates)
+    keys = [[site_id] * n_rows, dates, ['R'] * n_rows]
+    key_header = ['NAPS Site ID', 'Sampling Date', 'Sample Type']
+
+    book = openpyxl.Workbook()
+    book.remove(book.active)
+
+    samplers = ['S-1', 'S-2'] if with_ws else ['S-1']
+    pm25_columns = []
+    for _ in samplers:
+        pm25_columns.extend([synthetic_values(rng, n_rows, 10), [0.5] * n_rows, [None] * n_rows,
+                             [101.3] * n_rows, [15.0] * n_rows, ['00:00'] * n_rows, ['00:00'] * n_rows,
+                             [24.0] * n_rows])
+    sampler_row = [None] * 3 + [sampler for sampler in samplers for _ in pm25_sampler_columns]
+    write_sheet(book.create_sheet('PM2.5'), sampler_row,
+                key_header + pm25_sampler_columns * len(samplers), keys + pm25_columns)
+
+    sheets = [('Metals_ICPMS (Near-Total)', 'S-1', metals, metal_median_range)]
+    if with_ws:
+        sheets.append(('Metals_ICPMS (Water-Soluble)', 'S-2', metals, metal_median_range))
+    sheets.append(('Ions-Spec_IC', 'S-3', ions, ion_median_range))
+    for sheet_name, sampler, analytes, median_range in sheets:
+        header, columns = get_analyte_blocks(rng, analytes, n_rows, True, median_range)
+        write_sheet(book.create_sheet(sheet_name), [None, None, None, sampler],
+                    key_header + header, keys + columns)
+
+    book.save(file_path)
+
+
+def get_archive_name(year):
+    """Return the file name (string) of the zip archive of integrated data as published"""
+    if year < 2010:
+        return f'{year}PMSPECIATION.zip'
+    elif year < 2016:
+        return f'{year}_IntegratedPM2.5.zip'
+    return f'{year}_IntegratedPM2.5-PM2.5Ponctuelles.zip'
+
+
+def write_integrated_archive(archive_dir, year, site_ids, rng):
+    """
+    Write the synthetic workbooks of a year into a zip archive with the directory
+    structure of the published archive (see archive_structure_parser.py).
+    - output: the file path (string) of the archive
+    """
+    year_dir = Path(archive_dir) / str(year)
+    work_dir = year_dir / 'work'
+    # the directory in the archive, e.g. 'SPECIATION' or 'PM2.5/PM2.5'
+    inner_dir = get_unzipped_dir_for_pm25speciation(year).split('/', 1)[1]
+    (work_dir / inner_dir).mkdir(parents=True, exist_ok=True)
+
+    for i, site_id in enumerate(site_ids):
+        # water-soluble metals are measured at every other site
+        with_ws = i % 2 == 0
+        if year < 2010:
+            prefix = str(work_dir / inner_dir / f'S{site_id}')
+            write_pre_2010_workbook(prefix + '_ICPMS.XLS', year, site_id, metals, rng)
+            if with_ws:
+                write_pre_2010_workbook(prefix + '_WICPMS.XLS', year, site_id, metals, rng)
+            write_pre_2010_workbook(prefix + '_IC.XLS', year, site_id, ions, rng, with_blanks=True)
+        else:
+            file_name = get_unzipped_file_for_pm25speciation(year, site_id)
+            write_post_2010_workbook(str(work_dir / inner_dir / file_name), year, site_id, rng, with_ws)
+
+    archive_path = str(year_dir / get_archive_name(year))
+    with zipfile.ZipFile(archive_path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for root, _, names in os.walk(work_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                archive.write(path, os.path.relpath(path, work_dir))
+    shutil.rmtree(work_dir)
+    return archive_path
+
+
+def write_continuous_file(file_path, year, site_ids, rng, days=365):
+    """
+    Write a synthetic hourly PM2.5 file PM25_{year}.csv: a row per site and day with
+    24 hourly columns, with the preamble, column names, and date format of the year
+    (see get_continuous_pm25_file_format()).
+    """
+    dates = pd.date_range(f'{year}-01-01', periods=days)
+    n_rows = len(site_ids) * len(dates)
+    hourly = rng.gamma(2.0, 4.0, (n_rows, 24)).round().astype(int)
+    hourly[rng.random((n_rows, 24)) < 0.02] = -999
+
+    date_format = '%Y%m%d' if year < 2010 else '%Y-%m-%d'
+    site_column = np.repeat(site_ids, len(dates))
+    date_column = np.tile(dates.strftime(date_format).to_numpy(), len(site_ids))
+
+    if year < 2005:
+        preamble, encoding = 5, 'ISO-8859-1'
+        df = pd.DataFrame({'NAPSID': site_column, 'Date': date_column})
+        hour_columns = [f'H{str(i).zfill(2)}' for i in range(1, 25)]
+    else:
+        preamble, encoding = 7, 'utf-8'
+        df = pd.DataFrame({
+            'Pollutant//Polluant': 'PM2.5', 'Method Code//Code Méthode': 170,
+            'NAPS ID//Identifiant SNPA': site_column, 'City//Ville': 'Synthetic', 'P/T//P/T': 'ON',
+            'Latitude//Latitude': 45.0, 'Longitude//Longitude': -75.0, 'Date//Date': date_column})
+        hour_columns = [f'H{str(i).zfill(2)}//H{str(i).zfill(2)}' for i in range(1, 25)]
+    df = pd.concat([df, pd.DataFrame(hourly, columns=hour_columns)], axis=1)
+
+    with open(file_path, 'w', encoding=encoding, newline='') as file:
+        for line in range(preamble):
+            file.write(f'Synthetic NAPS hourly PM2.5 {year} ({line + 1})\n')
+        df.to_csv(file, index=False)
+
+
+def write_stations_metadata(file_path, site_ids, rng):
+    """Write a synthetic stations metadata CSV with the columns of STATIONS_CSV used in the analyses"""
+    n_sites = len(site_ids)
+    stations = pd.DataFrame({
+        'site_id': site_ids,
+        'station_name': [f'Synthetic station {site_id}' for site_id in site_ids],
+        'City': 'Synthetic',
+        'Latitude': rng.uniform(42, 60, n_sites).round(5),
+        'Longitude': rng.uniform(-130, -60, n_sites).round(5),
+        'site_type': rng.choice(['PE', 'PS', 'PT', 'RB'], n_sites)
+    })
+    stations.to_csv(file_path, index=False, encoding='utf-8')
+
+
+def generate_synthetic_dataset(data_dir, base_url, n_sites=4, years=(2008, 2009, 2010, 2011),
+                               n_continuous_sites=None, continuous_years=None, continuous_days=365, seed=0):
+    """
+    Generate a synthetic NAPS data directory to run the pipeline without the ECCC archives.
+    The published files are written under {data_dir}/archive to be served at base_url, and
+    the config files are written under {data_dir}/config with URLs to them.
+    - inputs:
+        - data_dir: a directory path (string) used as NAPS_DATA_DIR
+        - base_url: the URL (string) at which {data_dir}/archive is served
+        - n_sites: Optional. the number of integrated sites (int)
+        - years: Optional. years (int) of the integrated data; years before 2010 require xlwt
+        - n_continuous_sites: Optional. the number of continuous sites (int), which include
+            the integrated sites; twice n_sites by default
+        - continuous_years: Optional. years (int) of the continuous data; years by default.
+            Every year is expected to have integrated data, as in DATA_URLS_FILE
+        - continuous_days: Optional. the number of days (int) in each continuous file
+        - seed: Optional. a random seed (int)
+    - output: a dictionary of the generated sites and files
+    """
+    if (xlwt is None) and any(year < 2010 for year in years):
+        raise ImportError('xlwt is required to write the synthetic workbooks before 2010.')
+
+    rng = np.random.default_rng(seed)
+    data_dir = Path(data_dir)
+    archive_dir = data_dir / 'archive'
+    config_dir = data_dir / 'config'
+    metadata_dir = data_dir / 'metadata'
+    for directory in [archive_dir / 'continuous', config_dir, metadata_dir]:
+        directory.mkdir(parents=True, exist_ok=True)
+
+    for item in SOURCE_CONFIG_DIR.iterdir():
+        if item.name not in ['data_urls.csv', 'info_urls.csv']:
+            shutil.copy(item, config_dir / item.name)
+
+    site_ids = get_synthetic_site_ids(n_sites)
+    n_continuous_sites = 2 * n_sites if n_continuous_sites is None else n_continuous_sites
+    continuous_site_ids = get_synthetic_site_ids(n_continuous_sites)
+    continuous_years = list(years) if continuous_years is None else list(continuous_years)
+
+    url_rows = []
+    for year in years:
+        archive_path = write_integrated_archive(archive_dir, year, site_ids, rng)
+        url_rows.append({'year': year, 'type': 'integrated_pm25',
+                         'url': f'{base_url}/{year}%2F{os.path.basename(archive_path)}'})
+    for year in continuous_years:
+        file_name = f'PM25_{year}.csv'
+        write_continuous_file(str(archive_dir / 'continuous' / file_name), year, continuous_site_ids,
+                              rng, continuous_days)
+        url_rows.append({'year': year, 'type': 'continuous', 'url': f'{base_url}/continuous%2F{file_name}'})
+
+    pd.DataFrame(url_rows).to_csv(config_dir / 'data_urls.csv', index=False)
+    write_stations_metadata(str(metadata_dir / 'stations_metadata.csv'),
+                            sorted(set(site_ids) | set(continuous_site_ids)), rng)
+
+    archive_bytes = sum(item.stat().st_size for item in archive_dir.rglob('*') if item.is_file())
+    return {'site_ids': site_ids, 'continuous_site_ids': continuous_site_ids, 'years': list(years),
+            'continuous_years': continuous_years, 'archive_bytes': archive_bytes}
@@ -1,9 +1,11 @@
+import os
 from pathlib import Path
 
 PROJECT_ROOT = Path(__file__).resolve().parents[1]
 
 # key directories
-DATA_DIR = PROJECT_ROOT / 'data'
+# NAPS_DATA_DIR points the pipeline to another data directory, e.g. synthetic data for benchmarks
+DATA_DIR = Path(os.environ['NAPS_DATA_DIR']) if 'NAPS_DATA_DIR' in os.environ else PROJECT_ROOT / 'data'
 CONFIG_DIR = DATA_DIR / 'config'
 RAW_DIR = DATA_DIR / 'raw'
 METADATA_DIR = DATA_DIR / 'metadata'
@@ -12,6 +14,10 @@ RAW_INTEGRATED_PM25_DIR = RAW_DIR / 'integrated_pm25'
 INTEGRATED_PM25_DIR = PROCESSED_DIR / 'integrated_pm25'
 RAW_CONTINUOUS_PM25_DIR = RAW_DIR / 'continuous_pm25'
 CONTINUOUS_PM25_DIR = PROCESSED_DIR / 'continuous_pm25'
+CONTINUOUS_PM25_STORE_DIR = PROCESSED_DIR / 'continuous_pm25_store'
+CONTINUOUS_PM25_GRID_DIR = PROCESSED_DIR / 'continuous_pm25_grid'
+CONTINUOUS_PM25_ROLLUP_DIR = PROCESSED_DIR / 'continuous_pm25_rollup'
+DISK_CACHE_DIR = DATA_DIR / 'cache'
 OUTPUT_IMG_DIR = PROJECT_ROOT / 'output_image'
 
 # key files
@@ -19,6 +25,7 @@ DATA_URLS_FILE = CONFIG_DIR / 'data_urls.csv'
 INFO_URLS_FILE = CONFIG_DIR / 'info_urls.csv'
 STATIONS_RAW_CSV = RAW_DIR / 'stations.csv'
 ABBREVIATION_CSV = CONFIG_DIR / 'analyte_abbreviation.csv'
+UNITS_CSV = CONFIG_DIR / 'analyte_units.csv'
 
 # for modify errors in the dataset
 CHECKED_FREQUENCY = CONFIG_DIR / 'checked_frequency.csv'
@@ -28,3 +35,10 @@ COLUMN_NAMES_PRE_2010_IONS = CONFIG_DIR / 'column_names_pre_2010_ions.csv'
 # index data
 STATIONS_CSV = METADATA_DIR / 'stations_metadata.csv'
 INDEX_CSV = METADATA_DIR / 'index.csv'
+SPECIES_SCREENING_CSV = METADATA_DIR / 'species_screening.csv'
+COMPLETENESS_CSV = METADATA_DIR / 'completeness.csv'
+NETWORK_STATISTICS_CSV = METADATA_DIR / 'network_statistics.csv'
+CONTINUOUS_PM25_MANIFEST_CSV = METADATA_DIR / 'continuous_pm25_manifest.csv'
+
+# timing and throughput of the pipeline stages (see src/utils/instrumentation.py)
+METRICS_JSONL = METADATA_DIR / 'metrics.jsonl'
@@ -0,0 +1,142 @@
+import argparse
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from src.config import INDEX_CSV, PROCESSED_DIR, STATIONS_CSV
+from src.data.source_apportionment_extraction import create_nt_analyte_files, \
+create_PM25_file, create_ion_files
+from src.utils.instrumentation import instrumented
+from src.utils.logger_config import setup_logger
+
+logger = setup_logger('data.batch_source_apportionment', 'source_apportionment_extraction.log')
+
+PMF_SUMMARY_CSV = str(PROCESSED_DIR) + '/pmf_datasets_summary.csv'
+
+# the index and stations loaded once and shared with worker processes
+_shared_index_df = None
+_shared_stations_df = None
+
+
+def _init_worker(index_df, stations_df):
+    """Keep the index and stations DataFrames passed from the parent process"""
+    global _shared_index_df, _shared_stations_df
+    _shared_index_df = index_df
+    _shared_stations_df = stations_df
+
+
+def rank_sites_by_analytes(index_df, frequency=3):
+    """
+    Rank sites by the total number of analytes measured with a specified frequency,
+    summing the unique analytes of each year and analyte type.
+    - inputs:
+        - index_df: a DataFrame of the index CSV
+        - frequency: Optional. sampling frequency (int) in days; 3 by default
+    - output: a DataFrame with 'site_id' and 'total_analytes' sorted in descending order
+    """
+    freq_df = index_df[index_df['frequency'] == frequency]
+
+    # group by 'year', 'site_id', 'analyte_type' and count unique 'analyte'
+    analyte_counts = freq_df.groupby(
+        ['year', 'site_id', 'analyte_type'])['analyte'].nunique().reset_index(name='analyte_count')
+
+    # group by 'site_id' and sum the 'analyte_count' to get the total per site_id
+    total_analytes_per_site = analyte_counts.groupby(
+        'site_id')['analyte_count'].sum().reset_index(name='total_analytes')
+
+    return total_analytes_per_site.sort_values('total_analytes', ascending=False).reset_index(drop=True)
+
+
+def select_pmf_sites(frequency=3, min_analytes=0, index_df=None):
+    """
+    Return sites eligible for source apportionment.
+    - inputs:
+        - frequency: Optional. sampling frequency (int) in days; 3 by default
+        - min_analytes: Optional. minimum total number of analytes (int) of a site
+        - index_df: Optional. a loaded index DataFrame to avoid reading INDEX_CSV
+    - output: a list of NAPS site IDs (int) ranked by the number of analytes
+    """
+    if index_df is None:
+        index_df = pd.read_csv(INDEX_CSV)
+
+    ranked_df = rank_sites_by_analytes(index_df, frequency)
+    ranked_df = ranked_df[ranked_df['total_analytes'] >= min_analytes]
+    return ranked_df['site_id'].tolist()
+
+
+@instrumented(target=lambda target_site_id, **_: target_site_id)
+def create_pmf_dataset(target_site_id):
+    """
+    Create all files of the PMF input for a specified site, using the index
+    shared with the worker process.
+    - input: target_site_id: NAPS site ID (int)
+    - output: summary: a dictionary of the created data set
+    """
+    summary = {'site_id': target_site_id, 'station_name': None,
+               'nt_analytes': 0, 'ions': 0, 'continuous_pm25': False, 'error': None}
+
+    if _shared_stations_df is not None:
+        names = _shared_stations_df.loc[_shared_stations_df['site_id'] == target_site_id, 'station_name']
+        summary['station_name'] = names.iloc[0] if len(names) > 0 else None
+
+    try:
+        summary['nt_analytes'] = len(create_nt_analyte_files(target_site_id, index_df=_shared_index_df))
+
+        # continuous PM2.5 is not measured at every speciation site
+        try:
+            create_PM25_file(target_site_id)
+            summary['continuous_pm25'] = True
+        except FileNotFoundError:
+            logger.warning(f'No continuous PM2.5 data for site {target_site_id}')
+
+        summary['ions'] = len(create_ion_files(target_site_id, index_df=_shared_index_df))
+
+    except Exception as e:
+        logger.error(f'Failed to create the PMF data set for site {target_site_id}: {e}')
+        summary['error'] = str(e)
+
+    return summary
+
+
+@instrumented()
+def create_pmf_datasets(sites=None, frequency=3, min_analytes=0, processes=None):
+    """
+    Create the PMF input for many sites in parallel. The index and stations files
+    are loaded once and shared with the worker processes.
+    - inputs:
+        - sites: Optional. a list of NAPS site IDs (int). If not specified, sites are
+            selected by frequency and min_analytes (see select_pmf_sites())
+        - frequency: Optional. sampling frequency (int) in days to select sites
+        - min_analytes: Optional. minimum total number of analytes (int) to select sites
+        - processes: Optional. the number of worker processes (int); CPU count by default
+    - output: summary_df: a DataFrame summarising the created data sets
+        (also saved as PMF_SUMMARY_CSV)
+    """
+    index_df = pd.read_csv(INDEX_CSV)
+    stations_df = pd.read_csv(STATIONS_CSV, encoding='utf-8')[['site_id', 'station_name']]
+
+    if sites is None:
+        sites = select_pmf_sites(frequency, min_analytes, index_df)
+
+    logger.info(f'Start creating PMF data sets for {len(sites)} sites')
+
+    with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker,
+                             initargs=(index_df, stations_df)) as executor:
+        summaries = list(executor.map(create_pmf_dataset, sites))
+
+    summary_df = pd.DataFrame.from_records(summaries)
+    summary_df.to_csv(PMF_SUMMARY_CSV, index=False)
+
+    logger.info(f'Completed creating PMF data sets: {(summary_df["error"].isna()).sum()} succeeded, '
+                f'{(summary_df["error"].notna()).sum()} failed')
+    return summary_df
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Create PMF input data sets for many NAPS sites.')
+    parser.add_argument('--sites', type=int, nargs='+',
+                        help='NAPS site IDs; if omitted, sites are selected by --frequency and --min-analytes')
+    parser.add_argument('--frequency', type=int, default=3, help='sampling frequency in days (default: 3)')
+    parser.add_argument('--min-analytes', type=int, default=0, help='minimum total number of analytes')
+    parser.add_argument('--processes', type=int, default=None, help='the number of worker processes')
+    args = parser.parse_args()
+
+    create_pmf_datasets(args.sites, args.frequency, args.min_analytes, args.processes)
@@ -0,0 +1,246 @@
+import os
+import numpy as np
+import pandas as pd
+from src.config import COMPLETENESS_CSV, INDEX_CSV
+from src.data.file_operation import get_processed_file_path
+from src.data.qa_flags import QA_INTEGRATED_ERRORS
+from src.data.source_apportionment_extraction import load_site_measurements
+from src.utils.logger_config import setup_logger
+
+logger = setup_logger('data.completeness', 'completeness.log')
+
+completeness_columns = [
+    'site_id', 'year', 'instrument', 'analyte_type', 'analyte', 'frequency', 'phase',
+    'expected_samples', 'valid_samples', 'off_calendar_samples', 'completeness', 'source_mtime'
+]
+completeness_dtypes = {
+    'site_id': 'int64', 'year': 'int64', 'instrument': 'object', 'analyte_type': 'object', 'analyte': 'object',
+    'frequency': 'int64', 'phase': 'int64', 'expected_samples': 'int64', 'valid_samples': 'int64',
+    'off_calendar_samples': 'int64', 'completeness': 'float64', 'source_mtime': 'float64'
+}
+
+
+def to_day_numbers(dates):
+    """
+    Return the number of days since 1970-01-01 of dates.
+    - input: dates: an array-like of dates (string or datetime)
+    - output: a numpy array of int64
+    """
+    days = pd.to_datetime(pd.Series(dates), format='mixed').to_numpy().astype('datetime64[D]')
+    return days.astype(np.int64)
+
+
+def infer_calendar_phase(day_numbers, frequency):
+    """
+    Infer the phase of a 1-in-N day sampling calendar as the most common remainder
+    of the actual sampling days divided by the frequency.
+    - inputs:
+        - day_numbers: a numpy array of days since 1970-01-01 (int64)
+        - frequency: sampling frequency (int) in days
+    - output: phase (int) between 0 and frequency - 1
+    """
+    if len(day_numbers) == 0:
+        return 0
+    return int(np.bincount(day_numbers % frequency, minlength=frequency).argmax())
+
+
+def generate_sampling_calendar(year, frequency, phase):
+    """
+    Generate the expected sampling days of a year on a 1-in-N day calendar.
+    - inputs:
+        - year: a year (int)
+        - frequency: sampling frequency (int) in days, e.g. 3 or 6
+        - phase: the remainder (int) of the sampling days divided by the frequency
+    - output: a numpy array of datetime64[D]
+    """
+    first_day = np.datetime64(f'{year}-01-01', 'D').astype(np.int64)
+    last_day = np.datetime64(f'{year}-12-31', 'D').astype(np.int64)
+    start = first_day + (phase - first_day) % frequency
+    return np.arange(start, last_day + 1, frequency).astype('datetime64[D]')
+
+
+def compute_group_completeness(long_df, frequency_df):
+    """
+    Compare the expected sampling calendar with the valid sampling days of every
+    year and analyte in a long-format DataFrame of one site, instrument, and analyte type.
+    - inputs:
+        - long_df: a DataFrame returned by load_site_measurements() (valid measurements)
+        - frequency_df: a DataFrame with columns of 'year' and 'frequency'
+    - output: a DataFrame with a row for each year and analyte
+    """
+    frequencies = frequency_df.set_index('year')['frequency']
+    long_df = long_df.assign(day=to_day_numbers(long_df['sampling_date']))
+
+    rows = []
+    for year, year_df in long_df.groupby('year'):
+        frequency = int(frequencies.get(year, 0))
+        if frequency <= 0:
+            continue
+
+        # one phase for all analytes of the year, as they are sampled on the same filtre
+        phase = infer_calendar_phase(np.unique(year_df['day'].to_numpy()), frequency)
+        calendar = generate_sampling_calendar(year, frequency, phase)
+
+        for analyte, analyte_df in year_df.groupby('analyte', sort=False):
+            sampling_days = np.unique(analyte_df['day'].to_numpy()).astype('datetime64[D]')
+            on_calendar = np.intersect1d(calendar, sampling_days, assume_unique=True)
+            rows.append({
+                'year': year, 'analyte': analyte, 'frequency': frequency, 'phase': phase,
+                'expected_samples': len(calendar),
+                'valid_samples': len(on_calendar),
+                'off_calendar_samples': len(sampling_days) - len(on_calendar),
+                'completeness': len(on_calendar) / len(calendar) * 100
+            })
+
+    return pd.DataFrame(rows)
+
+
+def compute_empty_year_completeness(frequency_df):
+    """
+    Return the rows of years without valid measurements, with no analyte and valid_samples of 0,
+    so that the years are cached in the cube rather than recomputed on every update.
+    - input: frequency_df: a DataFrame with columns of 'year' and 'frequency' of those years
+    - output: a DataFrame with a row for each year
+    """
+    rows = []
+    for year, frequency in frequency_df[['year', 'frequency']].itertuples(index=False):
+        expected = len(generate_sampling_calendar(year, int(frequency), 0)) if frequency > 0 else 0
+        rows.append({
+            'year': year, 'analyte': np.nan, 'frequency': frequency, 'phase': 0,
+            'expected_samples': expected, 'valid_samples': 0, 'off_calendar_samples': 0,
+            'completeness': 0.0 if expected > 0 else np.nan
+        })
+    return pd.DataFrame(rows)
+
+
+def get_empty_completeness_df():
+    """Return an empty completeness cube with typed columns of completeness_columns"""
+    return pd.DataFrame({column: pd.Series(dtype=completeness_dtypes[column]) for column in completeness_columns})
+
+
+def get_source_mtimes(index_df):
+    """
+    Return the modification time of the processed file of every site, year, and instrument.
+    - input: index_df: a DataFrame of the index CSV
+    - output: a DataFrame with columns of 'site_id', 'year', 'instrument', and 'source_mtime'
+    """
+    sources_df = index_df[['site_id', 'year', 'instrument']].drop_duplicates().reset_index(drop=True)
+    mtimes = []
+    for site_id, year, instrument in sources_df.itertuples(index=False):
+        file_path = get_processed_file_path(year, site_id, instrument)
+        mtimes.append(os.path.getmtime(file_path) if os.path.exists(file_path) else np.nan)
+    sources_df['source_mtime'] = mtimes
+    return sources_df
+
+
+def compute_completeness(index_df):
+    """
+    Compute the completeness of every site, year, and analyte listed in an index DataFrame.
+    Only valid measurements (see QA_INTEGRATED_ERRORS) are counted. A year whose processed file
+    has no valid measurements has a row with no analyte (see compute_empty_year_completeness()).
+    - input: index_df: a DataFrame of the index CSV (or a subset of it)
+    - output: a DataFrame with columns of completeness_columns
+    """
+    sources_df = get_source_mtimes(index_df)
+
+    cube_dfs = []
+    for (site_id, instrument, analyte_type), group_df in index_df.groupby(
+            ['site_id', 'instrument', 'analyte_type']):
+        long_df = load_site_measurements(site_id, instrument, analyte_type, flags=QA_INTEGRATED_ERRORS,
+                                         index_df=group_df)
+        frequency_df = group_df.groupby('year')['frequency'].agg(lambda x: x.mode().iloc[0]).reset_index()
+        group_cube_df = compute_group_completeness(long_df, frequency_df) if len(long_df) > 0 else pd.DataFrame()
+
+        # years with no valid measurements, or with no sampling frequency
+        empty_year_df = frequency_df[~frequency_df['year'].isin(group_cube_df.get('year', []))]
+        if len(empty_year_df) > 0:
+            group_cube_dfs = [group_cube_df, compute_empty_year_completeness(empty_year_df)]
+            group_cube_df = pd.concat([df for df in group_cube_dfs if len(df) > 0], ignore_index=True)
+        group_cube_df['site_id'] = site_id
+        group_cube_df['instrument'] = instrument
+        group_cube_df['analyte_type'] = analyte_type
+        cube_dfs.append(group_cube_df)
+
+    if len(cube_dfs) == 0:
+        return get_empty_completeness_df()
+
+    cube_df = pd.concat(cube_dfs, ignore_index=True)
+    cube_df = cube_df.merge(sources_df, on=['site_id', 'year', 'instrument'], how='left')
+
+    # years without a processed file are not cached
+    cube_df = cube_df[cube_df['analyte'].notna() | cube_df['source_mtime'].notna()]
+    return cube_df[completeness_columns].astype(completeness_dtypes).reset_index(drop=True)
+
+
+def load_completeness_cube():
+    """
+    Load the cached completeness cube.
+    - output: a DataFrame with columns of completeness_columns (empty if not computed yet)
+    """
+    if not COMPLETENESS_CSV.exists():
+        return get_empty_completeness_df()
+    # round trip the modification times exactly to compare them with the files
+    return pd.read_csv(COMPLETENESS_CSV, float_precision='round_trip')
+
+
+def update_completeness_cube(index_df=None):
+    """
+    Update the cached completeness cube in COMPLETENESS_CSV. Only site-years whose
+    processed file is new or modified since the cube was computed are recomputed.
+    - input: index_df: Optional. a loaded index DataFrame to avoid reading INDEX_CSV
+    - output: cube_df: a DataFrame with columns of completeness_columns
+    """
+    if index_df is None:
+        index_df = pd.read_csv(INDEX_CSV)
+
+    cached_df = load_completeness_cube()
+    keys = ['site_id', 'year', 'instrument']
+
+    # compare the modification times of the processed files with the cached ones
+    sources_df = get_source_mtimes(index_df)
+    cached_sources_df = cached_df[keys + ['source_mtime']].drop_duplicates(keys)
+    compared_df = sources_df.merge(cached_sources_df, on=keys, how='left', suffixes=('', '_cached'))
+    is_stale = compared_df['source_mtime'].notna() & (
+        compared_df['source_mtime'] != compared_df['source_mtime_cached'])
+    stale_df = compared_df.loc[is_stale, keys]
+
+    if len(stale_df) == 0:
+        logger.info('The completeness cube is up to date')
+        return cached_df
+
+    logger.info(f'Computing the completeness of {len(stale_df)} site-years')
+    stale_index_df = index_df.merge(stale_df, on=keys)
+    new_df = compute_completeness(stale_index_df)
+
+    # drop the recomputed site-years and those no longer in the index
+    cached_df = cached_df.merge(sources_df[keys], on=keys)
+    cached_df = cached_df.merge(stale_df, on=keys, how='left', indicator=True)
+    cached_df = cached_df[cached_df['_merge'] == 'left_only'].drop(columns='_merge')
+
+    cube_df = pd.concat([df for df in [cached_df, new_df] if len(df) > 0] or [get_empty_completeness_df()],
+                        ignore_index=True)
+    cube_df = cube_df.sort_values(['site_id', 'year', 'instrument', 'analyte_type', 'analyte'])
+    cube_df = cube_df.reset_index(drop=True)[completeness_columns]
+    cube_df.to_csv(COMPLETENESS_CSV, index=False)
+    return cube_df
+
+
+def get_completeness_matrix(analyte, analyte_type=None, cube_df=None):
+    """
+    Return the completeness (%) of an analyte as a matrix of sites x years,
+    which can be coloured with color_percentage() in coverage_maps.py.
+    - inputs:
+        - analyte: a full name of analyte (string)
+        - analyte_type: Optional. 'NT', 'WS', or 'total'
+        - cube_df: Optional. a loaded completeness cube to avoid reading COMPLETENESS_CSV
+    - output: a DataFrame indexed by site ID with a column for each year
+    """
+    if cube_df is None:
+        cube_df = load_completeness_cube()
+
+    mask = cube_df['analyte'] == analyte
+    if analyte_type is not None:
+        mask = mask & (cube_df['analyte_type'] == analyte_type)
+
+    # the highest completeness where both NT and WS are measured
+    return cube_df[mask].pivot_table(index='site_id', columns='year', values='completeness', aggfunc='max')
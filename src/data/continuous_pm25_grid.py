@@ -0,0 +1,155 @@
+import json
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from src.config import CONTINUOUS_PM25_DIR, CONTINUOUS_PM25_GRID_DIR
+from src.data.continuous_pm25_operation import get_continuous_pm25_data
+from src.data.continuous_pm25_store import get_stored_sites, get_stored_years, is_store_available
+from src.data.file_operation import ensure_directory_exists
+from src.utils.logger_config import setup_logger
+
+logger = setup_logger('data.continuous_pm25_grid', 'extract_data.log')
+
+# the first hour of the grid
+GRID_START = pd.Timestamp('2004-01-01 00:00')
+
+GRID_FILE = str(CONTINUOUS_PM25_GRID_DIR) + '/pm25_hourly.float32'
+GRID_SITES_CSV = str(CONTINUOUS_PM25_GRID_DIR) + '/sites.csv'
+GRID_INFO_JSON = str(CONTINUOUS_PM25_GRID_DIR) + '/grid_info.json'
+
+
+def get_available_sites():
+    """
+    Return site IDs with continuous data, from the partitioned store if it exists,
+    otherwise from the site CSV files.
+    - output: a sorted list of site IDs (int)
+    """
+    if is_store_available() and (len(get_stored_sites()) > 0):
+        return get_stored_sites()
+    return sorted(int(item.stem) for item in Path(CONTINUOUS_PM25_DIR).glob('*.csv'))
+
+
+def get_hour_position(timestamps, start=GRID_START):
+    """
+    Return column positions in the grid of timestamps.
+    - inputs:
+        - timestamps: a timestamp or an array-like of timestamps
+        - start: Optional. the first hour of the grid (pd.Timestamp)
+    - output: positions (int or a numpy array of int)
+    """
+    offsets = (pd.to_datetime(timestamps) - start) // pd.Timedelta(hours=1)
+    return offsets if np.isscalar(offsets) else np.asarray(offsets, dtype=np.int64)
+
+
+def build_hourly_grid(sites=None, end_year=None):
+    """
+    Build a dense float32 memory-mapped array of shape (number of sites, number of hours
+    from 2004 to end_year) with NaN for missing or error values, and save the site index
+    (GRID_SITES_CSV) and the grid shape (GRID_INFO_JSON) as sidecar files.
+    - inputs:
+        - sites: Optional. a list of site IDs (int); all sites with continuous data by default
+        - end_year: Optional. the last year (int) of the grid; the latest stored year by default
+    - output: grid: a numpy memmap of the hourly PM2.5
+    """
+    if sites is None:
+        sites = get_available_sites()
+    if end_year is None:
+        stored_years = [year for site_id in sites for year in get_stored_years(site_id)]
+        end_year = max(stored_years) if len(stored_years) > 0 else pd.Timestamp.now().year - 1
+
+    n_hours = get_hour_position(pd.Timestamp(f'{end_year}-12-31 23:00')) + 1
+    ensure_directory_exists(CONTINUOUS_PM25_GRID_DIR)
+
+    grid = np.memmap(GRID_FILE, dtype=np.float32, mode='w+', shape=(len(sites), n_hours))
+    grid[:] = np.nan
+
+    for row, site_id in enumerate(sites):
+        # negative values are converted to NaN by get_continuous_pm25_data()
+        site_df = get_continuous_pm25_data(site_id, list(range(GRID_START.year, end_year + 1)))
+        positions = get_hour_position(site_df.index)
+        in_range = (positions >= 0) & (positions < n_hours)
+        grid[row, positions[in_range]] = site_df['PM2.5'].to_numpy(dtype=np.float32)[in_range]
+        logger.debug(f'Site {site_id}: {in_range.sum()} hours added to the grid')
+
+    grid.flush()
+
+    pd.DataFrame({'site_id': sites}).to_csv(GRID_SITES_CSV, index_label='row')
+    with open(GRID_INFO_JSON, 'w') as f:
+        json.dump({'start': str(GRID_START), 'n_sites': len(sites), 'n_hours': int(n_hours)}, f)
+
+    logger.info(f'Built the hourly grid of {len(sites)} sites x {n_hours} hours')
+    return grid
+
+
+def open_hourly_grid():
+    """
+    Open the hourly grid read-only without loading it into memory.
+    - outputs:
+        - grid: a numpy memmap of shape (number of sites, number of hours)
+        - site_ids: a numpy array of site IDs (int) for the rows
+        - start: the first hour of the grid (pd.Timestamp)
+    """
+    with open(GRID_INFO_JSON) as f:
+        grid_info = json.load(f)
+
+    grid = np.memmap(GRID_FILE, dtype=np.float32, mode='r',
+                     shape=(grid_info['n_sites'], grid_info['n_hours']))
+    site_ids = pd.read_csv(GRID_SITES_CSV)['site_id'].to_numpy()
+    return grid, site_ids, pd.Timestamp(grid_info['start'])
+
+
+def slice_hours(grid, start_time, end_time, start=GRID_START):
+    """
+    Return a zero-copy view of the grid between two timestamps (both inclusive).
+    - inputs:
+        - grid: the hourly grid
+        - start_time, end_time: timestamps (string or datetime)
+        - start: Optional. the first hour of the grid (pd.Timestamp)
+    - outputs:
+        - view: a numpy array view of shape (number of sites, number of hours in the slice)
+        - hours: a DatetimeIndex of the columns of the view
+    """
+    first = max(get_hour_position(pd.Timestamp(start_time), start), 0)
+    last = min(get_hour_position(pd.Timestamp(end_time), start), grid.shape[1] - 1)
+    hours = pd.date_range(start + pd.Timedelta(hours=first), periods=max(last - first + 1, 0), freq='h')
+    return grid[:, first:last + 1], hours
+
+
+def network_hourly_mean(grid, start_time, end_time, start=GRID_START):
+    """
+    Return the mean PM2.5 over all sites for each hour between two timestamps.
+    - output: a Series indexed by hour
+    """
+    view, hours = slice_hours(grid, start_time, end_time, start)
+    counts = np.sum(~np.isnan(view), axis=0)
+    sums = np.nansum(view, axis=0, dtype=np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = np.where(counts > 0, sums / counts, np.nan)
+    return pd.Series(means, index=hours, name='PM2.5')
+
+
+def count_exceedances(grid, threshold, start_time, end_time, start=GRID_START):
+    """
+    Return the number of sites above a threshold for each hour between two timestamps.
+    - inputs:
+        - threshold: a PM2.5 concentration (float) in ug/m3
+    - output: a Series indexed by hour
+    """
+    view, hours = slice_hours(grid, start_time, end_time, start)
+    # NaN > threshold is False, so missing hours are not counted
+    with np.errstate(invalid='ignore'):
+        counts = np.sum(view > threshold, axis=0)
+    return pd.Series(counts, index=hours, name='exceedances')
+
+
+def compare_sites_on_day(grid, site_ids, date, start=GRID_START):
+    """
+    Return hourly PM2.5 of all sites on a day.
+    - inputs:
+        - site_ids: a numpy array of site IDs (int) for the rows of the grid
+        - date: a date (string or datetime)
+    - output: a DataFrame with sites as rows and 24 hours as columns
+    """
+    day = pd.Timestamp(date).normalize()
+    view, hours = slice_hours(grid, day, day + pd.Timedelta(hours=23), start)
+    return pd.DataFrame(view, index=pd.Index(site_ids, name='site_id'), columns=hours.hour)
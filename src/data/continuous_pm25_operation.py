@@ -1,26 +1,44 @@
 import numpy as np
 import pandas as pd
-from src.config import OUTPUT_IMG_DIR, CONTINUOUS_PM25_DIR
+from src.config import OUTPUT_IMG_DIR, CONTINUOUS_PM25_DIR, CONTINUOUS_PM25_STORE_DIR
+from src.data.continuous_pm25_store import has_site_in_store, read_continuous_pm25
 from src.data.parameter_check import *
+from src.utils.disk_cache import disk_cache
 
 def error_to_none(df, measurement):
     # NaN, negative values are counted as an error.
     # Note: In visualization for the later analysis, they will be treated as NaN.
-    df[measurement] = np.where(df[measurement] < 0, np.NaN, df[measurement])
+    df[measurement] = np.where(df[measurement] < 0, np.nan, df[measurement])
     return df
 
 
+def get_continuous_pm25_inputs(site_id, **_):
+    """Return the files read by get_continuous_pm25_data() for a site"""
+    return [str(CONTINUOUS_PM25_STORE_DIR) + f'/site_id={site_id}', 
+            str(CONTINUOUS_PM25_DIR) + '/' + str(site_id) + '.csv']
+
+
+@disk_cache(inputs=get_continuous_pm25_inputs)
 def get_continuous_pm25_data(site_id, target_years):
     """
-    Load continuous PM2.5 data for a specified site and years
+    Load continuous PM2.5 data for a specified site and years. The partitions of 
+    the requested years are read from the partitioned store if it exists; 
+    otherwise the whole site CSV file is read and sliced.
     """
+    # 'all' reads every year, as the years are discovered from DATA_URLS_FILE when extracted
+    all_years = are_all_sites_included(target_years)
+    
+    if has_site_in_store(site_id):
+        years = None if all_years else list(range(target_years[0], target_years[-1] + 1))
+        site_df = read_continuous_pm25(site_id, years)
+        return error_to_none(site_df, 'PM2.5')
+    
     # construct a file name based on the site_id
     fname = str(CONTINUOUS_PM25_DIR) + '/' + str(site_id) + '.csv'
     site_df = pd.read_csv(fname, parse_dates=['sampling_date'], index_col='sampling_date')
-
-    years = list(range(2003, 2020)) if are_all_sites_included(target_years) else target_years
     
-    site_df = site_df.loc[str(years[0]):str(years[-1])]
+    if not all_years:
+        site_df = site_df.loc[str(target_years[0]):str(target_years[-1])]
     site_df = error_to_none(site_df, 'PM2.5')
     return site_df
 
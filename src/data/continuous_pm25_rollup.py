@@ -0,0 +1,198 @@
+import os
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from src.config import CONTINUOUS_PM25_DIR, CONTINUOUS_PM25_ROLLUP_DIR
+from src.data.continuous_pm25_store import get_partition_path, get_stored_sites, get_stored_years, \
+is_store_available, read_continuous_pm25, require_pyarrow
+from src.data.file_operation import ensure_directory_exists
+from src.utils.logger_config import setup_logger
+
+logger = setup_logger('data.continuous_pm25_rollup', 'extract_data.log')
+
+# resolutions of the rollups and the pandas period frequencies to group the daily rollup
+resolutions = {'daily': 'D', 'monthly': 'M', 'annual': 'Y'}
+
+rollup_columns = ['mean', 'max', 'valid_hours', 'completeness']
+
+
+def get_rollup_path(site_id, resolution):
+    """
+    Return a file path to the rollup of a site.
+    - inputs:
+        - site_id: NAPS site ID (int)
+        - resolution: 'daily', 'monthly', or 'annual'
+    - output: a file path (string)
+    """
+    if resolution not in resolutions:
+        raise ValueError(f'Unknown resolution: {resolution}. Use one of {list(resolutions)}')
+    return str(CONTINUOUS_PM25_ROLLUP_DIR) + f'/{resolution}/{site_id}.parquet'
+
+
+def has_rollup(site_id, resolution='daily'):
+    """Return True if the rollup of a site can be read"""
+    return is_store_available() and Path(get_rollup_path(site_id, resolution)).exists()
+
+
+def is_rollup_current(site_id, resolution='daily'):
+    """
+    Return True if the rollup of a site exists and is not older than the data it summarises:
+    the partitions of the site and its site CSV file, which extract_continuous_pm25() 
+    without the store rewrites without updating the rollups.
+    - inputs:
+        - site_id: NAPS site ID (int)
+        - resolution: Optional. 'daily' (default), 'monthly', or 'annual'
+    - output: bool
+    """
+    if not has_rollup(site_id, resolution):
+        return False
+    rollup_mtime = os.path.getmtime(get_rollup_path(site_id, resolution))
+    source_paths = [get_partition_path(site_id, year) for year in get_stored_years(site_id)]
+    source_paths.append(str(CONTINUOUS_PM25_DIR) + '/' + str(site_id) + '.csv')
+    return all(os.path.getmtime(path) <= rollup_mtime for path in source_paths if os.path.exists(path))
+
+
+def aggregate_hourly_to_daily(hourly_df):
+    """
+    Aggregate hourly PM2.5 into daily sums, maxima, and the numbers of valid hours.
+    NaN and negative values are counted as an error, as in omit_error_in_continuous_data().
+    - input: hourly_df: a DataFrame of hourly PM2.5 indexed by sampling_date
+    - output: a DataFrame indexed by day with columns of 'sum', 'max', and 'valid_hours'
+    """
+    values = hourly_df['PM2.5'].to_numpy(dtype=np.float64)
+    valid = values >= 0
+
+    daily_df = pd.DataFrame({
+        'sum': np.where(valid, values, 0.0),
+        'max': np.where(valid, values, np.nan),
+        'valid_hours': valid.astype(np.int64)
+    }, index=hourly_df.index.normalize())
+    return daily_df.groupby(level=0).agg({'sum': 'sum', 'max': 'max', 'valid_hours': 'sum'})
+
+
+def finalise_rollup(agg_df, resolution):
+    """
+    Compute the mean and completeness from aggregated sums and the numbers of valid hours.
+    - inputs:
+        - agg_df: a DataFrame indexed by the start of each period with columns of 'sum',
+            'max', and 'valid_hours'
+        - resolution: 'daily', 'monthly', or 'annual'
+    - output: a DataFrame with columns of rollup_columns
+    """
+    periods = agg_df.index.to_period(resolutions[resolution])
+    expected_hours = (periods.end_time.normalize() - periods.start_time).days.to_numpy() * 24 + 24
+
+    rollup_df = pd.DataFrame(index=agg_df.index)
+    valid_hours = agg_df['valid_hours'].to_numpy()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rollup_df['mean'] = np.where(valid_hours > 0, agg_df['sum'].to_numpy() / valid_hours, np.nan)
+    rollup_df['max'] = agg_df['max'].to_numpy()
+    rollup_df['valid_hours'] = valid_hours
+    rollup_df['completeness'] = valid_hours / expected_hours
+    rollup_df.index.name = 'sampling_date'
+    return rollup_df
+
+
+def compute_rollups(hourly_df):
+    """
+    Compute the daily, monthly, and annual rollups of hourly PM2.5. The coarser rollups
+    are aggregated from the daily sums without another pass over the hourly data.
+    - input: hourly_df: a DataFrame of hourly PM2.5 indexed by sampling_date
+    - output: a dictionary of resolution and the rollup DataFrame
+    """
+    daily_agg_df = aggregate_hourly_to_daily(hourly_df)
+
+    rollups = {}
+    for resolution, freq in resolutions.items():
+        if resolution == 'daily':
+            agg_df = daily_agg_df
+        else:
+            period_starts = daily_agg_df.index.to_period(freq).to_timestamp()
+            agg_df = daily_agg_df.groupby(period_starts).agg({'sum': 'sum', 'max': 'max', 'valid_hours': 'sum'})
+        rollups[resolution] = finalise_rollup(agg_df, resolution)
+    return rollups
+
+
+def write_rollup(rollup_df, site_id, resolution):
+    """
+    Write (or replace) the rollup of a site atomically.
+    - inputs:
+        - rollup_df: a DataFrame with columns of rollup_columns indexed by sampling_date
+        - site_id: NAPS site ID (int)
+        - resolution: 'daily', 'monthly', or 'annual'
+    """
+    require_pyarrow()
+    rollup_path = get_rollup_path(site_id, resolution)
+    ensure_directory_exists(Path(rollup_path).parent)
+
+    # write to a temporary file first, so a reader never sees a partial rollup
+    tmp_path = rollup_path + '.tmp'
+    rollup_df.to_parquet(tmp_path, engine='pyarrow')
+    os.replace(tmp_path, rollup_path)
+
+
+def read_rollup(site_id, resolution='daily', start=None, end=None):
+    """
+    Read the rollup of a site without touching the hourly data.
+    - inputs:
+        - site_id: NAPS site ID (int)
+        - resolution: Optional. 'daily' (default), 'monthly', or 'annual'
+        - start: Optional. the first period (string or datetime) to read
+        - end: Optional. the last period (string or datetime) to read
+    - output: a DataFrame with columns of 'mean', 'max', 'valid_hours', and
+        'completeness' (0 - 1) indexed by the start of each period
+    """
+    require_pyarrow()
+    rollup_df = pd.read_parquet(get_rollup_path(site_id, resolution), engine='pyarrow')
+    return rollup_df.loc[start:end]
+
+
+def update_rollups(site_id, years=None):
+    """
+    Recompute the rollups of a site for the specified years from the partitioned store
+    and replace those years in the rollup files. Other years are kept as they are.
+    - inputs:
+        - site_id: NAPS site ID (int)
+        - years: Optional. a list of years (int); all stored years (a full rebuild) by default
+    """
+    stored_years = get_stored_years(site_id)
+    if years is None:
+        years = stored_years
+        keep_existing = False
+    else:
+        keep_existing = True
+
+    hourly_df = read_continuous_pm25(site_id, [year for year in years if year in stored_years])
+    rollups = compute_rollups(hourly_df)
+
+    for resolution, rollup_df in rollups.items():
+        if keep_existing and has_rollup(site_id, resolution):
+            # replace the updated years, dropping years no longer stored for the site
+            existing_df = read_rollup(site_id, resolution)
+            existing_years = existing_df.index.year
+            existing_df = existing_df[~existing_years.isin(years) & existing_years.isin(stored_years)]
+            rollup_df = pd.concat([existing_df, rollup_df]).sort_index()
+
+        if len(rollup_df) == 0:
+            rollup_path = Path(get_rollup_path(site_id, resolution))
+            if rollup_path.exists():
+                rollup_path.unlink()
+            continue
+        write_rollup(rollup_df[rollup_columns], site_id, resolution)
+
+    logger.debug(f'Rollups of site {site_id} updated for {len(years)} years')
+
+
+def build_rollups(sites=None):
+    """
+    Build the daily, monthly, and annual rollups of every site in the partitioned store.
+    - input: sites: Optional. a list of site IDs (int); all stored sites by default
+    """
+    require_pyarrow()
+    if sites is None:
+        sites = get_stored_sites()
+
+    for site_id in sites:
+        update_rollups(site_id)
+
+    logger.info(f'Built the continuous PM2.5 rollups of {len(sites)} sites')
@@ -0,0 +1,240 @@
+import os
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from src.config import CONTINUOUS_PM25_STORE_DIR
+from src.data.file_operation import ensure_directory_exists
+from src.utils.logger_config import setup_logger
+
+# pyarrow is optional; the site CSV files are used when it is not installed
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+logger = setup_logger('data.continuous_pm25_store', 'extract_data.log')
+
+# one row group holds about a week of hourly data, so row-group statistics
+# allow reading a short time slice without scanning the whole partition
+ROW_GROUP_SIZE = 24 * 7
+
+
+def is_store_available():
+    """Return True if pyarrow is installed to use the partitioned store"""
+    return pq is not None
+
+
+def require_pyarrow():
+    if not is_store_available():
+        raise ImportError('pyarrow is required for the partitioned continuous PM2.5 store.')
+
+
+def get_partition_path(site_id, year):
+    """
+    Return a file path to the partition of a site and year.
+    - inputs:
+        - site_id: NAPS site ID (int)
+        - year: year of the data (int)
+    - output: a file path (string)
+    """
+    return str(CONTINUOUS_PM25_STORE_DIR) + f'/site_id={site_id}/year={year}/data.parquet'
+
+
+def get_stored_years(site_id):
+    """
+    Return years stored in the partitioned store for a site. A partition directory
+    without a complete data file (e.g. while it is first written) is not counted.
+    - input: site_id: NAPS site ID (int)
+    - output: a sorted list of years (int)
+    """
+    site_dir = Path(str(CONTINUOUS_PM25_STORE_DIR) + f'/site_id={site_id}')
+    if not site_dir.exists():
+        return []
+    years = [int(item.name.split('=')[1]) for item in site_dir.iterdir()
+             if item.name.startswith('year=') and (item / 'data.parquet').exists()]
+    return sorted(years)
+
+
+def get_stored_sites():
+    """Return a sorted list of site IDs (int) with at least one partition in the store"""
+    if not CONTINUOUS_PM25_STORE_DIR.exists():
+        return []
+    sites = [int(item.name.split('=')[1]) for item in CONTINUOUS_PM25_STORE_DIR.iterdir()
+             if item.name.startswith('site_id=') and any(item.glob('year=*/data.parquet'))]
+    return sorted(sites)
+
+
+def discard_partial_partition(site_id, year):
+    """
+    Remove the temporary file of a partition which failed to be written, and its
+    directories if they are left empty.
+    - inputs:
+        - site_id: NAPS site ID (int)
+        - year: year of the data (int)
+    """
+    partition_path = Path(get_partition_path(site_id, year))
+    Path(str(partition_path) + '.tmp').unlink(missing_ok=True)
+    for directory in [partition_path.parent, partition_path.parent.parent]:
+        if directory.exists() and not any(directory.iterdir()):
+            directory.rmdir()
+
+
+def has_site_in_store(site_id):
+    """Return True if the store can serve the continuous data of a site"""
+    return is_store_available() and (len(get_stored_years(site_id)) > 0)
+
+
+def get_partition_table(site_year_df):
+    """
+    Return the rows of a site and year as an Arrow table of a partition, sorted by time.
+    - input: site_year_df: a DataFrame of hourly PM2.5 indexed by sampling_date
+    - output: a pyarrow Table with columns of 'sampling_date' and 'PM2.5' (float32)
+    """
+    partition_df = pd.DataFrame({
+        'sampling_date': site_year_df.index.to_numpy(),
+        'PM2.5': site_year_df['PM2.5'].to_numpy(dtype=np.float32)
+    }).sort_values('sampling_date', kind='stable')
+    return pa.Table.from_pandas(partition_df, preserve_index=False)
+
+
+def write_partition(site_year_df, site_id, year):
+    """
+    Write (or replace) the partition of a site and year, sorted by time.
+    - inputs:
+        - site_year_df: a DataFrame of hourly PM2.5 indexed by sampling_date
+        - site_id: NAPS site ID (int)
+        - year: year of the data (int)
+    """
+    require_pyarrow()
+    partition_path = get_partition_path(site_id, year)
+    ensure_directory_exists(Path(partition_path).parent)
+
+    table = get_partition_table(site_year_df)
+
+    # write to a temporary file first, so a reader never sees a partial partition
+    tmp_path = partition_path + '.tmp'
+    try:
+        pq.write_table(table, tmp_path, row_group_size=ROW_GROUP_SIZE, write_statistics=True)
+    except BaseException:
+        discard_partial_partition(site_id, year)
+        raise
+    os.replace(tmp_path, partition_path)
+
+
+def remove_partition(site_id, year):
+    """
+    Remove the partition of a site and year if it exists.
+    - inputs:
+        - site_id: NAPS site ID (int)
+        - year: year of the data (int)
+    """
+    partition_path = Path(get_partition_path(site_id, year))
+    if partition_path.exists():
+        partition_path.unlink()
+        partition_path.parent.rmdir()
+        logger.debug(f'Partition of site {site_id} in {year} removed')
+
+
+def write_continuous_pm25_partitions(pm25_df, target_sites='all'):
+    """
+    Write hourly PM2.5 data into partitions by site and year.
+    - inputs:
+        - pm25_df: a DataFrame of hourly PM2.5 indexed by sampling_date with a site_id column
+        - target_sites: Optional. a list of site ID (int) or 'all' (string)
+    - output: written: a list of (site_id, year) tuples of the written partitions
+    """
+    years = pm25_df.index.year
+    written = []
+    for (site_id, year), site_year_df in pm25_df.groupby([pm25_df['site_id'], years]):
+        if (target_sites != 'all') and (site_id not in target_sites):
+            continue
+        write_partition(site_year_df, site_id, year)
+        written.append((site_id, year))
+
+    logger.debug(f'{len(written)} partitions written to {CONTINUOUS_PM25_STORE_DIR}')
+    return written
+
+
+def append_continuous_pm25_partitions(pm25_df, target_sites, writers):
+    """
+    Append hourly PM2.5 data of a chunk to the partitions by site and year through open
+    Parquet writers, which are opened on first use; the partitions replace the stored ones
+    when the writers are closed (see close_partition_writers()). The chunks of a site must
+    arrive in time order, as the rows of a raw file do.
+    - inputs:
+        - pm25_df: a DataFrame of hourly PM2.5 indexed by sampling_date with a site_id column
+        - target_sites: a list of site ID (int) or 'all' (string)
+        - writers: a dictionary of (site_id, year) and its open ParquetWriter; updated in place
+    """
+    require_pyarrow()
+    years = pm25_df.index.year
+    for (site_id, year), site_year_df in pm25_df.groupby([pm25_df['site_id'], years]):
+        if (target_sites != 'all') and (site_id not in target_sites):
+            continue
+        table = get_partition_table(site_year_df)
+        if (site_id, year) not in writers:
+            partition_path = get_partition_path(site_id, year)
+            ensure_directory_exists(Path(partition_path).parent)
+            writers[(site_id, year)] = pq.ParquetWriter(partition_path + '.tmp', table.schema,
+                                                        write_statistics=True)
+        writers[(site_id, year)].write_table(table, row_group_size=ROW_GROUP_SIZE)
+
+
+def close_partition_writers(writers, complete=True):
+    """
+    Close the writers opened by append_continuous_pm25_partitions().
+    - inputs:
+        - writers: a dictionary of (site_id, year) and its open ParquetWriter; emptied
+        - complete: Optional. If True (default), the written partitions replace the stored
+            ones; otherwise, e.g. after an error, they are discarded
+    - output: written: a list of (site_id, year) tuples of the replaced partitions
+    """
+    written = []
+    for (site_id, year), writer in writers.items():
+        writer.close()
+        if complete:
+            os.replace(get_partition_path(site_id, year) + '.tmp', get_partition_path(site_id, year))
+            written.append((site_id, year))
+        else:
+            discard_partial_partition(site_id, year)
+    writers.clear()
+    return written
+
+
+def read_continuous_pm25(site_id, years=None, start=None, end=None):
+    """
+    Read hourly PM2.5 data of a site from the partitioned store, opening only the
+    partitions of the requested years.
+    - inputs:
+        - site_id: NAPS site ID (int)
+        - years: Optional. a list of years (int); all stored years by default
+        - start: Optional. the first timestamp (string or datetime) to read
+        - end: Optional. the last timestamp (string or datetime) to read
+    - output: site_df: a DataFrame of hourly PM2.5 indexed by sampling_date
+    """
+    require_pyarrow()
+    stored_years = get_stored_years(site_id)
+    if years is not None:
+        stored_years = [year for year in stored_years if year in years]
+
+    # row groups outside the time slice are skipped by their statistics
+    filters = []
+    if start is not None:
+        filters.append(('sampling_date', '>=', pd.Timestamp(start)))
+    if end is not None:
+        filters.append(('sampling_date', '<=', pd.Timestamp(end)))
+
+    tables = [pq.read_table(get_partition_path(site_id, year), filters=filters or None)
+              for year in stored_years]
+
+    if len(tables) == 0:
+        site_df = pd.DataFrame({'site_id': pd.Series(dtype='int64'), 'PM2.5': pd.Series(dtype='float32')},
+                               index=pd.DatetimeIndex([], name='sampling_date'))
+        return site_df
+
+    site_df = pa.concat_tables(tables).to_pandas()
+    site_df['site_id'] = site_id
+    site_df = site_df.set_index('sampling_date')[['site_id', 'PM2.5']]
+    return site_df
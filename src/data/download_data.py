@@ -6,10 +6,12 @@ from zipfile import ZipFile
 from src.config import DATA_URLS_FILE, INFO_URLS_FILE, RAW_DIR,\
 RAW_INTEGRATED_PM25_DIR, RAW_CONTINUOUS_PM25_DIR, STATIONS_RAW_CSV
 from src.data.file_operation import ensure_directory_exists
+from src.utils.instrumentation import instrumented, record_metrics
 from src.utils.logger_config import setup_logger
 
 logger = setup_logger('data.download_data', 'download_data.log')
 
+@instrumented(target=lambda url, **_: url)
 def download_file(url, directory, fname=''):
     """
     Download a file from a given URL and save it to a directory.
@@ -35,6 +37,7 @@ def download_file(url, directory, fname=''):
         # open a file in binary write mode and save the content to the file
         with open(file_path, 'wb') as file:
             file.write(response.content)
+        record_metrics(bytes=len(response.content))
         logger.info(f"Downloaded {url} to {file_path}")
     else:
         logger.error(
@@ -1,90 +1,329 @@
+import hashlib
+import importlib.util
+import os
 import numpy as np
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from src.config import CONTINUOUS_PM25_DIR, RAW_CONTINUOUS_PM25_DIR
+from src.config import CONTINUOUS_PM25_DIR, CONTINUOUS_PM25_MANIFEST_CSV, DATA_URLS_FILE, \
+RAW_CONTINUOUS_PM25_DIR
+from src.data.continuous_pm25_rollup import build_rollups, update_rollups
+from src.data.continuous_pm25_store import append_continuous_pm25_partitions, close_partition_writers, \
+get_stored_sites, get_stored_years, read_continuous_pm25, remove_partition, require_pyarrow, \
+write_continuous_pm25_partitions
 from src.data.file_operation import *
 from src.data.parameter_check import *
+from src.utils.instrumentation import instrumented
 from src.utils.logger_config import setup_logger
 
 logger = setup_logger('data.extract_continuous_pm25_data', 'extract_data.log')
 
-def transform_combined_df(df):
-    # Assuming you have a function to determine the file's date format
-    def detect_date_format(date_cell):
-        date_str = str(date_cell)
-        if '-' in date_str:
-            return '%Y-%m-%d'
+# buffer size (bytes) of each site file written in the streaming mode
+WRITER_BUFFER_SIZE = 1024 * 1024
+
+# use the multithreaded pyarrow CSV engine when it is installed (None: the default C engine)
+FAST_CSV_ENGINE = 'pyarrow' if importlib.util.find_spec('pyarrow') is not None else None
+
+# a value used for missing measurements in the raw continuous data
+SENTINEL_VALUE = -999
+
+# the first year to extract; the file formats are defined from 2004 in get_continuous_pm25_file_format()
+FIRST_CONTINUOUS_YEAR = 2004
+
+manifest_columns = ['year', 'file_name', 'size', 'mtime', 'md5', 'processed_at']
+
+
+def get_continuous_years():
+    """
+    Return years of the continuous data listed in DATA_URLS_FILE whose raw file has
+    been downloaded into RAW_CONTINUOUS_PM25_DIR.
+    - output: a sorted list of years (int)
+    """
+    url_df = pd.read_csv(DATA_URLS_FILE)
+    listed_years = url_df.loc[url_df['type'] == 'continuous', 'year'].astype(int)
+    listed_years = sorted(listed_years[listed_years >= FIRST_CONTINUOUS_YEAR].unique().tolist())
+
+    years = []
+    for year in listed_years:
+        file_path, _, _ = get_continuous_pm25_file_format(year)
+        if os.path.exists(file_path):
+            years.append(year)
         else:
-            return '%Y%m%d'
-    
+            logger.warning(f'PM25_{year}.csv is listed in {DATA_URLS_FILE.name} but not downloaded')
+    return years
+
+
+def detect_date_format(date_cell):
+    """Return the date format of a cell, which vary across years"""
+    date_str = str(date_cell)
+    if '-' in date_str:
+        return '%Y-%m-%d'
+    else:
+        return '%Y%m%d'
+
+
+@instrumented(rows=len)
+def transform_combined_df(df):
+    """
+    Transform daily rows with 24 hourly columns into hourly data by reshaping 
+    the hourly block as a 2D array, without melting or sorting the hourly rows.
+    - input: df: a DataFrame with columns of site_id, sampling_date, and hours (0 - 23)
+    - output: a DataFrame of hourly PM2.5 (float32) indexed by sampling_date, 
+        sorted by site and time
+    """
     # detect the date format, which vary across years
     date_format = detect_date_format(df['sampling_date'].iloc[0])
-
-    df_melted = df.melt(id_vars=['site_id', 'sampling_date'], var_name='Hour', value_name='PM2.5')
+    dates = pd.to_datetime(df['sampling_date'], format=date_format).to_numpy()
+    site_ids = df['site_id'].to_numpy()
     
-    # parse the date and combine with hour
-    df_melted['datetime_with_hour'] = pd.to_datetime(
-        df_melted['sampling_date'], format=date_format) + pd.to_timedelta(df_melted['Hour'].astype(int), unit='h')
-
-    # set 'tmp_datetime_index' as the new index
-    df_melted.set_index('datetime_with_hour', inplace=True)
+    # order the daily rows (24 times fewer than the hourly rows) by site and date
+    order = np.lexsort((dates, site_ids))
+    
+    # malformed cells are treated as NaN
+    hourly_values = df[list(np.arange(0, 24))].apply(pd.to_numeric, errors='coerce')
+    hourly_values = hourly_values.to_numpy(dtype=np.float32)[order]
     
-    # drop the now redundant columns
-    df_melted.drop(columns=['sampling_date', 'Hour'], inplace=True)
+    # broadcast the dates against the hour offsets: (days, 1) + (24,) -> (days, 24)
+    hour_offsets = np.arange(24) * np.timedelta64(1, 'h')
+    timestamps = (dates[order][:, None] + hour_offsets).ravel()
     
-    # name the index again
-    df_melted.index.name = 'sampling_date'
-    df_melted.sort_index(ascending=True, inplace=True)
-    return df_melted
+    hourly_df = pd.DataFrame(
+        {'site_id': np.repeat(site_ids[order], 24), 'PM2.5': hourly_values.ravel()},
+        index=pd.DatetimeIndex(timestamps, name='sampling_date'))
+    return hourly_df
     
 
-def extract_continuous_pm25_data(year):
+def get_continuous_pm25_file_format(year):
     """
-    Extract hourly PM2.5 data from the continuous data file.
-    The data before or after 2006 is treated differently due to the formats.
-    - input:
-        - year: a year (int) of the data to extract
+    Return how to read a continuous data file, which is different before or after 2005.
+    - input: year: a year (int) of the data
     - outputs:
-        - pm25_df: a DataFrame containing extracted hourly PM2.5 data
+        - file_path: a file path (string) to the data file
+        - read_options: a dictionary of keyword arguments for pd.read_csv()
+        - old_columns: a list of the column names for site ID, date, and 24 hours in the file
     """
     file_name = f'PM25_{year}.csv'
     file_path = str(RAW_CONTINUOUS_PM25_DIR) + '/' + file_name
     
-    pm25_df = pd.DataFrame()
-    columns = []
-    
     if year < 2005:
-        pm25_df = pd.read_csv(file_path, encoding='ISO-8859-1', skiprows=5, low_memory=False)
-
-        columns = ['NAPSID', 'Date'] + [col for col in pm25_df.columns if col.startswith('H')]
-        pm25_df = pm25_df.rename(columns={
-            'NAPSID': 'site_id',
-            'Date': 'sampling_date'
-        })
+        read_options = {'encoding': 'ISO-8859-1', 'skiprows': 5}
         hours_old = [f'H{str(i).zfill(2)}' for i in range(1, 25)]
         old_columns = ['NAPSID', 'Date'] + hours_old
-
     else:
-        pm25_df = pd.read_csv(file_path, skiprows=7, low_memory=False)
-
-        columns = ['NAPS ID//Identifiant SNPA', 'Date//Date'] + [col for col in pm25_df.columns if col.startswith('H')]
-        pm25_df = pm25_df.rename(columns={
-            'NAPS ID//Identifiant SNPA': 'site_id',
-            'Date//Date': 'sampling_date'
-        })
+        read_options = {'skiprows': 7}
         hours_old = [f'H{str(i).zfill(2)}//H{str(i).zfill(2)}' for i in range(1, 25)]
-        old_columns = ['NAPSID', 'Date'] + hours_old
-        
+        old_columns = ['NAPS ID//Identifiant SNPA', 'Date//Date'] + hours_old
+    
+    return file_path, read_options, old_columns
+
+
+def get_typed_read_options(read_options, old_columns, hour_dtype, engine=None):
+    """
+    Return keyword arguments for pd.read_csv() which read only the site ID, date, and 
+    hourly columns with explicit dtypes.
+    - inputs:
+        - read_options: a dictionary returned by get_continuous_pm25_file_format()
+        - old_columns: a list of the column names for site ID, date, and 24 hours in the file
+        - hour_dtype: a dtype (string) of the hourly columns, 'float32' or 'str'; with 'str',
+            the site IDs are also read as strings to be coerced (see coerce_site_ids())
+        - engine: Optional. a CSV engine (string) of pd.read_csv()
+    - output: a dictionary of keyword arguments
+    """
+    typed_options = dict(read_options)
+    typed_options['usecols'] = old_columns
+    typed_options['dtype'] = {old_columns[0]: 'str' if hour_dtype == 'str' else 'int64', old_columns[1]: 'str'}
+    typed_options['dtype'].update({col: hour_dtype for col in old_columns[2:]})
+    if engine is not None:
+        typed_options['engine'] = engine
+    return typed_options
+
+
+def open_after_preamble(file_path, read_options):
+    """
+    Open a raw continuous data file in binary mode and skip the preamble lines above 
+    the header, so any CSV engine starts reading at the header row.
+    - inputs:
+        - file_path: a file path (string) to the data file
+        - read_options: a dictionary returned by get_continuous_pm25_file_format()
+    - outputs:
+        - file: an open file positioned at the header row
+        - options: read_options without 'skiprows'
+    """
+    options = dict(read_options)
+    skiprows = options.pop('skiprows', 0)
+    file = open(file_path, 'rb')
+    for _ in range(skiprows):
+        file.readline()
+    return file, options
+
+
+def coerce_hourly_columns(pm25_df, hour_columns):
+    """
+    Convert hourly columns read as strings to float32. Malformed values become NaN.
+    - inputs:
+        - pm25_df: a DataFrame read from a raw continuous data file
+        - hour_columns: a list of the hourly column names in the file
+    - outputs:
+        - pm25_df: a DataFrame with float32 hourly columns
+        - parse_errors: the number (int) of malformed values
+    """
+    raw_values = pm25_df[hour_columns]
+    numeric_values = raw_values.apply(pd.to_numeric, errors='coerce').astype(np.float32)
+    parse_errors = int((numeric_values.isna() & raw_values.notna()).to_numpy().sum())
+    pm25_df[hour_columns] = numeric_values
+    return pm25_df, parse_errors
+
+
+def coerce_site_ids(pm25_df, id_column):
+    """
+    Convert site IDs read as strings to int64, dropping the rows whose ID is blank or not numeric.
+    - inputs:
+        - pm25_df: a DataFrame read from a raw continuous data file
+        - id_column: the site ID column name in the file
+    - outputs:
+        - pm25_df: a DataFrame of the rows with a valid site ID
+        - invalid_rows: the number (int) of dropped rows
+    """
+    site_ids = pd.to_numeric(pm25_df[id_column], errors='coerce')
+    valid = site_ids.notna() & (site_ids == site_ids.round())
+    invalid_rows = int((~valid).sum())
+    pm25_df = pm25_df[valid.to_numpy()].copy()
+    pm25_df[id_column] = site_ids[valid].astype('int64').to_numpy()
+    return pm25_df, invalid_rows
+
+
+@instrumented(target=lambda year, **_: get_continuous_pm25_file_format(year)[0],
+              rows=lambda result: result[1]['rows'],
+              files=lambda year, **_: [get_continuous_pm25_file_format(year)[0]])
+def read_continuous_pm25_file(year):
+    """
+    Read a yearly continuous data file with explicit dtypes, reading only the site ID, 
+    date, and hourly columns, with a fast CSV engine where one is available.
+    - input: year: a year (int) of the data
+    - outputs:
+        - pm25_df: a DataFrame of the raw (daily) rows with float32 hourly columns
+        - report: a dictionary of the number of rows, parse errors (malformed hourly values
+            and rows dropped for an invalid site ID), and sentinel values
+    """
+    file_path, read_options, old_columns = get_continuous_pm25_file_format(year)
+    hour_columns = old_columns[2:]
+    report = {'year': year, 'engine': FAST_CSV_ENGINE or 'c', 'rows': 0, 'parse_errors': 0, 'sentinels': 0}
+    
+    try:
+        file, options = open_after_preamble(file_path, read_options)
+        with file:
+            pm25_df = pd.read_csv(
+                file, **get_typed_read_options(options, old_columns, 'float32', FAST_CSV_ENGINE))
+    except (ValueError, TypeError):
+        # malformed values: read them as strings, drop rows without a valid site ID,
+        # and coerce malformed hourly values to NaN
+        file, options = open_after_preamble(file_path, read_options)
+        with file:
+            pm25_df = pd.read_csv(
+                file, **get_typed_read_options(options, old_columns, 'str', FAST_CSV_ENGINE))
+        pm25_df, invalid_rows = coerce_site_ids(pm25_df, old_columns[0])
+        pm25_df, parse_errors = coerce_hourly_columns(pm25_df, hour_columns)
+        report['parse_errors'] = invalid_rows + parse_errors
+    
+    report['rows'] = len(pm25_df)
+    report['sentinels'] = int((pm25_df[hour_columns].to_numpy() == SENTINEL_VALUE).sum())
+    return pm25_df, report
+
+
+def format_continuous_pm25_df(pm25_df, old_columns):
+    """
+    Rename the columns of a raw continuous data to site_id, sampling_date, and hours (0 - 23),
+    and transform it into hourly data.
+    - inputs:
+        - pm25_df: a DataFrame read from a raw continuous data file
+        - old_columns: a list of the column names for site ID, date, and 24 hours in the file
+    - output: a DataFrame of hourly PM2.5 data indexed by sampling_date
+    """
     new_columns = ['site_id', 'sampling_date'] + list(np.arange(0, 24))
     rename_dict = dict(zip(old_columns, new_columns))
     pm25_df = pm25_df.rename(columns=rename_dict)
     pm25_df = pm25_df.loc[:, new_columns]
-        
-    pm25_df = transform_combined_df(pm25_df)
     
+    return transform_combined_df(pm25_df)
+
+
+def parse_continuous_pm25_data(year):
+    """
+    Extract hourly PM2.5 data from the continuous data file with a parsing report.
+    - input: year: a year (int) of the data to extract
+    - outputs:
+        - pm25_df: a DataFrame containing extracted hourly PM2.5 data
+        - report: a dictionary of the number of rows, parse errors, and sentinel values
+    """
+    _, _, old_columns = get_continuous_pm25_file_format(year)
+    pm25_df, report = read_continuous_pm25_file(year)
+    
+    logger.info(f'PM25_{year}.csv: {report["rows"]} rows, {report["parse_errors"]} parse errors, '
+                f'{report["sentinels"]} values of {SENTINEL_VALUE} ({report["engine"]} engine)')
+    
+    return format_continuous_pm25_df(pm25_df, old_columns), report
+
+
+def extract_continuous_pm25_data(year):
+    """
+    Extract hourly PM2.5 data from the continuous data file.
+    The data before or after 2005 is treated differently due to the formats.
+    - input:
+        - year: a year (int) of the data to extract
+    - outputs:
+        - pm25_df: a DataFrame containing extracted hourly PM2.5 data
+    """
+    pm25_df, _ = parse_continuous_pm25_data(year)
     return pm25_df
 
 
+def parse_continuous_pm25_files(years, processes=None):
+    """
+    Extract hourly PM2.5 data from yearly continuous data files concurrently.
+    - inputs:
+        - years: a list of years (int) of the data to extract
+        - processes: Optional. the number of worker processes (int); CPU count by default
+    - outputs:
+        - dataframes: a list of DataFrames of hourly PM2.5 data in the order of years
+        - report_df: a DataFrame of parse errors and sentinel counts for each file
+    """
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        results = list(executor.map(parse_continuous_pm25_data, years))
+    
+    dataframes = [pm25_df for pm25_df, _ in results]
+    report_df = pd.DataFrame.from_records([report for _, report in results])
+    return dataframes, report_df
+
+
+def iter_continuous_pm25_data(year, chunksize=None):
+    """
+    Yield hourly PM2.5 data of a continuous data file chunk by chunk.
+    - inputs:
+        - year: a year (int) of the data to extract
+        - chunksize: Optional. the number of rows (int; one row is a day of a site) 
+            to read at a time. The whole file is read at once by default.
+    - output: (yielding DataFrames of hourly PM2.5 data)
+    """
+    if chunksize is None:
+        yield extract_continuous_pm25_data(year)
+        return
+    
+    # the chunked reader needs the C engine; hourly values are coerced chunk by chunk
+    file_path, read_options, old_columns = get_continuous_pm25_file_format(year)
+    file, options = open_after_preamble(file_path, read_options)
+    typed_options = get_typed_read_options(options, old_columns, 'str')
+    with file, pd.read_csv(file, chunksize=chunksize, **typed_options) as reader:
+        for chunk in reader:
+            chunk, invalid_rows = coerce_site_ids(chunk, old_columns[0])
+            chunk, parse_errors = coerce_hourly_columns(chunk, old_columns[2:])
+            parse_errors += invalid_rows
+            if parse_errors > 0:
+                logger.warning(f'PM25_{year}.csv: {parse_errors} parse errors in a chunk')
+            if len(chunk) == 0:
+                continue
+            yield format_continuous_pm25_df(chunk, old_columns)
+
+
 def save_continuous_pm25_data(concatenated_df, target_sites):
     """
     Save a site specific continuous PM2.5 data
@@ -112,12 +351,84 @@ def save_continuous_pm25_data(concatenated_df, target_sites):
         logger.debug(f'Data for site {site_id} written to {fname_to_save}')
 
 
-def extract_continuous_pm25(target_sites):
+def append_continuous_pm25_data(pm25_df, target_sites, writers):
+    """
+    Append the rows of each site to the site specific continuous PM2.5 data 
+    through buffered writers, which are opened (and the files truncated) on first use.
+    - inputs:
+        - pm25_df: a DataFrame of hourly PM2.5 data of a year or a chunk
+        - target_sites: a list of site ID (int) or 'all' (string)
+        - writers: a dictionary of site ID (int) and its open file; updated in place
+    """
+    for site_id, site_df in pm25_df.groupby('site_id'):
         
-    target_years = np.arange(2004, 2020)
+        if (not are_all_sites_included(target_sites)):
+            if (site_id not in target_sites) :
+                continue
+        
+        is_new_file = site_id not in writers
+        if is_new_file:
+            fname_to_save = str(CONTINUOUS_PM25_DIR) + '/' + str(site_id) + '.csv'
+            writers[site_id] = open(
+                fname_to_save, 'w', encoding='utf-8', newline='', buffering=WRITER_BUFFER_SIZE)
+        
+        site_df.to_csv(writers[site_id], header=is_new_file)
+
+
+def extract_continuous_pm25(target_sites, streaming=False, chunksize=None, processes=None, store=False):
+    """
+    Extract hourly PM2.5 data of all years and save them as site specific CSV files.
+    - inputs:
+        - target_sites: a list of site ID (int) or 'all' (string)
+        - streaming: Optional. If True, process one year (or one chunk) at a time and 
+            append the rows to the site files (and the partitions of the store), so the 
+            peak memory does not grow with the number of years. False by default.
+        - chunksize: Optional. the number of raw rows (int) to process at a time in 
+            the streaming mode. A whole year at a time by default.
+        - processes: Optional. the number of worker processes (int) to parse the yearly 
+            files concurrently when not streaming; CPU count by default
+        - store: Optional. If True, also write the site/year partitioned store 
+            (see continuous_pm25_store.py; requires pyarrow). False by default.
+    """
+    target_years = get_continuous_years()
+
+    if store:
+        require_pyarrow()
     
-    # read each CSV into a DataFrame and store them in a list
-    dataframes = [extract_continuous_pm25_data(year) for year in target_years]
+    if streaming:
+        ensure_directory_exists(CONTINUOUS_PM25_DIR)
+        
+        # the years are processed in order and the rows of a site are in date order 
+        # in each file, so the appended site files are sorted by time
+        writers = {}
+        partition_writers = {}
+        try:
+            for year in target_years:
+                logger.info(f'Start extracting continuous PM2.5 data of {year}')
+                for pm25_df in iter_continuous_pm25_data(year, chunksize):
+                    append_continuous_pm25_data(pm25_df, target_sites, writers)
+                    if store:
+                        append_continuous_pm25_partitions(pm25_df, target_sites, partition_writers)
+                
+                # the partitions of the year replace the stored ones once the year is complete
+                close_partition_writers(partition_writers)
+        finally:
+            for writer in writers.values():
+                writer.close()
+            close_partition_writers(partition_writers, complete=False)
+        
+        if store:
+            build_rollups()
+            if are_all_sites_included(target_sites):
+                update_manifest(target_years)
+        return
+    
+    # parse the yearly CSVs concurrently into a list of DataFrames
+    dataframes, _ = parse_continuous_pm25_files(target_years, processes)
+    
+    if store:
+        for pm25_df in dataframes:
+            write_continuous_pm25_partitions(pm25_df, target_sites)
     
     # concatenate all DataFrames into one
     concatenated_df = pd.concat(dataframes)
@@ -125,18 +436,181 @@ def extract_continuous_pm25(target_sites):
     # save site-specific continuous data sets
     save_continuous_pm25_data(concatenated_df, target_sites)
 
+    if store:
+        build_rollups()
+        if are_all_sites_included(target_sites):
+            update_manifest(target_years)
 
-def plot_continuous_pm25(site_id, df):
-    fig, ax = plt.subplots(figsize = (12, 3))
-    
-    # replace values <= 0 with NaN
-    df['PM2.5'] = df['PM2.5'].apply(lambda x: np.nan if x <= 0 else x)
-    
-    ax.plot(df.index, df['PM2.5'], label='PM$_{2.5}$', color='grey', linestyle='None', marker=',')
+
+def get_file_fingerprint(file_path, md5=True):
+    """
+    Return the size, modification time, and (optionally) MD5 hash of a file.
+    - inputs:
+        - file_path: a file path (string)
+        - md5: Optional. If False, the hash is not computed. True by default.
+    - output: a dictionary with keys of 'size', 'mtime', and 'md5'
+    """
+    stat = os.stat(file_path)
+    fingerprint = {'size': stat.st_size, 'mtime': stat.st_mtime, 'md5': None}
+    if md5:
+        file_hash = hashlib.md5()
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(WRITER_BUFFER_SIZE), b''):
+                file_hash.update(block)
+        fingerprint['md5'] = file_hash.hexdigest()
+    return fingerprint
+
+
+def load_manifest():
+    """
+    Load the manifest of the raw continuous data files already processed into the store.
+    - output: a DataFrame with columns of manifest_columns (empty if no manifest exists)
+    """
+    if not CONTINUOUS_PM25_MANIFEST_CSV.exists():
+        return pd.DataFrame(columns=manifest_columns)
+    # round trip the modification times exactly to compare them with the files
+    return pd.read_csv(CONTINUOUS_PM25_MANIFEST_CSV, dtype={'md5': 'str'}, float_precision='round_trip')
+
+
+def update_manifest(years):
+    """
+    Record the fingerprints of the raw files of the processed years in CONTINUOUS_PM25_MANIFEST_CSV.
+    - input: years: a list of years (int) processed into the store
+    """
+    manifest_df = load_manifest()
+    manifest_df = manifest_df[~manifest_df['year'].isin(years)]
+
+    rows = []
+    for year in years:
+        file_path, _, _ = get_continuous_pm25_file_format(year)
+        row = {'year': year, 'file_name': os.path.basename(file_path)}
+        row.update(get_file_fingerprint(file_path))
+        row['processed_at'] = datetime.now().isoformat(timespec='seconds')
+        rows.append(row)
+
+    manifest_df = pd.concat([manifest_df, pd.DataFrame(rows, columns=manifest_columns)], ignore_index=True)
+    ensure_directory_exists(CONTINUOUS_PM25_MANIFEST_CSV.parent)
+    manifest_df.sort_values('year').to_csv(CONTINUOUS_PM25_MANIFEST_CSV, index=False)
+
+
+def touch_manifest(years):
+    """
+    Record the current size and modification time of raw files whose content is unchanged
+    since they were processed, so they are not hashed again on the next run.
+    - input: years: a list of years (int) in the manifest
+    """
+    manifest_df = load_manifest()
+    for year in years:
+        file_path, _, _ = get_continuous_pm25_file_format(year)
+        fingerprint = get_file_fingerprint(file_path, md5=False)
+        manifest_df.loc[manifest_df['year'] == year, ['size', 'mtime']] = [fingerprint['size'], fingerprint['mtime']]
+    manifest_df.to_csv(CONTINUOUS_PM25_MANIFEST_CSV, index=False)
+
+
+def get_changed_years(years):
+    """
+    Return years whose raw file is new or changed since it was processed. The MD5 hash is
+    computed only when the size or modification time differs from the manifest, so a file
+    touched without changes is not processed again, and its new size and modification
+    time are recorded in the manifest.
+    - input: years: a list of years (int) of the downloaded raw files
+    - output: a list of years (int) to process
+    """
+    manifest_df = load_manifest().set_index('year')
+
+    changed_years = []
+    touched_years = []
+    for year in years:
+        file_path, _, _ = get_continuous_pm25_file_format(year)
+        if year not in manifest_df.index:
+            changed_years.append(year)
+            continue
+
+        recorded = manifest_df.loc[year]
+        fingerprint = get_file_fingerprint(file_path, md5=False)
+        if (fingerprint['size'] == recorded['size']) and (fingerprint['mtime'] == recorded['mtime']):
+            continue
+        if get_file_fingerprint(file_path)['md5'] != recorded['md5']:
+            changed_years.append(year)
+        else:
+            touched_years.append(year)
+
+    if len(touched_years) > 0:
+        touch_manifest(touched_years)
+    return changed_years
+
+
+def replace_year_partitions(pm25_df, year, target_sites):
+    """
+    Replace the partitions of a year with newly extracted data, removing the partitions
+    of sites no longer included in the file of the year.
+    - inputs:
+        - pm25_df: a DataFrame of hourly PM2.5 data of the year
+        - year: year of the data (int)
+        - target_sites: a list of site ID (int) or 'all' (string)
+    - output: a list of site IDs (int) whose partitions were written or removed
+    """
+    written = write_continuous_pm25_partitions(pm25_df, target_sites)
+    written_sites = [site_id for site_id, _ in written]
+
+    removed_sites = []
+    for site_id in get_stored_sites():
+        if (site_id not in written_sites) and (year in get_stored_years(site_id)):
+            if are_all_sites_included(target_sites) or (site_id in target_sites):
+                remove_partition(site_id, year)
+                removed_sites.append(site_id)
+
+    return written_sites + removed_sites
+
+
+def ingest_continuous_pm25(target_sites='all', update_site_files=True, processes=None):
+    """
+    Incrementally update the partitioned store: only the yearly files which are new or
+    changed since the last run (see CONTINUOUS_PM25_MANIFEST_CSV) are parsed, and only
+    the partitions of those years are replaced. The manifest records whole years, so it
+    is updated only when all sites are ingested. Requires pyarrow.
+    - inputs:
+        - target_sites: Optional. a list of site ID (int) or 'all' (string)
+        - update_site_files: Optional. If True, rewrite the site specific CSV files of the
+            affected sites from the store. True by default.
+        - processes: Optional. the number of worker processes (int); CPU count by default
+    - output: changed_years: a list of years (int) processed
+    """
+    require_pyarrow()
+
+    changed_years = get_changed_years(get_continuous_years())
+    if len(changed_years) == 0:
+        logger.info('No new or changed continuous PM2.5 files')
+        return changed_years
+
+    logger.info(f'Start ingesting continuous PM2.5 data of {changed_years}')
+
+    dataframes, _ = parse_continuous_pm25_files(changed_years, processes)
+
+    affected_sites = set()
+    for year, pm25_df in zip(changed_years, dataframes):
+        affected_sites.update(replace_year_partitions(pm25_df, year, target_sites))
+
+    if update_site_files:
+        ensure_directory_exists(CONTINUOUS_PM25_DIR)
+        for site_id in sorted(affected_sites):
+            fname_to_save = str(CONTINUOUS_PM25_DIR) + '/' + str(site_id) + '.csv'
+            if len(get_stored_years(site_id)) == 0:
+                # the site is no longer included in any yearly file
+                if os.path.exists(fname_to_save):
+                    os.remove(fname_to_save)
+                continue
+            read_continuous_pm25(site_id).to_csv(fname_to_save, encoding='utf-8')
+
+    # the rollups are updated after the site files, as a rollup older than
+    # its site file is not used (see is_rollup_current())
+    for site_id in sorted(affected_sites):
+        update_rollups(site_id, changed_years)
     
-    ax.set_xlabel('Time')
-    plt.gcf().autofmt_xdate()
-    ax.set_ylabel('PM$_{2.5}$ (µg/m$^3$)')
-    ax.legend()
-    plt.show()
+    # the manifest is updated only after the partitions and rollups are replaced, and only
+    # when all sites are ingested, as it records whole years
+    if are_all_sites_included(target_sites):
+        update_manifest(changed_years)
 
+    logger.info(f'Completed ingesting {len(changed_years)} years for {len(affected_sites)} sites')
+    return changed_years
@@ -7,7 +7,9 @@ from src.config import RAW_INTEGRATED_PM25_DIR, INTEGRATED_PM25_DIR
 from src.data.archive_structure_parser import get_unzipped_directory_for_year, get_unzipped_file
 from src.data.file_operation import ensure_directory_exists
 from src.data.index_query import get_all_sites, get_metadata
-from src.data.text_transforms import rename_columns
+from src.data.qa_flags import add_qa_columns
+from src.data.text_transforms import normalise_units, rename_columns
+from src.utils.instrumentation import instrumented
 from src.utils.logger_config import setup_logger
 
 logger = setup_logger('data.extract_post_2010_data', 'extract_data.log')
@@ -139,6 +141,8 @@ def extract_ion_2010(sheet):
     return df
 
 
+@instrumented(target=lambda file_path, **_: file_path, rows=lambda result: len(result[0]) + len(result[1]),
+              files=lambda file_path, **_: [file_path])
 def extract_file(file_path, meta_df):
     """
     Extract ICP-MS measured data (metal and PM2.5) and IC measured data (ions).
@@ -164,6 +168,8 @@ def extract_file(file_path, meta_df):
         metal_df = rename_columns(metal_df)
         
         merged_df = pm25_df.merge(metal_df, on=['site_id', 'sampling_date', 'sampling_type', 'sampler'])
+        merged_df = normalise_units(merged_df, 'ICPMS')
+        merged_df = add_qa_columns(merged_df)
         icpms_df = pd.concat([icpms_df, merged_df], ignore_index=True)
         
     # extract ion data even if ICPMS measured data does not exsit
@@ -171,6 +177,8 @@ def extract_file(file_path, meta_df):
     if ('Ions-Spec_IC' in book.sheetnames):
         ic_df = extract_ion_2010(book['Ions-Spec_IC'])
         ic_df = rename_columns(ic_df)
+        ic_df = normalise_units(ic_df, 'IC')
+        ic_df = add_qa_columns(ic_df)
     
     return icpms_df, ic_df
 
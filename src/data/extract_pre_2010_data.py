@@ -7,7 +7,9 @@ import xlrd
 
 from src.config import RAW_INTEGRATED_PM25_DIR, INTEGRATED_PM25_DIR, INDEX_CSV, COLUMN_NAMES_PRE_2010_IONS
 from src.data.file_operation import ensure_directory_exists
-from src.data.text_transforms import rename_columns
+from src.data.qa_flags import add_qa_columns
+from src.data.text_transforms import normalise_units, rename_columns
+from src.utils.instrumentation import instrumented
 from src.utils.logger_config import setup_logger
 
 logger = setup_logger('data.extract_pre_2010_data', 'extract_data.log')
@@ -37,6 +39,9 @@ def get_raw_file_path(year, site_id, instrument, analyte_type=None):
     return file_path
 
 
+# the first row of the sheet values is the header
+@instrumented(target=lambda file_path, **_: file_path, rows=lambda result: max(len(result) - 1, 0),
+              files=lambda file_path, **_: [file_path])
 def extract_sheet_values(file_path, year):
     """
     Extract all cell values of the first sheet of an XSL file as a 2D array.
@@ -113,6 +118,8 @@ def sheet_df_to_metal_df(datafile, analyte_type):
         datafile: pandas DataFrame
     """
     datafile = rename_columns(datafile)
+    datafile = normalise_units(datafile, 'ICPMS')
+    datafile = add_qa_columns(datafile)
     datafile['analyte_type'] = analyte_type
     datafile['sampler'] = None   
     return datafile
@@ -136,6 +143,8 @@ def sheet_df_to_ion_df(datafile):
     # datafile.columns = col_values
     
     datafile = rename_columns(datafile, COLUMN_NAMES_PRE_2010_IONS)
+    datafile = normalise_units(datafile, 'IC')
+    datafile = add_qa_columns(datafile)
     datafile['analyte_type'] = 'total'
     datafile['sampler'] = None
     return datafile
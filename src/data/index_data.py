@@ -10,6 +10,7 @@ STATIONS_RAW_CSV, STATIONS_CSV, METADATA_DIR
 from src.data.archive_structure_parser import get_unzipped_directory_for_year
 from src.data.file_operation import ensure_directory_exists
 from src.data.text_transforms import remove_parentheses
+from src.utils.instrumentation import instrumented, record_metrics
 from src.utils.logger_config import setup_logger
 
 logger = setup_logger('data.index_data', 'index_data.log')
@@ -456,6 +457,33 @@ def create_row_in_and_after_2010(item, year):
     return rows
 
 
+@instrumented(target=lambda year: year, rows=len)
+def index_year(year):
+    """
+    Create the index rows of the relevant files of a year in RAW_INTEGRATED_PM25_DIR.
+    - input: year: a year (int) of the integrated data
+    - output: a list of dictionaries of the index rows
+    """
+    # retrieve an unzipped directory for a particular year
+    target_dir = Path(str(RAW_INTEGRATED_PM25_DIR) + '/' + get_unzipped_directory_for_year(year))
+    
+    rows_list = []
+    for item in target_dir.iterdir():
+        
+        # check a file if it is relevant
+        if is_relevant_file(item.name, year):
+            row = []
+            if year < 2010:
+                row.extend(create_row_before_2010(item, year))
+            else:
+                row.extend(create_row_in_and_after_2010(item, year))
+            if row is not None:
+                rows_list.extend(row)
+            record_metrics(bytes=item.stat().st_size)
+    return rows_list
+
+
+@instrumented()
 def index_dataset_attributes():
     """
     Create an index file INDEX_CSV to show the availability of integrated data  
@@ -470,21 +498,7 @@ def index_dataset_attributes():
     for year in years:
         
         logger.info(f'Start scanning the source directory of {year} >>>')
-        
-        # retrieve an unzipped directory for a particular year
-        target_dir = Path(str(RAW_INTEGRATED_PM25_DIR) + '/' + get_unzipped_directory_for_year(year))
-        
-        for item in target_dir.iterdir():
-            
-            # check a file if it is relevant
-            if is_relevant_file(item.name, year):
-                row = []
-                if year < 2010:
-                    row.extend(create_row_before_2010(item, year))
-                else:
-                    row.extend(create_row_in_and_after_2010(item, year))
-                if row is not None:
-                    rows_list.extend(row)
+        rows_list.extend(index_year(year))
     
         logger.info(f'<<< Complete scanning the data of {year}.')
     
@@ -493,6 +507,7 @@ def index_dataset_attributes():
     metadata_df.sort_values(['year', 'site_id', 'analyte'], inplace=True)
     metadata_df = metadata_df.reset_index(drop=True)
     metadata_df.to_csv(INDEX_CSV, index=False, encoding='utf-8')
+    record_metrics(rows=len(metadata_df))
 
 def apply_manually_checked_frequency(index_df, CHECKED_FREQUENCY, INDEX_CSV):
     """
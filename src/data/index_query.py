@@ -1,5 +1,8 @@
 import pandas as pd
 from src.config import INDEX_CSV, STATIONS_CSV
+from src.data.metadata_registry import get_csv
+from src.data.station_spatial_index import query_sites_in_bbox, query_sites_within_radius
+from src.utils.disk_cache import disk_cache
 
 
 def get_all_analytes(site_ids=None, years=None, instrument=None):
@@ -11,9 +14,9 @@ def get_all_analytes(site_ids=None, years=None, instrument=None):
         - instrument: 'ICPMS' or 'IC' (string); optional
     - output: analyte_list: a list of analytes' full names (string)
     """
-    index_df = pd.read_csv(INDEX_CSV)
+    index_df = get_csv(INDEX_CSV)
 
-    mask = pd.Series([True] * len(index_df))
+    mask = pd.Series(True, index=index_df.index)
     if site_ids is not None:
         mask = mask & (index_df['site_id'].isin(site_ids))
     if years is not None:
@@ -37,9 +40,9 @@ def get_all_sites(analyte=None, analyte_type=None, instrument=None, year=None):
         - year: Optional. year of the interest (int)
     - output: site_list: a list of NAPS site IDs (int)
     """
-    index_df = pd.read_csv(INDEX_CSV)
+    index_df = get_csv(INDEX_CSV)
 
-    mask = pd.Series([True] * len(index_df))
+    mask = pd.Series(True, index=index_df.index)
     if analyte is not None:
         mask = mask & (index_df['analyte'] == analyte)
     if analyte_type is not None:
@@ -54,6 +57,35 @@ def get_all_sites(analyte=None, analyte_type=None, instrument=None, year=None):
     site_list.sort()
     return site_list
 
+
+
+def get_sites_within_radius(latitude, longitude, radius_km, analyte=None, analyte_type=None, 
+                            instrument=None, year=None):
+    """
+    Return sites in the index within a radius of a point, nearest first.
+    - inputs:
+        - latitude, longitude: coordinates (float) of the point in degrees
+        - radius_km: the radius (float) in km
+        - analyte, analyte_type, instrument, year: Optional. see get_all_sites()
+    - output: a DataFrame with columns of 'site_id' and 'distance_km'
+    """
+    candidates = get_all_sites(analyte, analyte_type, instrument, year)
+    nearby_df = query_sites_within_radius(latitude, longitude, radius_km, candidates)
+    return nearby_df[['site_id', 'distance_km']]
+
+
+def get_sites_in_bbox(min_latitude, max_latitude, min_longitude, max_longitude, analyte=None, 
+                      analyte_type=None, instrument=None, year=None):
+    """
+    Return sites in the index within a bounding box (e.g. a province or an airshed).
+    - inputs:
+        - min_latitude, max_latitude, min_longitude, max_longitude: the box in degrees
+        - analyte, analyte_type, instrument, year: Optional. see get_all_sites()
+    - output: site_list: a list of NAPS site IDs (int)
+    """
+    candidates = get_all_sites(analyte, analyte_type, instrument, year)
+    return query_sites_in_bbox(min_latitude, max_latitude, min_longitude, max_longitude, candidates)
+
     
 def get_sites_for_year(year, analyte='', analyte_type='', instrument=None):
     """
@@ -77,9 +109,9 @@ def get_sations_info(sites):
     - input: sites: a list of site ID (int)
     - output: site_info: a DataFrame of staton information
     """
-    stations = pd.read_csv(STATIONS_CSV)
+    stations = get_csv(STATIONS_CSV)
     # Merge the sites in our interest with the coordinates information
-    site_list_df = pd.read_csv(INDEX_CSV, index_col=0).drop_duplicates(subset = 'site_id')
+    site_list_df = get_csv(INDEX_CSV).drop_duplicates(subset = 'site_id')
     
     site_info = site_list_df.merge(stations, on='site_id')[
         ['site_id', 'station_name', 'Latitude', 'Longitude', 'site_type']].sort_values('site_id').reset_index(drop=True)
@@ -96,7 +128,7 @@ def get_years_for_site(site_id, analyte, analyte_type=None):
         analyte_type: Optional. 'NT' for Near Total, 'WS' for Water-soluble, and 'total' for ions.
     - output: years: a list of years (int)
     """
-    index_df = pd.read_csv(INDEX_CSV)
+    index_df = get_csv(INDEX_CSV)
 
     filtered_df = pd.DataFrame()
     if analyte_type is not None:
@@ -116,7 +148,10 @@ def get_years_for_site(site_id, analyte, analyte_type=None):
     return unique_years_list
 
 
-def get_metadata(site_ids=None, years=None, instrument=None, analyte_type=None, analytes=None):
+# a given index_df is filtered faster than it is hashed for the cache
+@disk_cache(inputs=lambda **_: [INDEX_CSV], skip_if=lambda index_df, **_: index_df is not None)
+def get_metadata(site_ids=None, years=None, instrument=None, analyte_type=None, analytes=None, 
+                 index_df=None):
     """
     Rreturns metadata by specifying optional properties
     - inputs:
@@ -126,11 +161,13 @@ def get_metadata(site_ids=None, years=None, instrument=None, analyte_type=None,
         - analyte_type: 'NT' for Near Total metals, 'WS' for Water-soluble metals, 
             or 'total' for ions; optional
         - analytes: a list of full names (string) of analyte; optional
+        - index_df: a loaded index DataFrame to use instead of reading INDEX_CSV; optional
     - output: a DataFrame filtered
     """
-    index_df = pd.read_csv(INDEX_CSV)
+    if index_df is None:
+        index_df = get_csv(INDEX_CSV)
     
-    mask = pd.Series([True] * len(index_df))
+    mask = pd.Series(True, index=index_df.index)
     if site_ids is not None:
         mask = mask & (index_df['site_id'].isin(site_ids))
     if years is not None:
@@ -157,10 +194,10 @@ def get_all_years_metadata(analyte, instrument, analyte_type=None, site_id=None)
         - site_id: NAPS site ID (int); optional
     - output: a DataFrame filtered
     """
-    index_df = pd.read_csv(INDEX_CSV)
+    index_df = get_csv(INDEX_CSV)
     
     # start with a mask that selects all rows
-    mask = pd.Series([True] * len(index_df))
+    mask = pd.Series(True, index=index_df.index)
 
     mask = mask & (
         index_df['analyte'] == analyte) & (
@@ -184,10 +221,10 @@ def get_all_years_pm25_metadata(instrument, analyte_type=None, site_ids=None):
             or 'total' for ions
     - output: filtered_df: a DataFrame subset of the index file
     """
-    index_df = pd.read_csv(INDEX_CSV)
+    index_df = get_csv(INDEX_CSV)
 
     # start with a mask that selects all rows
-    mask = pd.Series([True] * len(index_df))
+    mask = pd.Series(True, index=index_df.index)
     mask = mask & (index_df['instrument'] == instrument)
     
     if site_ids is not None:
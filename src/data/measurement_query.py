@@ -0,0 +1,181 @@
+import os
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+from src.data.file_operation import get_processed_file_path
+from src.data.index_query import get_metadata
+from src.data.qa_flags import QA_INTEGRATED_ERRORS, compute_qa_masks, get_QA_col_name
+from src.data.text_transforms import get_abbreviation_dict
+
+# the number of results of load_measurements() kept in memory
+MEASUREMENT_CACHE_SIZE = 32
+
+# the number of rows read at once from a processed file
+CHUNK_SIZE = 50000
+
+instrument_by_analyte_type = {'NT': 'ICPMS', 'WS': 'ICPMS', 'total': 'IC'}
+
+measurement_columns = ['site_id', 'year', 'sampling_date', 'analyte', 'value', 'mdl', 'qa']
+
+# (arguments, modification times of the index and files) -> result, least recently used first
+_measurement_cache = OrderedDict()
+
+
+def get_site_file_columns(analytes):
+    """
+    Return a set of column names which are needed to read the analytes
+    from the processed files.
+    - input: analytes: a list of full names (string) of analytes
+    - output: a set of column names (string)
+    """
+    abb_dict = get_abbreviation_dict()
+    columns = {'sampling_date', 'analyte_type', 'sampling_type', 'Media'}
+    for analyte in analytes:
+        abb = abb_dict.get(analyte, analyte)
+        columns.update([analyte, abb + '-MDL', abb + '-QA', abb + '-VFlag', abb + '-Vflag'])
+    return columns
+
+
+def read_file_measurements(file_path, analytes, analyte_type, flags=QA_INTEGRATED_ERRORS,
+                           start=None, end=None):
+    """
+    Read the measurements of analytes in a processed file into a long-format DataFrame.
+    Only the needed columns are read, and rows of other analyte types or outside the
+    date range are dropped chunk by chunk while reading.
+    - inputs:
+        - file_path: a file path to a processed file
+        - analytes: a list of full names (string) of analytes
+        - analyte_type: 'NT' for Near Total, 'WS' for Water-soluble, and 'total' for ions
+        - flags: Optional. QA bits (int) to exclude; errors in integrated data by default
+        - start: Optional. the first sampling date (Timestamp) to read
+        - end: Optional. the last sampling date (Timestamp) to read
+    - output: a DataFrame with columns of 'sampling_date', 'analyte', 'value', 'mdl', and 'qa'
+    """
+    needed_columns = get_site_file_columns(analytes)
+
+    file_dfs = []
+    for chunk_df in pd.read_csv(file_path, usecols=lambda col: col in needed_columns, chunksize=CHUNK_SIZE):
+        keep = (chunk_df['analyte_type'] == analyte_type).to_numpy()
+        if (start is not None) or (end is not None):
+            dates = pd.to_datetime(chunk_df['sampling_date'])
+            if start is not None:
+                keep = keep & (dates >= start).to_numpy()
+            if end is not None:
+                keep = keep & (dates <= end).to_numpy()
+        file_dfs.append(chunk_df[keep])
+    file_df = pd.concat(file_dfs) if len(file_dfs) > 1 else file_dfs[0]
+
+    present = [analyte for analyte in analytes if analyte in file_df.columns]
+    if (len(present) == 0) | (len(file_df) == 0):
+        return pd.DataFrame(columns=['sampling_date', 'analyte', 'value', 'mdl', 'qa'])
+
+    abb_dict = get_abbreviation_dict()
+    n_rows, n_analytes = len(file_df), len(present)
+    values = file_df[present].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float)
+
+    mdls = np.full((n_rows, n_analytes), np.nan)
+    for i, analyte in enumerate(present):
+        mdl_col = abb_dict.get(analyte, analyte) + '-MDL'
+        if mdl_col in file_df.columns:
+            mdls[:, i] = pd.to_numeric(file_df[mdl_col], errors='coerce').to_numpy(dtype=float)
+
+    # QA masks are saved during extraction; compute them for older processed files
+    qa_cols = [get_QA_col_name(analyte) for analyte in present]
+    if all(col in file_df.columns for col in qa_cols):
+        masks = file_df[qa_cols].to_numpy().astype(np.uint8)
+    else:
+        masks = compute_qa_masks(file_df, present)
+
+    # ravel the (rows x analytes) blocks into a long format
+    long_df = pd.DataFrame({
+        'sampling_date': np.repeat(file_df['sampling_date'].to_numpy(), n_analytes),
+        'analyte': np.tile(np.array(present, dtype=object), n_rows),
+        'value': values.ravel(),
+        'mdl': mdls.ravel(),
+        'qa': masks.ravel()
+    })
+    return long_df[(long_df['qa'].to_numpy() & flags) == 0]
+
+
+def get_file_plan(sites, years, analytes, analyte_type, index_df=None):
+    """
+    Return the processed files to open for a query, with the analytes to read from each.
+    Analytes which are not indexed (e.g. PM2.5) are read from every file.
+    - inputs: see load_measurements()
+    - output: a list of (site_id, year, file path, analytes) tuples
+    """
+    instrument = instrument_by_analyte_type[analyte_type]
+    meta_df = get_metadata(site_ids=sites, years=years, instrument=instrument,
+                           analyte_type=analyte_type, index_df=index_df)
+    indexed_analytes = set(meta_df['analyte'])
+    file_analytes = meta_df.groupby(['site_id', 'year'])['analyte'].agg(set)
+
+    plan = []
+    for (site_id, year), indexed in file_analytes.items():
+        if analytes is None:
+            file_targets = sorted(indexed)
+        else:
+            file_targets = [analyte for analyte in analytes
+                            if (analyte in indexed) | (analyte not in indexed_analytes)]
+        if len(file_targets) > 0:
+            plan.append((site_id, year, get_processed_file_path(year, site_id, instrument), file_targets))
+    return plan
+
+
+def load_measurements(sites=None, years=None, analytes=None, date_range=None, analyte_type='NT',
+                      qa_mask=QA_INTEGRATED_ERRORS):
+    """
+    Load measurements across sites and years into a long-format DataFrame. The index is
+    consulted to open only the relevant files, and only the needed columns and rows are
+    read. Recent results are kept in memory and returned again while the index and the
+    files are unchanged.
+    - inputs:
+        - sites: Optional. a list of NAPS site IDs (int); all sites by default
+        - years: Optional. a list of years (int); all years by default
+        - analytes: Optional. a list of full names (string) of analytes; all analytes by default
+        - date_range: Optional. a tuple of the first and last sampling dates (string or datetime);
+            either can be None for an open range
+        - analyte_type: Optional. 'NT' (default) for Near Total, 'WS' for Water-soluble,
+            and 'total' for ions
+        - qa_mask: Optional. QA bits (int) to exclude (see qa_flags.py); errors in integrated
+            data by default, and 0 to keep all measurements
+    - output: a DataFrame with columns of 'site_id', 'year', 'sampling_date', 'analyte',
+        'value', 'mdl', and 'qa'; shared with the cache, so copy it before modifying it
+    """
+    start, end = date_range if date_range is not None else (None, None)
+    start = pd.Timestamp(start) if start is not None else None
+    end = pd.Timestamp(end) if end is not None else None
+
+    plan = get_file_plan(sites, years, analytes, analyte_type)
+    plan = [item for item in plan if ((start is None) or (item[1] >= start.year)) & (
+        (end is None) or (item[1] <= end.year))]
+
+    arguments = (None if sites is None else tuple(sorted(sites)),
+                 None if years is None else tuple(sorted(years)),
+                 None if analytes is None else tuple(analytes), start, end, analyte_type, qa_mask)
+    key = (arguments, tuple((file_path, os.stat(file_path).st_mtime_ns) for _, _, file_path, _ in plan))
+
+    if key in _measurement_cache:
+        _measurement_cache.move_to_end(key)
+        return _measurement_cache[key]
+
+    long_dfs = []
+    for site_id, year, file_path, file_analytes in plan:
+        long_df = read_file_measurements(file_path, file_analytes, analyte_type, qa_mask, start, end)
+        if len(long_df) > 0:
+            long_dfs.append(long_df.assign(site_id=site_id, year=year))
+
+    if len(long_dfs) == 0:
+        result_df = pd.DataFrame(columns=measurement_columns)
+    else:
+        result_df = pd.concat(long_dfs, ignore_index=True)[measurement_columns]
+
+    _measurement_cache[key] = result_df
+    if len(_measurement_cache) > MEASUREMENT_CACHE_SIZE:
+        _measurement_cache.popitem(last=False)
+    return result_df
+
+
+def clear_measurement_cache():
+    """Drop all results kept by load_measurements()"""
+    _measurement_cache.clear()
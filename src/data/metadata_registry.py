@@ -0,0 +1,60 @@
+import os
+import pandas as pd
+
+# a process-wide registry of loaded config and metadata files:
+# (file path, name of the view) -> (modification time in ns, loaded object)
+_registry = {}
+
+
+def get_registered(file_path, name, loader):
+    """
+    Return an object loaded from a file, loading it on first use and again only
+    when the modification time of the file changes.
+    - inputs:
+        - file_path: a file path (string or Path)
+        - name: a name (string) of the view of the file, e.g. 'csv' or 'mapping'
+        - loader: a function which takes the file path and returns the object
+    - output: the loaded object, shared by all callers; do not modify it in place
+    """
+    key = (str(file_path), name)
+    mtime = os.stat(file_path).st_mtime_ns
+
+    entry = _registry.get(key)
+    if (entry is None) or (entry[0] != mtime):
+        entry = (mtime, loader(file_path))
+        _registry[key] = entry
+    return entry[1]
+
+
+def get_csv(file_path, **read_options):
+    """
+    Return a CSV file as a DataFrame from the registry.
+    - inputs:
+        - file_path: a file path (string or Path)
+        - read_options: keyword arguments of pd.read_csv()
+    - output: a DataFrame, shared by all callers; copy it before modifying it
+    """
+    name = 'csv' + repr(sorted(read_options.items()))
+    return get_registered(file_path, name, lambda path: pd.read_csv(path, **read_options))
+
+
+def get_mapping(file_path, key_column, value_column, **read_options):
+    """
+    Return a dictionary of two columns of a CSV file from the registry.
+    - inputs:
+        - file_path: a file path (string or Path)
+        - key_column: a column name (string) of the keys
+        - value_column: a column name (string) of the values
+        - read_options: keyword arguments of pd.read_csv()
+    - output: a dictionary, shared by all callers; do not modify it in place
+    """
+    def build_mapping(path):
+        df = get_csv(path, **read_options)
+        return dict(zip(df[key_column], df[value_column]))
+
+    return get_registered(file_path, f'mapping:{key_column}:{value_column}', build_mapping)
+
+
+def clear_registry():
+    """Drop all loaded files from the registry"""
+    _registry.clear()
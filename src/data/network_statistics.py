@@ -0,0 +1,248 @@
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from src.config import INDEX_CSV, NETWORK_STATISTICS_CSV, STATIONS_CSV
+from src.data.qa_flags import QA_INTEGRATED_ERRORS
+from src.data.source_apportionment_extraction import load_site_measurements
+from src.utils.logger_config import setup_logger
+
+logger = setup_logger('data.network_statistics', 'network_statistics.log')
+
+# relative accuracy of the quantiles estimated by the log-bucket sketch
+SKETCH_RELATIVE_ACCURACY = 0.01
+SKETCH_GAMMA = (1 + SKETCH_RELATIVE_ACCURACY) / (1 - SKETCH_RELATIVE_ACCURACY)
+
+percentiles = [5, 25, 50, 75, 95]
+
+# the columns returned by summarise_partials()
+statistic_columns = (['analyte', 'year', 'site_type', 'n', 'mean', 'std', 'min', 'max']
+                     + [f'p{p:02d}' for p in percentiles])
+
+# the index and site types loaded once and shared with worker processes
+_shared_index_df = None
+_shared_site_types = None
+
+
+def _init_worker(index_df, site_types):
+    """Keep the index DataFrame and site types passed from the parent process"""
+    global _shared_index_df, _shared_site_types
+    _shared_index_df = index_df
+    _shared_site_types = site_types
+
+
+def compute_partial(values):
+    """
+    Compute a partial aggregate of values which can be merged with others: the count,
+    sum, sum of squares, min, max, and a sketch of the distribution which counts
+    positive values in logarithmic buckets (bucket i holds values in (gamma^(i-1), gamma^i]).
+    - input: values: a numpy array of float
+    - output: a dictionary of the partial aggregate
+    """
+    values = values[~np.isnan(values)]
+    positive = values[values > 0]
+
+    keys = np.ceil(np.log(positive) / np.log(SKETCH_GAMMA)).astype(np.int64)
+    unique_keys, counts = np.unique(keys, return_counts=True)
+
+    return {
+        'count': len(values),
+        'sum': float(values.sum()),
+        'sumsq': float(np.square(values).sum()),
+        'min': float(values.min()) if len(values) > 0 else np.inf,
+        'max': float(values.max()) if len(values) > 0 else -np.inf,
+        'non_positive': int(len(values) - len(positive)),
+        'buckets': dict(zip(unique_keys.tolist(), counts.tolist()))
+    }
+
+
+def merge_partials(partial, other):
+    """
+    Merge a partial aggregate into another in place.
+    - inputs:
+        - partial: a dictionary returned by compute_partial(); updated in place
+        - other: a dictionary returned by compute_partial()
+    - output: partial
+    """
+    partial['count'] += other['count']
+    partial['sum'] += other['sum']
+    partial['sumsq'] += other['sumsq']
+    partial['min'] = min(partial['min'], other['min'])
+    partial['max'] = max(partial['max'], other['max'])
+    partial['non_positive'] += other['non_positive']
+    buckets = partial['buckets']
+    for key, count in other['buckets'].items():
+        buckets[key] = buckets.get(key, 0) + count
+    return partial
+
+
+def merge_partial_dicts(accumulated, partials):
+    """
+    Merge a dictionary of partial aggregates by key into an accumulated dictionary in place.
+    - inputs:
+        - accumulated: a dictionary of key and partial aggregate; updated in place
+        - partials: a dictionary of key and partial aggregate
+    """
+    for key, partial in partials.items():
+        if key in accumulated:
+            merge_partials(accumulated[key], partial)
+        else:
+            accumulated[key] = partial
+
+
+def estimate_quantiles(partial, quantiles):
+    """
+    Estimate quantiles from the sketch of a partial aggregate, within the relative
+    accuracy SKETCH_RELATIVE_ACCURACY. Non-positive values are estimated as 0.
+    - inputs:
+        - partial: a dictionary returned by compute_partial() or merge_partials()
+        - quantiles: a list of quantiles (float) between 0 and 1
+    - output: a numpy array of the estimates
+    """
+    if partial['count'] == 0:
+        return np.full(len(quantiles), np.nan)
+
+    keys = np.array(sorted(partial['buckets']), dtype=np.int64)
+    counts = np.array([partial['buckets'][key] for key in keys], dtype=np.int64)
+    cumulative_counts = partial['non_positive'] + np.cumsum(counts)
+
+    ranks = np.asarray(quantiles) * (partial['count'] - 1)
+    positions = np.searchsorted(cumulative_counts, ranks, side='right')
+    in_buckets = ranks >= partial['non_positive']
+
+    # the midpoint (in relative terms) of each bucket, clipped to the observed range
+    estimates = 2 * SKETCH_GAMMA ** keys[np.minimum(positions, len(keys) - 1)] / (SKETCH_GAMMA + 1) \
+        if len(keys) > 0 else np.zeros(len(ranks))
+    estimates = np.clip(estimates, partial['min'], partial['max'])
+    return np.where(in_buckets, estimates, 0.0)
+
+
+def compute_file_partials(task):
+    """
+    Compute partial aggregates of every analyte in a processed file (a site and year).
+    - input: task: a tuple of (site_id, year, instrument, analyte_type)
+    - output: a dictionary with (analyte, year, site_type) as keys and partial aggregates as values
+    """
+    site_id, year, instrument, analyte_type = task
+    index_df = _shared_index_df if _shared_index_df is not None else pd.read_csv(INDEX_CSV)
+    site_types = _shared_site_types if _shared_site_types is not None else {}
+
+    file_index_df = index_df[(index_df['site_id'] == site_id) & (index_df['year'] == year)]
+    long_df = load_site_measurements(site_id, instrument, analyte_type, flags=QA_INTEGRATED_ERRORS,
+                                     index_df=file_index_df)
+
+    site_type = site_types.get(site_id, 'unknown')
+    partials = {}
+    for analyte, analyte_df in long_df.groupby('analyte', sort=False):
+        partials[(analyte, year, site_type)] = compute_partial(analyte_df['value'].to_numpy(dtype=float))
+    return partials
+
+
+def summarise_partials(partials):
+    """
+    Convert merged partial aggregates into statistics.
+    - input: partials: a dictionary with (analyte, year, site_type) as keys
+    - output: a DataFrame with a row for each key (empty with the statistic columns if no keys)
+    """
+    rows = []
+    for (analyte, year, site_type), partial in partials.items():
+        n = partial['count']
+        mean = partial['sum'] / n if n > 0 else np.nan
+        variance = (partial['sumsq'] - n * mean ** 2) / (n - 1) if n > 1 else np.nan
+        row = {'analyte': analyte, 'year': year, 'site_type': site_type, 'n': n, 'mean': mean,
+               'std': np.sqrt(max(variance, 0)) if n > 1 else np.nan,
+               'min': partial['min'] if n > 0 else np.nan, 'max': partial['max'] if n > 0 else np.nan}
+        estimates = estimate_quantiles(partial, [p / 100 for p in percentiles])
+        row.update({f'p{p:02d}': estimate for p, estimate in zip(percentiles, estimates)})
+        rows.append(row)
+
+    stats_df = pd.DataFrame(rows, columns=statistic_columns)
+    return stats_df.sort_values(['analyte', 'site_type', 'year']).reset_index(drop=True)
+
+
+def save_network_statistics(stats_df):
+    """
+    Merge statistics into NETWORK_STATISTICS_CSV, replacing the rows of the same analyte type,
+    analyte, year, and site type, so the statistics of other analyte types and years are kept.
+    - input: stats_df: a DataFrame returned by summarise_partials() with an 'analyte_type' column
+    """
+    keys = ['analyte_type', 'analyte', 'year', 'site_type']
+    if NETWORK_STATISTICS_CSV.exists():
+        saved_df = pd.read_csv(NETWORK_STATISTICS_CSV)
+        replaced = saved_df.set_index(keys).index.isin(stats_df.set_index(keys).index)
+        stats_df = pd.concat([saved_df[~replaced], stats_df], ignore_index=True)
+    stats_df = stats_df.sort_values(['analyte_type', 'analyte', 'site_type', 'year'])
+    stats_df.to_csv(NETWORK_STATISTICS_CSV, index=False)
+
+
+def compute_network_statistics(instrument='ICPMS', analyte_type='NT', years=None, processes=None):
+    """
+    Compute national distributions of every analyte by year and site type. Each processed
+    file is reduced to partial aggregates in a worker process, and the partials are merged
+    as they arrive, so the memory is bounded by the sketch size rather than the data volume.
+    The statistics of all site types are also given with site_type 'all'.
+    - inputs:
+        - instrument: Optional. 'ICPMS' (default) or 'IC'
+        - analyte_type: Optional. 'NT' (default), 'WS', or 'total' for ions
+        - years: Optional. a list of years (int); all years in the index by default
+        - processes: Optional. the number of worker processes (int); CPU count by default
+    - output: stats_df: a DataFrame of the statistics (also merged into NETWORK_STATISTICS_CSV,
+        see save_network_statistics())
+    """
+    index_df = pd.read_csv(INDEX_CSV)
+    stations_df = pd.read_csv(STATIONS_CSV, encoding='utf-8')
+    site_types = dict(zip(stations_df['site_id'], stations_df['site_type'].fillna('unknown')))
+
+    task_df = index_df[(index_df['instrument'] == instrument) & (index_df['analyte_type'] == analyte_type)]
+    if years is not None:
+        task_df = task_df[task_df['year'].isin(years)]
+    task_df = task_df[['site_id', 'year']].drop_duplicates()
+    tasks = [(site_id, year, instrument, analyte_type) for site_id, year in task_df.itertuples(index=False)]
+
+    logger.info(f'Start computing network statistics of {instrument} {analyte_type} over {len(tasks)} files')
+
+    merged = {}
+    with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker,
+                             initargs=(index_df, site_types)) as executor:
+        for partials in executor.map(compute_file_partials, tasks, chunksize=8):
+            merge_partial_dicts(merged, partials)
+
+    # the network as a whole, merged over site types
+    merged_all = {}
+    for (analyte, year, _), partial in merged.items():
+        merge_partial_dicts(merged_all, {(analyte, year, 'all'): dict(partial, buckets=dict(partial['buckets']))})
+    merged.update(merged_all)
+
+    stats_df = summarise_partials(merged)
+    stats_df.insert(0, 'analyte_type', analyte_type)
+    if len(stats_df) == 0:
+        logger.warning(f'No processed {instrument} {analyte_type} files found; no statistics saved')
+        return stats_df
+    save_network_statistics(stats_df)
+
+    logger.info(f'Completed network statistics of {stats_df["analyte"].nunique()} analytes')
+    return stats_df
+
+
+def compute_trends(stats_df, statistic='p50'):
+    """
+    Compute the linear trend of a statistic over years for every analyte and site type,
+    with the slope from grouped sums (ordinary least squares).
+    - inputs:
+        - stats_df: a DataFrame returned by compute_network_statistics()
+        - statistic: Optional. a column (string) of stats_df, e.g. 'mean' or 'p95'; 'p50' by default
+    - output: a DataFrame with columns of 'analyte', 'site_type', 'n_years', 'slope_per_year',
+        and 'percent_per_year' (the slope relative to the average of the statistic)
+    """
+    df = stats_df.dropna(subset=[statistic])
+    x = df['year'].to_numpy(dtype=float)
+    y = df[statistic].to_numpy(dtype=float)
+    df = df[['analyte', 'site_type']].assign(x=x, y=y, xx=x * x, xy=x * y)
+
+    sums = df.groupby(['analyte', 'site_type']).agg(
+        n_years=('x', 'size'), sx=('x', 'sum'), sy=('y', 'sum'), sxx=('xx', 'sum'), sxy=('xy', 'sum')).reset_index()
+
+    n = sums['n_years'].to_numpy(dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sums['slope_per_year'] = (sums['sxy'] - sums['sx'] * sums['sy'] / n) / (sums['sxx'] - sums['sx'] ** 2 / n)
+        sums['percent_per_year'] = sums['slope_per_year'] / (sums['sy'] / n) * 100
+    return sums[['analyte', 'site_type', 'n_years', 'slope_per_year', 'percent_per_year']]
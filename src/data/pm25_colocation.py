@@ -0,0 +1,255 @@
+import numpy as np
+import pandas as pd
+from src.config import PROCESSED_DIR
+from src.data.continuous_pm25_grid import get_available_sites
+from src.data.continuous_pm25_operation import get_continuous_pm25_data
+from src.data.file_operation import get_processed_file_path
+from src.data.index_query import get_metadata
+from src.data.qa_flags import QA_INTEGRATED_ERRORS, get_qa_mask
+from src.data.station_spatial_index import get_nearest_sites
+from src.data.text_transforms import get_column_unit, unit_factors
+from src.utils.logger_config import setup_logger
+
+logger = setup_logger('data.pm25_colocation', 'source_apportionment_extraction.log')
+
+PM25_COLOCATION_CSV = str(PROCESSED_DIR) + '/pm25_colocation.csv'
+PM25_COLOCATION_SUMMARY_CSV = str(PROCESSED_DIR) + '/pm25_colocation_summary.csv'
+
+# the analyte type whose PM2.5 is used when a sample appears in both NT and WS rows, first preferred
+analyte_type_preference = {'NT': 0, 'WS': 1}
+
+# columns read from the processed ICPMS files
+integrated_columns = {'sampling_date', 'analyte_type', 'sampling_type', 'Media',
+                      'PM2.5', 'PM2.5-QA', 'PM2.5-MDL', 'PM2.5-Vflag', 'Start Time', 'End Time'}
+
+
+def parse_time_of_day(times):
+    """
+    Parse times of day (e.g. '10:00', '10:00:00', or '2012-01-01 10:00:00') into Timedelta.
+    - input: times: a Series of times
+    - output: a Series of Timedelta (NaT if a time cannot be parsed)
+    """
+    text = times.astype(str).str.strip().str.extract(r'(\d{1,2}:\d{2}(?::\d{2})?)$')[0]
+    text = text.where(text.str.count(':') != 1, text + ':00')
+    return pd.to_timedelta(text, errors='coerce')
+
+
+def get_sampling_windows(df):
+    """
+    Return the start and end of the sampling window of every integrated sample, using
+    the Start Time and End Time columns where they exist. Otherwise a sample is taken
+    from midnight to midnight of the sampling date.
+    - input: df: a DataFrame of a processed ICPMS file
+    - outputs:
+        - starts: a Series of the start timestamps
+        - ends: a Series of the end timestamps (exclusive)
+    """
+    dates = pd.to_datetime(df['sampling_date'], format='mixed').dt.normalize()
+    starts = dates
+    ends = dates + pd.Timedelta(days=1)
+
+    if ('Start Time' in df.columns) and ('End Time' in df.columns):
+        start_times = parse_time_of_day(df['Start Time'])
+        end_times = parse_time_of_day(df['End Time'])
+        has_times = (start_times.notna() & end_times.notna()).to_numpy()
+
+        exact_starts = dates + start_times
+        exact_ends = dates + end_times
+        # a window ending at or before its start ends on the next day
+        exact_ends = exact_ends.where(exact_ends > exact_starts, exact_ends + pd.Timedelta(days=1))
+
+        starts = starts.where(~has_times, exact_starts)
+        ends = ends.where(~has_times, exact_ends)
+
+    return starts, ends
+
+
+def load_integrated_pm25(sites=None, index_df=None):
+    """
+    Load valid filter-based (integrated) PM2.5 samples with their sampling windows.
+    A sample is counted once even if it appears in both NT and WS rows; the NT row is used.
+    - inputs:
+        - sites: Optional. a list of NAPS site IDs (int); all ICPMS sites in the index by default
+        - index_df: Optional. a loaded index DataFrame to avoid reading INDEX_CSV
+    - output: a DataFrame with columns of 'site_id', 'sampling_date', 'start', 'end',
+        and 'integrated_pm25' in ug/m3 (the unit of continuous PM2.5)
+    """
+    meta_df = get_metadata(site_ids=sites, instrument='ICPMS', index_df=index_df)
+    site_years = meta_df[['site_id', 'year']].drop_duplicates().sort_values(['site_id', 'year'])
+
+    # integrated PM2.5 is stored in the canonical unit (ng/m3)
+    to_ug = unit_factors[get_column_unit('ICPMS', 'PM2.5')] / unit_factors['ug/m3']
+
+    sample_dfs = []
+    for site_id, year in site_years.itertuples(index=False):
+        file_df = pd.read_csv(get_processed_file_path(year, site_id, 'ICPMS'),
+                              usecols=lambda col: col in integrated_columns)
+        if 'PM2.5' not in file_df.columns:
+            continue
+
+        file_df = file_df[(get_qa_mask(file_df, 'PM2.5') & QA_INTEGRATED_ERRORS) == 0]
+        # the NT row of a date is kept, and the WS row only where the date has no NT row
+        preference = file_df['analyte_type'].map(analyte_type_preference).fillna(len(analyte_type_preference))
+        file_df = file_df.iloc[np.argsort(preference.to_numpy(), kind='stable')]
+        file_df = file_df.drop_duplicates('sampling_date', keep='first').sort_index()
+        starts, ends = get_sampling_windows(file_df)
+
+        sample_dfs.append(pd.DataFrame({
+            'site_id': site_id,
+            'sampling_date': starts.dt.normalize().to_numpy(),
+            'start': starts.to_numpy(),
+            'end': ends.to_numpy(),
+            'integrated_pm25': pd.to_numeric(file_df['PM2.5'], errors='coerce').to_numpy() * to_ug
+        }))
+
+    if len(sample_dfs) == 0:
+        return pd.DataFrame(columns=['site_id', 'sampling_date', 'start', 'end', 'integrated_pm25'])
+    return pd.concat(sample_dfs, ignore_index=True)
+
+
+def get_colocation_pairs(integrated_sites, continuous_sites=None, max_distance_km=25.0):
+    """
+    Pair each integrated PM2.5 site with a continuous PM2.5 site: the same site if it
+    measures both (co-located), otherwise the nearest continuous site within a distance.
+    - inputs:
+        - integrated_sites: a list of NAPS site IDs (int) with integrated PM2.5
+        - continuous_sites: Optional. a list of site IDs (int) with continuous PM2.5;
+            all sites with continuous data by default
+        - max_distance_km: Optional. the maximum distance (float) of a nearest pair; 25 km by default
+    - output: a DataFrame with columns of 'site_id', 'continuous_site_id', 'pair_type', and 'distance_km'
+    """
+    if continuous_sites is None:
+        continuous_sites = get_available_sites()
+
+    is_colocated = np.isin(integrated_sites, continuous_sites)
+    colocated_df = pd.DataFrame({'site_id': np.asarray(integrated_sites)[is_colocated]})
+    colocated_df['continuous_site_id'] = colocated_df['site_id']
+    colocated_df['pair_type'] = 'co-located'
+    colocated_df['distance_km'] = 0.0
+
+    if not (~is_colocated).any():
+        return colocated_df.sort_values('site_id').reset_index(drop=True)
+
+    nearest_df = get_nearest_sites(np.asarray(integrated_sites)[~is_colocated], k=1,
+                                   candidates=continuous_sites)
+    nearest_df = nearest_df[nearest_df['distance_km'] <= max_distance_km]
+    nearest_df = nearest_df.rename(columns={'nearest_site_id': 'continuous_site_id'})
+    nearest_df['pair_type'] = 'nearest'
+
+    pairs_df = pd.concat([colocated_df, nearest_df[colocated_df.columns]], ignore_index=True)
+    return pairs_df.sort_values('site_id').reset_index(drop=True)
+
+
+def compute_window_means(hourly_df, starts, ends):
+    """
+    Average hourly PM2.5 over sampling windows with cumulative sums, so every window is
+    computed with two binary searches. Hours are labelled by their start.
+    - inputs:
+        - hourly_df: a DataFrame of hourly PM2.5 indexed by sampling_date
+        - starts: a numpy array of window starts (datetime64)
+        - ends: a numpy array of window ends (datetime64, exclusive)
+    - outputs:
+        - means: a numpy array of the mean of valid hours in each window
+        - valid_hours: a numpy array (int) of the number of valid hours in each window
+    """
+    hourly_df = hourly_df.sort_index()
+    times = hourly_df.index.to_numpy()
+    values = hourly_df['PM2.5'].to_numpy(dtype=np.float64)
+
+    # NaN and negative values are counted as an error
+    valid = values >= 0
+    cumulative_sums = np.concatenate([[0.0], np.cumsum(np.where(valid, values, 0.0))])
+    cumulative_counts = np.concatenate([[0], np.cumsum(valid)])
+
+    left = np.searchsorted(times, np.asarray(starts, dtype='datetime64[ns]'), side='left')
+    right = np.searchsorted(times, np.asarray(ends, dtype='datetime64[ns]'), side='left')
+
+    valid_hours = cumulative_counts[right] - cumulative_counts[left]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        means = np.where(valid_hours > 0, (cumulative_sums[right] - cumulative_sums[left]) / valid_hours, np.nan)
+    return means, valid_hours
+
+
+def join_integrated_continuous(sites=None, max_distance_km=25.0, min_valid_hours=18, index_df=None):
+    """
+    Align integrated 24-hour PM2.5 samples with continuous hourly PM2.5 of the paired
+    site for all sites in one run. Each continuous site is loaded once.
+    - inputs:
+        - sites: Optional. a list of NAPS site IDs (int); all ICPMS sites in the index by default
+        - max_distance_km: Optional. the maximum distance (float) of a nearest pair; 25 km by default
+        - min_valid_hours: Optional. the minimum number of valid hours (int) in a window; 18 by default
+        - index_df: Optional. a loaded index DataFrame to avoid reading INDEX_CSV
+    - output: a DataFrame of the paired samples with the ratio of integrated to continuous PM2.5
+    """
+    integrated_df = load_integrated_pm25(sites, index_df)
+    pairs_df = get_colocation_pairs(integrated_df['site_id'].unique(), max_distance_km=max_distance_km)
+    joined_df = integrated_df.merge(pairs_df, on='site_id')
+
+    joined_dfs = []
+    for continuous_site_id, pair_df in joined_df.groupby('continuous_site_id'):
+        hourly_df = get_continuous_pm25_data(continuous_site_id, 'all')
+        means, valid_hours = compute_window_means(hourly_df, pair_df['start'].to_numpy(), pair_df['end'].to_numpy())
+        joined_dfs.append(pair_df.assign(continuous_pm25=means, valid_hours=valid_hours))
+
+    if len(joined_dfs) == 0:
+        return joined_df.assign(continuous_pm25=pd.Series(dtype=float), valid_hours=pd.Series(dtype=int),
+                                ratio=pd.Series(dtype=float))
+
+    joined_df = pd.concat(joined_dfs, ignore_index=True)
+    joined_df = joined_df[joined_df['valid_hours'] >= min_valid_hours].copy()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        joined_df['ratio'] = joined_df['integrated_pm25'] / joined_df['continuous_pm25']
+    joined_df.loc[~np.isfinite(joined_df['ratio']), 'ratio'] = np.nan
+
+    logger.info(f'Joined {len(joined_df)} integrated samples with continuous PM2.5 of {len(joined_dfs)} sites')
+    return joined_df.sort_values(['site_id', 'sampling_date']).reset_index(drop=True)
+
+
+def summarise_colocation(joined_df):
+    """
+    Compute ratios and the ordinary least squares regression (integrated = slope x continuous
+    + intercept) of every site pair from grouped sums.
+    - input: joined_df: a DataFrame returned by join_integrated_continuous()
+    - output: a DataFrame with a row for each site pair
+    """
+    keys = ['site_id', 'continuous_site_id', 'pair_type', 'distance_km']
+    df = joined_df.dropna(subset=['integrated_pm25', 'continuous_pm25'])
+    x = df['continuous_pm25'].to_numpy(dtype=float)
+    y = df['integrated_pm25'].to_numpy(dtype=float)
+    df = df[keys + ['ratio']].assign(x=x, y=y, xx=x * x, yy=y * y, xy=x * y)
+
+    sums = df.groupby(keys).agg(
+        n=('x', 'size'), sx=('x', 'sum'), sy=('y', 'sum'), sxx=('xx', 'sum'), syy=('yy', 'sum'),
+        sxy=('xy', 'sum'), mean_ratio=('ratio', 'mean'), median_ratio=('ratio', 'median')).reset_index()
+
+    n = sums['n'].to_numpy(dtype=float)
+    cov_xy = sums['sxy'] - sums['sx'] * sums['sy'] / n
+    var_x = sums['sxx'] - sums['sx'] ** 2 / n
+    var_y = sums['syy'] - sums['sy'] ** 2 / n
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sums['slope'] = cov_xy / var_x
+        sums['intercept'] = (sums['sy'] - sums['slope'] * sums['sx']) / n
+        sums['r'] = cov_xy / np.sqrt(var_x * var_y)
+    sums['r_squared'] = sums['r'] ** 2
+    sums['mean_integrated'] = sums['sy'] / n
+    sums['mean_continuous'] = sums['sx'] / n
+
+    return sums[keys + ['n', 'mean_integrated', 'mean_continuous', 'mean_ratio', 'median_ratio',
+                        'slope', 'intercept', 'r', 'r_squared']]
+
+
+def create_colocation_files(sites=None, max_distance_km=25.0, min_valid_hours=18):
+    """
+    Join integrated and continuous PM2.5 for all sites and save the paired samples
+    (PM25_COLOCATION_CSV) and the statistics of each pair (PM25_COLOCATION_SUMMARY_CSV).
+    - inputs: see join_integrated_continuous()
+    - outputs:
+        - joined_df: a DataFrame of the paired samples
+        - summary_df: a DataFrame of the statistics of each site pair
+    """
+    joined_df = join_integrated_continuous(sites, max_distance_km, min_valid_hours)
+    summary_df = summarise_colocation(joined_df)
+
+    joined_df.to_csv(PM25_COLOCATION_CSV, index=False)
+    summary_df.to_csv(PM25_COLOCATION_SUMMARY_CSV, index=False)
+    return joined_df, summary_df
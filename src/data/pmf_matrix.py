@@ -0,0 +1,158 @@
+import numpy as np
+import pandas as pd
+from src.config import ABBREVIATION_CSV, INDEX_CSV, INTEGRATED_PM25_DIR, UNITS_CSV
+from src.data.qa_flags import QA_BLANK, QA_NYLON, QA_MISSING
+from src.data.source_apportionment_extraction import create_dir_for_pmf, load_site_measurements
+from src.utils.disk_cache import disk_cache
+from src.utils.instrumentation import instrumented
+from src.utils.logger_config import setup_logger
+
+logger = setup_logger('data.pmf_matrix', 'source_apportionment_extraction.log')
+
+# below-MDL and non-positive values are kept for substitution in the matrices
+QA_MATRIX_EXCLUDED = QA_BLANK | QA_NYLON | QA_MISSING
+
+# species groups in the matrices: (column prefix, instrument, analyte_type, analytes)
+species_groups = [
+    ('', 'ICPMS', 'NT', ['PM2.5']),
+    ('NT_', 'ICPMS', 'NT', None),
+    ('ion_', 'IC', 'total', None)
+]
+
+
+def calculate_uncertainty(conc, mdl, error_fraction=0.1):
+    """
+    Return uncertainties of concentrations based on MDL (EPA PMF 5.0 User Guide).
+    Below MDL (conc < MDL, or conc <= 0, as in build_pmf_matrices()): 5/6 * MDL. Otherwise: sqrt((error_fraction * conc)^2 + (0.5 * MDL)^2).
+    - inputs:
+        - conc: a numpy array of concentrations
+        - mdl: a numpy array of MDL; NaN when MDL was not reported
+        - error_fraction: Optional. error fraction (float); 0.1 by default
+    - output: unc: a numpy array of uncertainties
+    """
+    mdl_or_zero = np.nan_to_num(mdl, nan=0.0)
+    unc = np.sqrt((error_fraction * conc) ** 2 + (0.5 * mdl_or_zero) ** 2)
+    return np.where((conc <= 0) | (conc < mdl_or_zero), 5 / 6 * mdl_or_zero, unc)
+
+
+def load_species_long_df(target_site_id, index_df=None):
+    """
+    Load PM2.5, Near Total metals, and ions of a site into one long-format DataFrame
+    with a 'species' column named after the per-analyte files (e.g. 'NT_lead', 'ion_nitrate').
+    - inputs:
+        - target_site_id: NAPS site ID (int)
+        - index_df: Optional. a loaded index DataFrame to avoid reading INDEX_CSV
+    - output: a DataFrame with columns of 'year', 'sampling_date', 'species', 'analyte', 
+        'analyte_type', 'value', and 'mdl'
+    """
+    long_dfs = []
+    for prefix, instrument, analyte_type, analytes in species_groups:
+        long_df = load_site_measurements(target_site_id, instrument, analyte_type, analytes,
+                                         flags=QA_MATRIX_EXCLUDED, index_df=index_df)
+        long_df['species'] = prefix + long_df['analyte']
+        long_df['analyte_type'] = analyte_type
+        long_dfs.append(long_df[['year', 'sampling_date', 'species', 'analyte', 'analyte_type', 'value', 'mdl']])
+
+    species_long_df = pd.concat(long_dfs, ignore_index=True)
+    species_long_df['sampling_date'] = pd.to_datetime(
+        species_long_df['sampling_date'], format='mixed').dt.normalize()
+    return species_long_df
+
+
+def get_pmf_inputs(target_site_id, **_):
+    """Return the files read by build_pmf_matrices() for a site"""
+    return [INDEX_CSV, ABBREVIATION_CSV, UNITS_CSV, str(INTEGRATED_PM25_DIR) + f'/*_{target_site_id}.csv', 
+            str(INTEGRATED_PM25_DIR) + f'/*_{target_site_id}_IC.csv']
+
+
+# measured outside the cache, so the calls answered from the cache are included
+@instrumented(target=lambda target_site_id, **_: target_site_id, rows=lambda result: len(result[0]))
+@disk_cache(inputs=get_pmf_inputs)
+def build_pmf_matrices(target_site_id, error_fraction=0.1, index_df=None):
+    """
+    Build a date-aligned concentration matrix (samples x species) and a matching
+    uncertainty matrix for a site.
+    - Values below MDL (or <= 0) are replaced with MDL / 2, and their uncertainties are 5/6 * MDL.
+    - Missing values are replaced with the species median, and their uncertainties
+        are 4 times the median.
+    - inputs:
+        - target_site_id: NAPS site ID (int)
+        - error_fraction: Optional. error fraction (float) for the uncertainty; 0.1 by default
+        - index_df: Optional. a loaded index DataFrame to avoid reading INDEX_CSV
+    - outputs:
+        - conc_df: a DataFrame of concentrations indexed by sampling date
+        - unc_df: a DataFrame of uncertainties indexed by sampling date
+    """
+    long_df = load_species_long_df(target_site_id, index_df)
+
+    conc = long_df['value'].to_numpy(dtype=float)
+    mdl = long_df['mdl'].to_numpy(dtype=float)
+
+    # non-positive values without MDL cannot be substituted, so treat them as missing
+    below_mdl = (conc <= 0) | (conc < mdl)
+    no_substitute = below_mdl & np.isnan(mdl)
+    below_mdl = below_mdl & ~no_substitute
+
+    long_df['conc'] = np.where(below_mdl, mdl / 2, np.where(no_substitute, np.nan, conc))
+    long_df['unc'] = np.where(below_mdl, 5 / 6 * mdl, calculate_uncertainty(conc, mdl, error_fraction))
+    long_df = long_df.dropna(subset=['conc'])
+
+    # average duplicated samples on the same date
+    conc_df = long_df.pivot_table(index='sampling_date', columns='species', values='conc', aggfunc='mean')
+    unc_df = long_df.pivot_table(index='sampling_date', columns='species', values='unc', aggfunc='mean')
+
+    species = long_df['species'].unique().tolist()
+    conc_df = conc_df.reindex(columns=species)
+    unc_df = unc_df.reindex(index=conc_df.index, columns=species)
+
+    # missing values: the species median and 4 times the median as the uncertainty
+    medians = conc_df.median()
+    missing = conc_df.isna().to_numpy()
+    conc_df = conc_df.fillna(medians)
+    unc_df = unc_df.mask(missing, np.broadcast_to(4 * medians.to_numpy(), unc_df.shape))
+
+    conc_df.index.name = 'sampling_date'
+    unc_df.index.name = 'sampling_date'
+    return conc_df, unc_df
+
+
+def write_pmf_matrices(target_site_id, conc_df, unc_df, file_format='xlsx'):
+    """
+    Save the concentration and uncertainty matrices in the layout used by PMF software.
+    - inputs:
+        - target_site_id: NAPS site ID (int)
+        - conc_df: a DataFrame of concentrations returned by build_pmf_matrices()
+        - unc_df: a DataFrame of uncertainties returned by build_pmf_matrices()
+        - file_format: Optional. 'xlsx' (one workbook with two sheets), 'csv' (two files), or 'both'
+    - output: (saving files into the PMF directory of the site)
+    """
+    pmf_dir = create_dir_for_pmf(target_site_id)
+
+    if file_format in ['csv', 'both']:
+        conc_df.to_csv(pmf_dir + '/PMF_concentration.csv')
+        unc_df.to_csv(pmf_dir + '/PMF_uncertainty.csv')
+
+    if file_format in ['xlsx', 'both']:
+        with pd.ExcelWriter(pmf_dir + '/PMF_input.xlsx', engine='openpyxl') as writer:
+            conc_df.to_excel(writer, sheet_name='concentration')
+            unc_df.to_excel(writer, sheet_name='uncertainty')
+
+    logger.info(f'PMF matrices for site {target_site_id}: {conc_df.shape[0]} samples x {conc_df.shape[1]} species')
+
+
+@instrumented(target=lambda target_site_id, **_: target_site_id)
+def create_pmf_matrix_files(target_site_id, file_format='xlsx', error_fraction=0.1, index_df=None):
+    """
+    Build and save the concentration and uncertainty matrices for a specified site.
+    - inputs:
+        - target_site_id: NAPS site ID (int)
+        - file_format: Optional. 'xlsx', 'csv', or 'both'
+        - error_fraction: Optional. error fraction (float) for the uncertainty; 0.1 by default
+        - index_df: Optional. a loaded index DataFrame to avoid reading INDEX_CSV
+    - outputs:
+        - conc_df: a DataFrame of concentrations
+        - unc_df: a DataFrame of uncertainties
+    """
+    conc_df, unc_df = build_pmf_matrices(target_site_id, error_fraction, index_df)
+    write_pmf_matrices(target_site_id, conc_df, unc_df, file_format)
+    return conc_df, unc_df
@@ -0,0 +1,119 @@
+import numpy as np
+import pandas as pd
+from src.data.text_transforms import get_abbreviation_dict
+
+# bits of the QA mask stored for each measurement (the '-QA' columns)
+QA_BLANK = 1          # Field Blank or Travel Blank
+QA_NYLON = 2          # measured with a Nylon filtre
+QA_MISSING = 4        # empty value
+QA_NON_POSITIVE = 8   # value <= 0
+QA_BELOW_MDL = 16     # value < MDL
+QA_VFLAG = 32         # a validation flag is reported
+
+# measurements with any of these bits are excluded as errors in integrated data
+QA_INTEGRATED_ERRORS = QA_BLANK | QA_NYLON | QA_MISSING | QA_NON_POSITIVE
+
+
+def get_QA_col_name(analyte):
+    """Return a QA column name for a specified analyte"""
+    abb_dict = get_abbreviation_dict()
+    return abb_dict.get(analyte, analyte) + '-QA'
+
+
+def get_vflag_col_name(df, analyte):
+    """
+    Return a validation flag column name for a specified analyte,
+    or None if the DataFrame has no such column ('-VFlag' or '-Vflag').
+    """
+    abb_dict = get_abbreviation_dict()
+    abb = abb_dict.get(analyte, analyte)
+    for suffix in ['-VFlag', '-Vflag']:
+        if abb + suffix in df.columns:
+            return abb + suffix
+    return None
+
+
+def compute_qa_masks(df, analytes):
+    """
+    Compute the QA bitmask of every measurement of the analytes at once.
+    - inputs:
+        - df: a DataFrame of extracted (renamed and unit-normalised) data
+        - analytes: a list of full names (string) of analytes in df
+    - output: masks: a 2D numpy array (uint8) of shape (number of rows, number of analytes)
+    """
+    abb_dict = get_abbreviation_dict()
+    n_rows = len(df)
+
+    values = df[analytes].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float)
+
+    # MDL columns do not exist in some data (e.g. PM2.5 in 2003 - 2009); treat them as NaN
+    mdls = np.full((n_rows, len(analytes)), np.nan)
+    vflags = np.zeros((n_rows, len(analytes)), dtype=bool)
+    for i, analyte in enumerate(analytes):
+        mdl_col = abb_dict.get(analyte, analyte) + '-MDL'
+        if mdl_col in df.columns:
+            mdls[:, i] = pd.to_numeric(df[mdl_col], errors='coerce').to_numpy(dtype=float)
+        vflag_col = get_vflag_col_name(df, analyte)
+        if vflag_col is not None:
+            vflags[:, i] = df[vflag_col].notna().to_numpy() & (df[vflag_col].astype(str).str.strip() != '').to_numpy()
+
+    # flags for a whole row (sample) are broadcast to all analytes
+    row_flags = np.zeros(n_rows, dtype=np.uint8)
+    if 'sampling_type' in df.columns:
+        row_flags |= (df['sampling_type'].to_numpy() != 'R') * np.uint8(QA_BLANK)
+    if 'Media' in df.columns:
+        row_flags |= (df['Media'].to_numpy() != 'T') * np.uint8(QA_NYLON)
+
+    masks = np.broadcast_to(row_flags[:, None], values.shape).copy()
+
+    # comparisons with NaN are False, so missing values are flagged only as QA_MISSING
+    with np.errstate(invalid='ignore'):
+        masks |= np.isnan(values) * np.uint8(QA_MISSING)
+        masks |= (values <= 0) * np.uint8(QA_NON_POSITIVE)
+        masks |= (values < mdls) * np.uint8(QA_BELOW_MDL)
+    masks |= vflags * np.uint8(QA_VFLAG)
+    return masks
+
+
+def add_qa_columns(df):
+    """
+    Add a QA bitmask column ('<abbreviation>-QA') for every analyte in a DataFrame.
+    - input: df: a DataFrame of extracted (renamed and unit-normalised) data
+    - output: df: a DataFrame with the QA columns
+    """
+    abb_dict = get_abbreviation_dict()
+    analytes = [col for col in df.columns if col in abb_dict]
+
+    if len(analytes) > 0:
+        masks = compute_qa_masks(df, analytes)
+        qa_cols = [abb_dict[analyte] + '-QA' for analyte in analytes]
+        df = df.drop(columns=qa_cols, errors='ignore')
+        df = pd.concat([df, pd.DataFrame(masks, columns=qa_cols, index=df.index)], axis=1)
+    return df
+
+
+def get_qa_mask(df, analyte):
+    """
+    Return the QA bitmask of an analyte. The mask is computed on the fly for
+    the files extracted without QA columns.
+    - inputs:
+        - df: a DataFrame
+        - analyte: a full name of analyte (string)
+    - output: a numpy array (uint8) of the QA bitmask
+    """
+    qa_col = get_QA_col_name(analyte)
+    if qa_col in df.columns:
+        return df[qa_col].to_numpy().astype(np.uint8)
+    return compute_qa_masks(df, [analyte])[:, 0]
+
+
+def omit_flagged_measurements(df, analyte, flags=QA_INTEGRATED_ERRORS):
+    """
+    Return a DataFrame which excludes measurements with any of the specified QA flags.
+    - inputs:
+        - df: a DataFrame
+        - analyte: a full name of analyte (string)
+        - flags: Optional. a combination of QA bits (int); errors in integrated data by default
+    - output: a DataFrame without flagged measurements
+    """
+    return df[(get_qa_mask(df, analyte) & flags) == 0]
@@ -0,0 +1,162 @@
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from src.config import INDEX_CSV, SPECIES_SCREENING_CSV
+from src.data.pmf_matrix import calculate_uncertainty, load_species_long_df
+from src.utils.logger_config import setup_logger
+
+logger = setup_logger('data.species_screening', 'source_apportionment_extraction.log')
+
+# S/N thresholds for the categories of species in PMF (EPA PMF 5.0 User Guide)
+sn_categories = {'strong': 1.0, 'weak': 0.5}
+
+screening_columns = [
+    'site_id', 'species', 'analyte', 'analyte_type', 'n_samples', 'pct_below_mdl',
+    'signal_to_noise', 'completeness', 'median_conc', 'category', 'rank', 'error'
+]
+
+# the index loaded once and shared with worker processes
+_shared_index_df = None
+
+
+def _init_worker(index_df):
+    """Keep the index DataFrame passed from the parent process"""
+    global _shared_index_df
+    _shared_index_df = index_df
+
+
+def get_expected_samples(index_df, site_id):
+    """
+    Return the number of samples expected from the sampling frequency for each
+    year and analyte type of a site.
+    - inputs:
+        - index_df: a DataFrame of the index CSV
+        - site_id: NAPS site ID (int)
+    - output: a DataFrame with columns of 'year', 'analyte_type', and 'expected_samples'
+    """
+    freq_df = index_df.loc[index_df['site_id'] == site_id, ['year', 'analyte_type', 'frequency']]
+    freq_df = freq_df.drop_duplicates(['year', 'analyte_type']).copy()
+
+    days_in_year = np.where(pd.to_datetime(freq_df['year'].astype(str)).dt.is_leap_year, 366, 365)
+    freq_df['expected_samples'] = np.ceil(days_in_year / freq_df['frequency'].to_numpy())
+    return freq_df[['year', 'analyte_type', 'expected_samples']]
+
+
+def screen_site_species(site_id, index_df=None):
+    """
+    Compute screening statistics of every species at a site in one pass:
+    the number of samples, the percentage below MDL, the signal-to-noise ratio,
+    the completeness, and the median concentration.
+    - inputs:
+        - site_id: NAPS site ID (int)
+        - index_df: Optional. a loaded index DataFrame to avoid reading INDEX_CSV
+    - output: a DataFrame with one row for each species
+    """
+    if index_df is None:
+        index_df = _shared_index_df if _shared_index_df is not None else pd.read_csv(INDEX_CSV)
+
+    long_df = load_species_long_df(site_id, index_df)
+    if len(long_df) == 0:
+        return pd.DataFrame(columns=screening_columns)
+
+    conc = long_df['value'].to_numpy(dtype=float)
+    mdl = long_df['mdl'].to_numpy(dtype=float)
+    unc = calculate_uncertainty(conc, mdl)
+
+    # S/N (EPA PMF 5.0): d = (x - s) / s for x > s, otherwise 0, averaged over samples
+    with np.errstate(divide='ignore', invalid='ignore'):
+        long_df['sn'] = np.where(conc > unc, (conc - unc) / unc, 0.0)
+    long_df['below_mdl'] = (conc <= 0) | (conc < mdl)
+
+    stats_df = long_df.groupby(['species', 'analyte', 'analyte_type'], sort=False).agg(
+        n_samples=('value', 'size'),
+        pct_below_mdl=('below_mdl', 'mean'),
+        signal_to_noise=('sn', 'mean'),
+        median_conc=('value', 'median')).reset_index()
+    stats_df['pct_below_mdl'] = stats_df['pct_below_mdl'] * 100
+
+    # completeness within the years in which each species was measured
+    species_years = long_df[['species', 'year', 'analyte_type']].drop_duplicates()
+    species_years = species_years.merge(get_expected_samples(index_df, site_id),
+                                        on=['year', 'analyte_type'], how='left')
+    expected = species_years.groupby('species')['expected_samples'].sum()
+    stats_df['completeness'] = (
+        stats_df['n_samples'] / stats_df['species'].map(expected).to_numpy() * 100).clip(upper=100)
+
+    stats_df['category'] = np.where(
+        stats_df['signal_to_noise'] >= sn_categories['strong'], 'strong',
+        np.where(stats_df['signal_to_noise'] >= sn_categories['weak'], 'weak', 'bad'))
+    stats_df['rank'] = stats_df['signal_to_noise'].rank(ascending=False, method='first').astype(int)
+    stats_df['site_id'] = site_id
+    stats_df['error'] = None
+    return stats_df[screening_columns]
+
+
+def screen_site_species_safely(site_id):
+    """
+    Screen the species of a site in a worker process. An error is logged and recorded
+    instead of stopping the screening of the other sites.
+    - input: site_id: NAPS site ID (int)
+    - output: a DataFrame returned by screen_site_species(), or a row of the site with
+        the error message if the screening failed
+    """
+    try:
+        return screen_site_species(site_id)
+    except Exception as e:
+        logger.error(f'Failed to screen species at site {site_id}: {e}')
+        return pd.DataFrame([{'site_id': site_id, 'error': str(e)}], columns=screening_columns)
+
+
+def screen_species(sites=None, processes=None):
+    """
+    Compute the screening statistics for every site x species across a process pool
+    and save the ranked table to SPECIES_SCREENING_CSV.
+    - inputs:
+        - sites: Optional. a list of NAPS site IDs (int); all sites in the index by default
+        - processes: Optional. the number of worker processes (int); CPU count by default
+    - output: screening_df: a DataFrame sorted by site and rank of S/N; a site which
+        failed has one row with the message in 'error'
+    """
+    index_df = pd.read_csv(INDEX_CSV)
+    if sites is None:
+        sites = index_df['site_id'].sort_values().unique().tolist()
+
+    logger.info(f'Start screening species at {len(sites)} sites')
+
+    with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker,
+                             initargs=(index_df,)) as executor:
+        site_dfs = list(executor.map(screen_site_species_safely, sites))
+
+    screening_df = pd.concat(site_dfs, ignore_index=True)
+    screening_df = screening_df.sort_values(['site_id', 'rank']).reset_index(drop=True)
+    screening_df.to_csv(SPECIES_SCREENING_CSV, index=False)
+
+    failed_sites = screening_df.loc[screening_df['error'].notna(), 'site_id'].tolist()
+    logger.info(f'Completed screening {len(screening_df) - len(failed_sites)} site x species combinations'
+                f'{f", failed at sites {failed_sites}" if len(failed_sites) > 0 else ""}')
+    return screening_df
+
+
+def get_screened_analytes(site_id, analyte_type, min_signal_to_noise=sn_categories['weak'],
+                          max_pct_below_mdl=None, min_completeness=None):
+    """
+    Return analytes of a site which pass the screening criteria in SPECIES_SCREENING_CSV.
+    The list can be passed to create_nt_analyte_files() or create_ion_files().
+    - inputs:
+        - site_id: NAPS site ID (int)
+        - analyte_type: 'NT' for Near Total, 'WS' for Water-soluble, and 'total' for ions
+        - min_signal_to_noise: Optional. minimum S/N (float); 0.5 (weak) by default
+        - max_pct_below_mdl: Optional. maximum percentage (float) of samples below MDL
+        - min_completeness: Optional. minimum completeness (float) in percent
+    - output: a list of analytes' full names (string) in order of S/N
+    """
+    screening_df = pd.read_csv(SPECIES_SCREENING_CSV)
+
+    mask = (screening_df['site_id'] == site_id) & (screening_df['analyte_type'] == analyte_type) & (
+        screening_df['analyte'] != 'PM2.5') & (screening_df['signal_to_noise'] >= min_signal_to_noise)
+    if max_pct_below_mdl is not None:
+        mask = mask & (screening_df['pct_below_mdl'] <= max_pct_below_mdl)
+    if min_completeness is not None:
+        mask = mask & (screening_df['completeness'] >= min_completeness)
+
+    return screening_df[mask].sort_values('rank')['analyte'].tolist()
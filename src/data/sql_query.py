@@ -0,0 +1,126 @@
+from pathlib import Path
+from src.config import (CONTINUOUS_PM25_ROLLUP_DIR, CONTINUOUS_PM25_STORE_DIR, INDEX_CSV,
+                        INTEGRATED_PM25_DIR, STATIONS_CSV)
+from src.utils.logger_config import setup_logger
+
+# duckdb is optional; it is only needed for SQL queries over the processed files
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+logger = setup_logger('data.sql_query', 'sql_query.log')
+
+# the connection shared by query() in this process
+_connection = None
+
+
+def require_duckdb():
+    if duckdb is None:
+        raise ImportError('duckdb is required for SQL queries over the processed datasets.')
+
+
+def quote_path(path):
+    """Return a path (string or Path) as an SQL string literal"""
+    return "'" + str(path).replace("'", "''") + "'"
+
+
+def get_view_definitions():
+    """
+    Return SQL definitions of the views over the processed files which exist.
+    Each view reads its files lazily, so filters and projections in a query are pushed
+    down to the CSV and Parquet readers (e.g. the partitions of the continuous store
+    outside a WHERE clause on site_id or year are not opened).
+    - output: a dictionary of view name and SELECT statement (string)
+    """
+    views = {}
+    if Path(INDEX_CSV).exists():
+        views['naps_index'] = f'SELECT * FROM read_csv_auto({quote_path(INDEX_CSV)})'
+    if Path(STATIONS_CSV).exists():
+        views['stations'] = f'SELECT * FROM read_csv_auto({quote_path(STATIONS_CSV)})'
+
+    # integrated files ({year}_{site_id}.csv and {year}_{site_id}_IC.csv) have different
+    # analyte columns across years, so the columns are united by name
+    integrated_files = {
+        'integrated': [path for path in Path(INTEGRATED_PM25_DIR).glob('[0-9][0-9][0-9][0-9]_*.csv')
+                       if not path.stem.endswith('_IC')],
+        'ions': list(Path(INTEGRATED_PM25_DIR).glob('[0-9][0-9][0-9][0-9]_*_IC.csv'))
+    }
+    for view, files in integrated_files.items():
+        if len(files) == 0:
+            continue
+        # the ICPMS files are listed, as a glob of {year}_{site_id}.csv would match the IC files
+        files = '[' + ', '.join(quote_path(path) for path in sorted(files)) + ']' if view == 'integrated' \
+            else quote_path(str(INTEGRATED_PM25_DIR) + '/[0-9][0-9][0-9][0-9]_*_IC.csv')
+        views[view] = (
+            "SELECT CAST(regexp_extract(filename, '(\\d{4})_\\d+(_IC)?\\.csv$', 1) AS INTEGER) AS year, "
+            f"* EXCLUDE (filename) FROM read_csv_auto({files}, union_by_name=true, filename=true)")
+
+    # hourly continuous PM2.5, partitioned by site_id and year (see continuous_pm25_store.py);
+    # negative values (e.g. -999 for missing hours) are NULL in pm25 and kept in pm25_raw
+    if any(Path(CONTINUOUS_PM25_STORE_DIR).glob('site_id=*/year=*/data.parquet')):
+        pattern = str(CONTINUOUS_PM25_STORE_DIR) + '/site_id=*/year=*/data.parquet'
+        views['continuous_pm25'] = (
+            f'SELECT site_id, year, sampling_date, CASE WHEN "PM2.5" >= 0 THEN "PM2.5" END AS pm25, '
+            f'"PM2.5" AS pm25_raw '
+            f'FROM read_parquet({quote_path(pattern)}, hive_partitioning=true)')
+
+    # daily, monthly and annual rollups of continuous PM2.5, a file per site
+    for resolution in ['daily', 'monthly', 'annual']:
+        if any(Path(str(CONTINUOUS_PM25_ROLLUP_DIR) + '/' + resolution).glob('*.parquet')):
+            pattern = str(CONTINUOUS_PM25_ROLLUP_DIR) + '/' + resolution + '/*.parquet'
+            views[f'continuous_pm25_{resolution}'] = (
+                "SELECT CAST(regexp_extract(filename, '(\\d+)\\.parquet$', 1) AS INTEGER) AS site_id, "
+                f"* EXCLUDE (filename) FROM read_parquet({quote_path(pattern)}, filename=true)")
+    return views
+
+
+def create_views(connection):
+    """
+    Create (or replace) the views over the processed files in a DuckDB connection.
+    Views are re-created to pick up new files, e.g. after extracting a new year.
+    - input: connection: a DuckDB connection
+    - output: a list of the view names (string)
+    """
+    views = get_view_definitions()
+    for view, select in views.items():
+        connection.execute(f'CREATE OR REPLACE VIEW {view} AS {select}')
+    logger.debug(f'Views created: {list(views)}')
+    return list(views)
+
+
+def connect(database=':memory:'):
+    """
+    Open a DuckDB connection with the views over the processed datasets:
+        - naps_index: the index file (INDEX_CSV)
+        - stations: the stations metadata (STATIONS_CSV)
+        - integrated: the integrated PM2.5 files of ICPMS with a 'year' column
+        - ions: the integrated PM2.5 files of IC with a 'year' column
+        - continuous_pm25: hourly continuous PM2.5 with 'site_id', 'year', 'sampling_date', 'pm25'
+            (NULL for negative values such as -999 for missing hours), and 'pm25_raw' (as stored)
+        - continuous_pm25_daily, _monthly, _annual: rollups of continuous PM2.5 with a 'site_id' column
+    - input: database: Optional. a DuckDB database file; in memory by default
+    - output: a DuckDB connection
+    """
+    require_duckdb()
+    connection = duckdb.connect(database)
+    create_views(connection)
+    return connection
+
+
+def query(sql, params=None, refresh=False):
+    """
+    Run an SQL query over the processed datasets and return the result, e.g.
+        query('SELECT year, avg(pm25) FROM continuous_pm25 WHERE site_id = ? GROUP BY year', [10102])
+    - inputs:
+        - sql: an SQL statement (string) over the views (see connect())
+        - params: Optional. a list of parameters for '?' placeholders in sql
+        - refresh: Optional. If True, re-create the views to pick up new files. False by default.
+    - output: a DataFrame of the result
+    """
+    global _connection
+    if _connection is None:
+        _connection = connect()
+    elif refresh:
+        create_views(_connection)
+    return _connection.execute(sql, params or []).df()
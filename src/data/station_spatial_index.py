@@ -0,0 +1,238 @@
+import numpy as np
+import pandas as pd
+from src.config import STATIONS_CSV
+from src.data.metadata_registry import get_csv, get_registered
+
+# scipy is optional; a brute-force search over the ~800 stations is used without it
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def to_unit_vectors(latitudes, longitudes):
+    """
+    Convert latitudes and longitudes in degrees into 3D unit vectors, in which the
+    Euclidean (chord) distance increases monotonically with the great-circle distance.
+    - output: a numpy array of shape (number of points, 3)
+    """
+    lat = np.radians(np.asarray(latitudes, dtype=float))
+    lon = np.radians(np.asarray(longitudes, dtype=float))
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+
+def chord_to_km(chord):
+    """Convert chord distances between unit vectors into great-circle distances in km"""
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.clip(np.asarray(chord) / 2, 0, 1))
+
+
+def km_to_chord(distance_km):
+    """Convert great-circle distances in km into chord distances between unit vectors"""
+    return 2 * np.sin(np.minimum(np.asarray(distance_km, dtype=float) / EARTH_RADIUS_KM, np.pi) / 2)
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """
+    Return great-circle distances in km between points, broadcasting the inputs.
+    - inputs: latitudes and longitudes in degrees (float or numpy arrays)
+    - output: distances (float or a numpy array) in km
+    """
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(x, dtype=float)) for x in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+def build_station_index(file_path):
+    """
+    Build the spatial index of the stations with coordinates in a stations file.
+    - input: file_path: a file path to the stations metadata CSV
+    - output: a dictionary of 'site_id', 'latitude', 'longitude', 'xyz' (numpy arrays),
+        and 'tree' (a cKDTree, or None without scipy)
+    """
+    stations = get_csv(file_path, encoding='utf-8')
+    stations = stations.dropna(subset=['Latitude', 'Longitude']).drop_duplicates('site_id')
+
+    xyz = to_unit_vectors(stations['Latitude'], stations['Longitude'])
+    return {
+        'site_id': stations['site_id'].to_numpy(),
+        'latitude': stations['Latitude'].to_numpy(dtype=float),
+        'longitude': stations['Longitude'].to_numpy(dtype=float),
+        'xyz': xyz,
+        'tree': cKDTree(xyz) if cKDTree is not None else None
+    }
+
+
+def get_station_index(candidates=None):
+    """
+    Return the spatial index of the stations, built once from STATIONS_CSV and rebuilt
+    when the file changes (see metadata_registry.py).
+    - input: candidates: Optional. a list of site IDs (int) to restrict the index to
+    - output: a dictionary (see build_station_index())
+    """
+    station_index = get_registered(STATIONS_CSV, 'spatial_index', build_station_index)
+    if candidates is None:
+        return station_index
+
+    is_candidate = np.isin(station_index['site_id'], np.asarray(candidates))
+    xyz = station_index['xyz'][is_candidate]
+    subset = {key: station_index[key][is_candidate] for key in ['site_id', 'latitude', 'longitude']}
+    subset['xyz'] = xyz
+    subset['tree'] = cKDTree(xyz) if (cKDTree is not None) and (len(xyz) > 0) else None
+    return subset
+
+
+def get_site_coordinates(site_ids):
+    """
+    Return latitudes and longitudes of sites.
+    - input: site_ids: a list of site IDs (int)
+    - outputs:
+        - latitudes: a numpy array (NaN for sites without coordinates)
+        - longitudes: a numpy array (NaN for sites without coordinates)
+    """
+    station_index = get_station_index()
+    positions = pd.Index(station_index['site_id']).get_indexer(np.asarray(site_ids))
+    found = positions >= 0
+    latitudes = np.where(found, station_index['latitude'][positions], np.nan)
+    longitudes = np.where(found, station_index['longitude'][positions], np.nan)
+    return latitudes, longitudes
+
+
+def get_empty_neighbours_df(columns):
+    """
+    Return an empty result of a nearest-station query with typed columns: 'distance_km'
+    as float and the other columns (IDs, ranks, and query positions) as int.
+    - input: columns: a list of the column names (string)
+    - output: an empty DataFrame
+    """
+    return pd.DataFrame({column: pd.Series(dtype='float64' if column == 'distance_km' else 'int64')
+                         for column in columns})
+
+
+def query_nearest_sites(latitudes, longitudes, k=1, candidates=None):
+    """
+    Find the k nearest stations of each query point.
+    - inputs:
+        - latitudes: a list or numpy array of latitudes of the query points
+        - longitudes: a list or numpy array of longitudes of the query points
+        - k: Optional. the number of nearest stations (int); 1 by default
+        - candidates: Optional. a list of site IDs (int) to search in; all stations by default
+    - output: a DataFrame with columns of 'query', 'rank' (1 for the nearest), 'site_id',
+        and 'distance_km', sorted by query and rank
+    """
+    station_index = get_station_index(candidates)
+    query_xyz = to_unit_vectors(np.atleast_1d(latitudes), np.atleast_1d(longitudes))
+    n_queries = len(query_xyz)
+    k = min(k, len(station_index['site_id']))
+    if (n_queries == 0) or (k == 0):
+        return get_empty_neighbours_df(['query', 'rank', 'site_id', 'distance_km'])
+
+    if station_index['tree'] is not None:
+        chords, positions = station_index['tree'].query(query_xyz, k=k)
+        chords, positions = chords.reshape(n_queries, k), positions.reshape(n_queries, k)
+    else:
+        # squared chord distances between unit vectors: |q - r|^2 = 2 - 2 q.r
+        squared = np.clip(2 - 2 * query_xyz @ station_index['xyz'].T, 0, None)
+        positions = np.argpartition(squared, k - 1, axis=1)[:, :k]
+        nearest = np.take_along_axis(squared, positions, axis=1)
+        order = np.argsort(nearest, axis=1)
+        positions = np.take_along_axis(positions, order, axis=1)
+        chords = np.sqrt(np.take_along_axis(nearest, order, axis=1))
+
+    return pd.DataFrame({
+        'query': np.repeat(np.arange(n_queries), k),
+        'rank': np.tile(np.arange(1, k + 1), n_queries),
+        'site_id': station_index['site_id'][positions.ravel()],
+        'distance_km': chord_to_km(chords.ravel())
+    })
+
+
+def query_sites_within_radius(latitudes, longitudes, radius_km, candidates=None):
+    """
+    Find all stations within a radius of each query point.
+    - inputs:
+        - latitudes: a list or numpy array of latitudes of the query points
+        - longitudes: a list or numpy array of longitudes of the query points
+        - radius_km: the radius (float) in km
+        - candidates: Optional. a list of site IDs (int) to search in; all stations by default
+    - output: a DataFrame with columns of 'query', 'site_id', and 'distance_km',
+        sorted by query and distance
+    """
+    station_index = get_station_index(candidates)
+    query_xyz = to_unit_vectors(np.atleast_1d(latitudes), np.atleast_1d(longitudes))
+    max_chord = km_to_chord(radius_km)
+
+    if station_index['tree'] is not None:
+        neighbours = station_index['tree'].query_ball_point(query_xyz, max_chord)
+        queries = np.repeat(np.arange(len(query_xyz)), [len(item) for item in neighbours])
+        positions = np.fromiter((p for item in neighbours for p in item), dtype=np.int64, count=len(queries))
+        chords = np.linalg.norm(query_xyz[queries] - station_index['xyz'][positions], axis=1)
+    else:
+        chords_matrix = np.sqrt(np.clip(2 - 2 * query_xyz @ station_index['xyz'].T, 0, None))
+        queries, positions = np.nonzero(chords_matrix <= max_chord)
+        chords = chords_matrix[queries, positions]
+
+    result_df = pd.DataFrame({
+        'query': queries,
+        'site_id': station_index['site_id'][positions],
+        'distance_km': chord_to_km(chords)
+    })
+    return result_df.sort_values(['query', 'distance_km']).reset_index(drop=True)
+
+
+def query_sites_in_bbox(min_latitude, max_latitude, min_longitude, max_longitude, candidates=None):
+    """
+    Return stations in a bounding box. A box across the antimeridian can be given
+    with min_longitude > max_longitude.
+    - inputs:
+        - min_latitude, max_latitude: the range of latitudes in degrees
+        - min_longitude, max_longitude: the range of longitudes in degrees
+        - candidates: Optional. a list of site IDs (int) to search in; all stations by default
+    - output: a sorted list of site IDs (int)
+    """
+    station_index = get_station_index(candidates)
+    latitude, longitude = station_index['latitude'], station_index['longitude']
+
+    in_latitude = (latitude >= min_latitude) & (latitude <= max_latitude)
+    if min_longitude <= max_longitude:
+        in_longitude = (longitude >= min_longitude) & (longitude <= max_longitude)
+    else:
+        in_longitude = (longitude >= min_longitude) | (longitude <= max_longitude)
+
+    return sorted(station_index['site_id'][in_latitude & in_longitude].tolist())
+
+
+def get_nearest_sites(site_ids, k=1, candidates=None, include_self=False):
+    """
+    Find the k nearest other stations of each site, e.g. continuous PM2.5 sites
+    near speciation sites.
+    - inputs:
+        - site_ids: a list of site IDs (int)
+        - k: Optional. the number of nearest stations (int); 1 by default
+        - candidates: Optional. a list of site IDs (int) to search in; all stations by default
+        - include_self: Optional. If True, a site can be its own nearest station
+            (e.g. co-located instruments). False by default.
+    - output: a DataFrame with columns of 'site_id', 'rank', 'nearest_site_id', and 'distance_km'
+    """
+    site_ids = np.asarray(site_ids)
+    latitudes, longitudes = get_site_coordinates(site_ids)
+    has_coordinates = ~np.isnan(latitudes)
+    site_ids = site_ids[has_coordinates]
+
+    # one extra neighbour to drop the site itself
+    n_neighbours = k if include_self else k + 1
+    nearest_df = query_nearest_sites(latitudes[has_coordinates], longitudes[has_coordinates],
+                                     n_neighbours, candidates)
+    if len(nearest_df) == 0:
+        # no query site has coordinates, or no candidate station
+        return get_empty_neighbours_df(['site_id', 'rank', 'nearest_site_id', 'distance_km'])
+    nearest_df['site_id'], nearest_df['nearest_site_id'] = (
+        site_ids[nearest_df['query'].to_numpy()], nearest_df['site_id'].to_numpy())
+
+    if not include_self:
+        nearest_df = nearest_df[nearest_df['site_id'] != nearest_df['nearest_site_id']]
+    nearest_df = nearest_df.copy()
+    nearest_df['rank'] = nearest_df.groupby('site_id').cumcount() + 1
+    nearest_df = nearest_df[nearest_df['rank'] <= k]
+    return nearest_df[['site_id', 'rank', 'nearest_site_id', 'distance_km']].reset_index(drop=True)
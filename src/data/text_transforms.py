@@ -1,21 +1,60 @@
+import numpy as np
 import pandas as pd
 import re
-from src.config import ABBREVIATION_CSV, COLUMN_NAMES
+from src.config import ABBREVIATION_CSV, COLUMN_NAMES, UNITS_CSV
+from src.data.metadata_registry import get_csv, get_mapping
 
-# Global variable to cache the data
-_cached_column_names = None
-_cached_column_names_pre_2010 = None
+# factors to convert a reported unit to ng/m3
+unit_factors = {'ng/m3': 1, 'ug/m3': 10 ** 3}
 
-def convert_micro_to_nano(df, columns):
+
+def load_units_file():
+    """
+    Return the units table UNITS_CSV, which records the reported unit (raw_unit) and 
+    the canonical unit (unit) of every analyte and MDL column for each instrument.
+    """
+    return get_csv(UNITS_CSV)
+
+
+def get_unit_conversion_factors(instrument):
+    """
+    Return factors to convert the reported values into the canonical unit.
+    - input: instrument: 'ICPMS' or 'IC' (string)
+    - output: factors: a dictionary with column names as keys and factors (float) as values
+    """
+    units_df = load_units_file()
+    units_df = units_df[units_df['instrument'] == instrument]
+    
+    raw_factors = units_df['raw_unit'].map(unit_factors).to_numpy(dtype=float)
+    canonical_factors = units_df['unit'].map(unit_factors).to_numpy(dtype=float)
+    factors = dict(zip(units_df['column'], raw_factors / canonical_factors))
+    return factors
+
+
+def get_column_unit(instrument, column):
+    """Return the canonical unit (string) of a column in the processed data"""
+    units_df = load_units_file()
+    row = units_df[(units_df['instrument'] == instrument) & (units_df['column'] == column)]
+    return row['unit'].iloc[0]
+
+
+def normalise_units(df, instrument):
     """
-    Convert unit from micro to nano in specified columns.
+    Convert analyte and MDL columns to their canonical units (see UNITS_CSV).
+    This is applied once during extraction, so the processed files are already 
+    in the canonical units.
     - inputs:
-        - df: a DataFrame
-        - columns: a list of column names (string)
-    - output: df: a DataFrame with columns which have converted units
+        - df: a DataFrame with the renamed (canonical) columns
+        - instrument: 'ICPMS' or 'IC' (string)
+    - output: df: a DataFrame with converted units
     """
-    conversion_factor = 10 ** 3
-    df[columns] = df[columns].apply(lambda x: x * conversion_factor)
+    factors = get_unit_conversion_factors(instrument)
+    columns = [col for col in df.columns if (col in factors) and (factors[col] != 1)]
+    
+    if len(columns) > 0:
+        # cells can be empty strings in the raw data, so coerce them to NaN first
+        values = df[columns].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float)
+        df[columns] = values * np.array([factors[col] for col in columns])
     return df
 
 
@@ -42,14 +81,11 @@ def formalise_columns(df, mapping):
 def get_abbreviation_dict():
     """
     Return a diction with full names of analytes as keys and their abbreviations as values.
+    The dictionary is loaded once and shared (see metadata_registry.py); do not modify it.
     - output:
         - abb_dict: a dictionary of keys (analyte full name) and values (abbreviation)
     """
-    abb_df = pd.read_csv(ABBREVIATION_CSV)
-    column_keys = 'full_name'
-    column_values = 'abbreviation'
-    abb_dict = pd.Series(abb_df[column_values].values, index=abb_df[column_keys]).to_dict()
-    return abb_dict
+    return get_mapping(ABBREVIATION_CSV, 'full_name', 'abbreviation')
 
 
 def get_MDL_col_name(analyte):
@@ -64,18 +100,8 @@ def remove_parentheses(text):
 
 
 def load_column_names_file(filepath):
-    
-    if filepath == COLUMN_NAMES:
-        global _cached_column_names
-        if _cached_column_names is None:
-            _cached_column_names = pd.read_csv(filepath)
-        return _cached_column_names
-        
-    else:  # COLUMN_NAMES_PRE_2010_IONS
-        global _cached_column_names_pre_2010
-        if _cached_column_names_pre_2010 is None:
-            _cached_column_names_pre_2010 = pd.read_csv(filepath)
-        return _cached_column_names_pre_2010
+    """Return a column names file (COLUMN_NAMES or COLUMN_NAMES_PRE_2010_IONS) as a DataFrame"""
+    return get_csv(filepath)
 
 
 def rename_columns(df, TEMPLATE=COLUMN_NAMES):
@@ -88,8 +114,7 @@ def rename_columns(df, TEMPLATE=COLUMN_NAMES):
             in 'new_name' column
     - output: renamed_df, a DataFrame with modified column names 
     """
-    col_names_df = load_column_names_file(TEMPLATE)
-    dict_col = dict(zip(col_names_df.old_name, col_names_df.new_name))
+    dict_col = get_mapping(TEMPLATE, 'old_name', 'new_name')
     renamed_df = df.rename(columns=dict_col, errors = 'ignore')
     return renamed_df
 
@@ -0,0 +1,236 @@
+import functools
+import hashlib
+import inspect
+import os
+import pickle
+import shutil
+import sys
+import types
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from src.config import DISK_CACHE_DIR
+from src.utils.logger_config import setup_logger
+
+logger = setup_logger('utils.disk_cache', 'disk_cache.log')
+
+# the total size of the cached results; the least recently used results are evicted beyond it
+DISK_CACHE_MAX_BYTES = 2 * 1024 ** 3
+
+
+def hash_value(value, digest):
+    """
+    Update a hash digest with an argument value. DataFrames, Series, and numpy arrays
+    are hashed by their content; other values by their repr().
+    - inputs:
+        - value: an argument value
+        - digest: a hashlib object; updated in place
+    """
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        digest.update(type(value).__name__.encode())
+        if isinstance(value, pd.DataFrame):
+            digest.update(repr(value.columns.tolist()).encode())
+        digest.update(pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes())
+    elif isinstance(value, np.ndarray):
+        digest.update(repr((value.dtype.str, value.shape)).encode())
+        digest.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, (list, tuple)):
+        digest.update(type(value).__name__.encode() + b'[')
+        for item in value:
+            hash_value(item, digest)
+            digest.update(b',')
+        digest.update(b']')
+    elif isinstance(value, (set, frozenset)):
+        hash_value(sorted(value, key=repr), digest)
+    elif isinstance(value, dict):
+        hash_value(sorted(value.items(), key=lambda item: repr(item[0])), digest)
+    else:
+        digest.update(repr(value).encode())
+
+
+def get_file_fingerprints(paths):
+    """
+    Return fingerprints (size and modification time) of input files. Directories are
+    walked, and glob patterns (with '*') are expanded.
+    - input: paths: a list of file paths, directories, or glob patterns (string or Path)
+    - output: a sorted list of (path, size, modification time in ns) tuples;
+        a path which does not exist has a size and time of -1
+    """
+    fingerprints = []
+    for path in paths:
+        path = str(path)
+        if '*' in path:
+            parent, pattern = os.path.split(path)
+            matches = [str(item) for item in Path(parent).glob(pattern)]
+        elif os.path.isdir(path):
+            matches = [os.path.join(root, name) for root, _, names in os.walk(path) for name in names]
+        else:
+            matches = [path]
+
+        for match in matches:
+            try:
+                stat = os.stat(match)
+                fingerprints.append((match, stat.st_size, stat.st_mtime_ns))
+            except FileNotFoundError:
+                fingerprints.append((match, -1, -1))
+    return sorted(fingerprints)
+
+
+def get_dependent_modules(module_name):
+    """
+    Return the modules of the same package which a module depends on, itself included,
+    following the modules, functions, and classes in their namespaces.
+    - input: module_name: an imported module name (string), e.g. 'src.data.pmf_matrix'
+    - output: a sorted list of module names (string)
+    """
+    package = module_name.split('.')[0]
+    modules = set()
+    pending = [module_name]
+    while len(pending) > 0:
+        name = pending.pop()
+        if (name in modules) or (name not in sys.modules):
+            continue
+        modules.add(name)
+        for value in vars(sys.modules[name]).values():
+            dependency = value.__name__ if isinstance(value, types.ModuleType) else getattr(value, '__module__', None)
+            if isinstance(dependency, str) and (dependency.split('.')[0] == package):
+                pending.append(dependency)
+    return sorted(modules)
+
+
+def hash_module_sources(module_name):
+    """
+    Return a hash (string) of the source files of a module and the modules of the same
+    package it depends on, so results are recomputed when any code they run changes.
+    - input: module_name: an imported module name (string)
+    """
+    digest = hashlib.sha256()
+    for name in get_dependent_modules(module_name):
+        file_path = getattr(sys.modules[name], '__file__', None)
+        if file_path is None:
+            continue
+        digest.update(name.encode())
+        with open(file_path, 'rb') as file:
+            digest.update(hashlib.sha256(file.read()).digest())
+    return digest.hexdigest()
+
+
+def get_function_cache_dir(func):
+    """Return the cache directory (Path) of a function"""
+    return Path(DISK_CACHE_DIR) / f'{func.__module__}.{func.__qualname__}'
+
+
+def get_cache_size():
+    """Return the total size (int) in bytes of the cached results"""
+    if not Path(DISK_CACHE_DIR).exists():
+        return 0
+    return sum(item.stat().st_size for item in Path(DISK_CACHE_DIR).glob('*/*.pkl'))
+
+
+def evict_cache(max_bytes=None):
+    """
+    Remove the least recently used results until the cache fits in a size.
+    - input: max_bytes: Optional. the size (int) in bytes; DISK_CACHE_MAX_BYTES by default
+    """
+    if max_bytes is None:
+        max_bytes = DISK_CACHE_MAX_BYTES
+    if not Path(DISK_CACHE_DIR).exists():
+        return
+
+    entries = []
+    for item in Path(DISK_CACHE_DIR).glob('*/*.pkl'):
+        try:
+            stat = item.stat()
+            entries.append((stat.st_mtime_ns, stat.st_size, item))
+        except FileNotFoundError:
+            # removed by another process
+            continue
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, item in sorted(entries):
+        if total <= max_bytes:
+            break
+        item.unlink(missing_ok=True)
+        total -= size
+        logger.debug(f'Evicted {item}')
+
+
+def clear_disk_cache(func=None):
+    """
+    Remove cached results of a function, or all cached results.
+    - input: func: Optional. a function decorated with disk_cache(); all functions by default
+    """
+    cache_dir = get_function_cache_dir(func.__wrapped__) if func is not None else Path(DISK_CACHE_DIR)
+    if cache_dir.exists():
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+def disk_cache(inputs=None, skip_if=None, version=None):
+    """
+    Decorate a function to keep its results on disk, addressed by a hash of the source of
+    its module and the modules of the package it depends on, its arguments, and the
+    fingerprints of the input files it reads. A result is reused across sessions until
+    the code, the arguments, or the input files change.
+    - inputs:
+        - inputs: Optional. a function which takes the arguments (as keywords) and returns
+            a list of the files, directories, or glob patterns read by the function,
+            including configuration files such as ABBREVIATION_CSV
+        - skip_if: Optional. a function which takes the arguments (as keywords) and returns
+            True to call the function without the cache, e.g. when hashing an argument
+            would take longer than the call
+        - version: Optional. a value to change to discard the results when something
+            outside the package code and the input files changes
+    - output: a decorator; the decorated function has clear_cache() to remove its results
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+        try:
+            source = inspect.getsource(func)
+        except (OSError, TypeError):
+            source = func.__code__.co_code.hex()
+        # the dependencies are imported by the first call, so the modules are hashed then
+        code_hash = []
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            arguments = dict(bound.arguments)
+            if (skip_if is not None) and skip_if(**arguments):
+                return func(*args, **kwargs)
+
+            if len(code_hash) == 0:
+                code_hash.append(hashlib.sha256((source + hash_module_sources(func.__module__) +
+                                                 repr(version)).encode()).hexdigest())
+            digest = hashlib.sha256(code_hash[0].encode())
+            hash_value(sorted(arguments.items()), digest)
+            if inputs is not None:
+                hash_value(get_file_fingerprints(inputs(**arguments)), digest)
+            cache_dir = get_function_cache_dir(func)
+            cache_path = cache_dir / (digest.hexdigest() + '.pkl')
+
+            try:
+                with open(cache_path, 'rb') as file:
+                    result = pickle.load(file)
+                # the modification time marks the last use for the eviction
+                os.utime(cache_path)
+                return result
+            except FileNotFoundError:
+                pass
+            except (pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+                logger.warning(f'Discarded an unreadable cache file: {cache_path}')
+
+            result = func(*args, **kwargs)
+
+            cache_dir.mkdir(parents=True, exist_ok=True)
+            # write to a temporary file first, so a reader never sees a partial result
+            tmp_path = str(cache_path) + f'.{os.getpid()}.tmp'
+            with open(tmp_path, 'wb') as file:
+                pickle.dump(result, file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, cache_path)
+            evict_cache()
+            return result
+
+        wrapper.clear_cache = lambda: clear_disk_cache(wrapper)
+        return wrapper
+    return decorator
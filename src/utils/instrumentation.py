@@ -0,0 +1,224 @@
+import argparse
+import functools
+import inspect
+import json
+import os
+import platform
+import time
+import pandas as pd
+from contextlib import contextmanager
+from pathlib import Path
+from src.config import METRICS_JSONL
+from src.utils.logger_config import setup_logger
+
+# resource is not available on Windows; peak RSS is not recorded there
+try:
+    import resource
+except ImportError:
+    resource = None
+
+logger = setup_logger('utils.instrumentation', 'instrumentation.log')
+
+metric_columns = ['stage', 'target', 'parent', 'wall_s', 'cpu_s', 'rows', 'bytes', 'peak_rss_mb',
+                  'error', 'pid', 'started_at']
+
+# the records of the stages running in this process, the innermost last
+_active_stages = []
+
+
+def get_peak_rss_mb():
+    """
+    Return the peak resident set size (float) in MB of this process so far,
+    or None where it cannot be measured.
+    """
+    if resource is None:
+        return None
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / 1024 ** 2 if platform.system() == 'Darwin' else peak / 1024, 1)
+
+
+def get_total_size(paths):
+    """Return the total size (int) in bytes of files; files which do not exist are ignored"""
+    return sum(os.path.getsize(path) for path in paths if os.path.isfile(path))
+
+
+def write_metrics(record, path=None):
+    """
+    Append a record as a line of a JSON-lines file. Failing to write it is logged
+    and does not stop the pipeline.
+    - inputs:
+        - record: a dictionary of metrics
+        - path: Optional. a file path; METRICS_JSONL by default
+    """
+    path = Path(METRICS_JSONL if path is None else path)
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # a line is written at once, so worker processes can append to the same file
+        with open(path, 'a', encoding='utf-8') as file:
+            file.write(json.dumps(record, default=str) + '\n')
+    except OSError as e:
+        logger.warning(f'Failed to write metrics of {record["stage"]} to {path}: {e}')
+
+
+def record_metrics(rows=None, bytes=None):
+    """
+    Add rows processed and bytes read to the innermost running stage, e.g. from the
+    body of a function decorated with instrumented(). Ignored outside a stage.
+    - inputs:
+        - rows: Optional. the number of rows (int) processed
+        - bytes: Optional. the number of bytes (int) read
+    """
+    if len(_active_stages) == 0:
+        return
+    record = _active_stages[-1]
+    for key, value in [('rows', rows), ('bytes', bytes)]:
+        if value is not None:
+            record[key] = int(value) + (record[key] or 0)
+
+
+@contextmanager
+def measure_stage(stage, target=None):
+    """
+    Measure a stage of the pipeline and append its metrics to METRICS_JSONL:
+    wall time, CPU time of this process, rows processed, bytes read, and the peak RSS
+    of the process at the end of the stage. Stages can be nested, and each record
+    names its enclosing stage as 'parent'. e.g.
+        with measure_stage('index_year', target=year) as metrics:
+            ...
+            metrics['rows'] = len(rows)
+    - inputs:
+        - stage: the stage name (string)
+        - target: Optional. the file, site, or year the stage works on
+    - output: (yielding the record; set 'rows' and 'bytes' in it or call record_metrics())
+    """
+    record = {'stage': stage, 'target': None if target is None else str(target),
+              'parent': _active_stages[-1]['stage'] if len(_active_stages) > 0 else None,
+              'rows': None, 'bytes': None, 'error': None}
+    _active_stages.append(record)
+    started_at = time.strftime('%Y-%m-%dT%H:%M:%S')
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    try:
+        yield record
+    except BaseException as e:
+        record['error'] = type(e).__name__
+        raise
+    finally:
+        _active_stages.pop()
+        record.update({'wall_s': round(time.perf_counter() - wall_start, 4),
+                       'cpu_s': round(time.process_time() - cpu_start, 4),
+                       'peak_rss_mb': get_peak_rss_mb(), 'pid': os.getpid(), 'started_at': started_at})
+        write_metrics({column: record.get(column) for column in metric_columns})
+
+
+def instrumented(stage=None, target=None, rows=None, files=None):
+    """
+    Decorate a function to measure each call as a stage (see measure_stage()).
+    - inputs:
+        - stage: Optional. the stage name (string); the function name by default
+        - target: Optional. a function which takes the arguments (as keywords) and returns
+            the file, site, or year of the call
+        - rows: Optional. a function which takes the result and returns the number of rows
+        - files: Optional. a function which takes the arguments (as keywords) and returns
+            a list of the files read (or written, for downloads); their sizes are the bytes
+    - output: a decorator
+    """
+    def decorator(func):
+        name = stage or func.__name__
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            arguments = {}
+            if (target is not None) or (files is not None):
+                bound = signature.bind(*args, **kwargs)
+                bound.apply_defaults()
+                arguments = dict(bound.arguments)
+
+            with measure_stage(name, None if target is None else target(**arguments)):
+                result = func(*args, **kwargs)
+                record_metrics(rows=None if rows is None else rows(result),
+                               bytes=None if files is None else get_total_size(files(**arguments)))
+            return result
+        return wrapper
+    return decorator
+
+
+def load_metrics(path=None, since=None):
+    """
+    Load the recorded metrics.
+    - inputs:
+        - path: Optional. a JSON-lines file; METRICS_JSONL by default
+        - since: Optional. the first start time (string or datetime) of the stages to load
+    - output: a DataFrame with a row per measured stage
+    """
+    path = Path(METRICS_JSONL if path is None else path)
+    if (not path.exists()) or (path.stat().st_size == 0):
+        return pd.DataFrame(columns=metric_columns)
+
+    metrics_df = pd.read_json(path, lines=True, convert_dates=['started_at'], dtype={'target': str})
+    metrics_df = metrics_df.reindex(columns=metric_columns)
+    metrics_df['started_at'] = pd.to_datetime(metrics_df['started_at'])
+    if since is not None:
+        metrics_df = metrics_df[metrics_df['started_at'] >= pd.Timestamp(since)]
+    return metrics_df.reset_index(drop=True)
+
+
+def summarise_metrics(path=None, since=None, top=10):
+    """
+    Summarise the recorded metrics by stage and list the slowest calls.
+    Nested stages are included in the time of their parents.
+    - inputs:
+        - path: Optional. a JSON-lines file; METRICS_JSONL by default
+        - since: Optional. the first start time (string or datetime) of the stages to include
+        - top: Optional. the number (int) of the slowest calls to list; 10 by default
+    - outputs:
+        - stage_df: a DataFrame of the calls, times, rows, bytes, throughput, peak RSS, and
+            errors of each stage, the slowest in total first
+        - slowest_df: a DataFrame of the slowest calls with a target (e.g. a file or a site)
+    """
+    metrics_df = load_metrics(path, since)
+    if len(metrics_df) == 0:
+        return pd.DataFrame(), pd.DataFrame()
+
+    # rows and bytes stay NaN for stages which do not count them
+    total = lambda values: values.sum(min_count=1)
+    stage_df = metrics_df.groupby('stage').agg(
+        calls=('wall_s', 'size'), wall_s=('wall_s', 'sum'), mean_wall_s=('wall_s', 'mean'),
+        max_wall_s=('wall_s', 'max'), cpu_s=('cpu_s', 'sum'), rows=('rows', total),
+        bytes=('bytes', total), peak_rss_mb=('peak_rss_mb', 'max'), errors=('error', 'count'))
+    wall = stage_df['wall_s'].where(stage_df['wall_s'] > 0)
+    stage_df['rows_per_s'] = (stage_df['rows'] / wall).round(1)
+    stage_df['mb_per_s'] = (stage_df['bytes'] / 1024 ** 2 / wall).round(2)
+    stage_df = stage_df.sort_values('wall_s', ascending=False)
+
+    slowest_df = metrics_df[metrics_df['target'].notna()].nlargest(top, 'wall_s')
+    slowest_df = slowest_df[['stage', 'target', 'wall_s', 'cpu_s', 'rows', 'bytes', 'peak_rss_mb']]
+    return stage_df, slowest_df.reset_index(drop=True)
+
+
+def clear_metrics(path=None):
+    """Remove the recorded metrics (METRICS_JSONL by default)"""
+    Path(METRICS_JSONL if path is None else path).unlink(missing_ok=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Summarise the timing and throughput of the pipeline stages.')
+    parser.add_argument('--path', default=None, help=f'a metrics file (default: {METRICS_JSONL})')
+    parser.add_argument('--since', default=None, help='include stages started at or after this time')
+    parser.add_argument('--top', type=int, default=10, help='the number of the slowest calls (default: 10)')
+    parser.add_argument('--clear', action='store_true', help='remove the recorded metrics after the summary')
+    args = parser.parse_args()
+
+    stage_df, slowest_df = summarise_metrics(args.path, args.since, args.top)
+    if len(stage_df) == 0:
+        print('No metrics recorded.')
+    else:
+        with pd.option_context('display.width', 200, 'display.max_columns', None):
+            print('Stages (slowest in total first):')
+            print(stage_df.to_string())
+            print(f'\nSlowest {len(slowest_df)} calls:')
+            print(slowest_df.to_string())
+
+    if args.clear:
+        clear_metrics(args.path)
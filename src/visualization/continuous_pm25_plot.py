@@ -0,0 +1,183 @@
+import numpy as np
+import pandas as pd
+import matplotlib.pyplot as plt
+from concurrent.futures import ProcessPoolExecutor
+from matplotlib.figure import Figure
+from src.config import OUTPUT_IMG_DIR
+from src.data.continuous_pm25_operation import get_continuous_pm25_data
+from src.data.file_operation import ensure_directory_exists
+from src.utils.logger_config import setup_logger
+
+logger = setup_logger('visualization.continuous_pm25_plot', 'visualization.log')
+
+CONTINUOUS_PM25_IMG_DIR = OUTPUT_IMG_DIR / 'continuous_pm25'
+
+FIGURE_SIZE = (12, 3)
+FIGURE_DPI = 100
+
+
+def mask_non_positive(values):
+    """
+    Return values as float with values <= 0 (and NaN) replaced with NaN.
+    - input: values: a numpy array of PM2.5
+    - output: a numpy array of float
+    """
+    values = np.asarray(values, dtype=float)
+    with np.errstate(invalid='ignore'):
+        return np.where(values > 0, values, np.nan)
+
+
+def decimate_min_max(values, n_buckets):
+    """
+    Return positions of the minimum and maximum of each of n_buckets equal-sized buckets,
+    which preserve the envelope of a series at the resolution of n_buckets pixels.
+    - inputs:
+        - values: a numpy array without NaN
+        - n_buckets: the number of buckets (int), e.g. the plot width in pixels
+    - output: a sorted numpy array of positions (int)
+    """
+    n = len(values)
+    if n <= 2 * n_buckets:
+        return np.arange(n)
+
+    bucket_ids = np.arange(n) * n_buckets // n
+    edges = np.searchsorted(bucket_ids, np.arange(n_buckets + 1))
+
+    # sorted by bucket then value, the first and last of each bucket are its min and max
+    order = np.lexsort((values, bucket_ids))
+    positions = np.concatenate([order[edges[:-1]], order[edges[1:] - 1]])
+    return np.unique(positions)
+
+
+def decimate_lttb(x, y, n_out):
+    """
+    Return positions selected by the Largest-Triangle-Three-Buckets algorithm, which
+    keeps the points forming the largest triangles with the neighbouring buckets.
+    - inputs:
+        - x: a numpy array of float (e.g. time in hours) in ascending order
+        - y: a numpy array without NaN
+        - n_out: the number of points (int) to return
+    - output: a numpy array of positions (int)
+    """
+    n = len(y)
+    if (n <= n_out) or (n_out < 3):
+        return np.arange(n)
+
+    # the first and last points are always kept; the rest is split into n_out - 2 buckets
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    positions = np.empty(n_out, dtype=np.int64)
+    positions[0] = 0
+    positions[-1] = n - 1
+
+    previous = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+
+        # the average point of the next bucket (the last point for the last bucket)
+        if i < n_out - 3:
+            next_x = x[edges[i + 1]:edges[i + 2]].mean()
+            next_y = y[edges[i + 1]:edges[i + 2]].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]
+
+        areas = np.abs((x[previous] - next_x) * (y[start:end] - y[previous])
+                       - (x[previous] - x[start:end]) * (next_y - y[previous]))
+        previous = start + int(np.argmax(areas))
+        positions[i + 1] = previous
+
+    return positions
+
+
+def decimate_continuous_pm25(df, width_px, method='minmax'):
+    """
+    Mask values <= 0 and downsample hourly PM2.5 to the plot width.
+    - inputs:
+        - df: a DataFrame of hourly PM2.5 indexed by sampling_date
+        - width_px: the plot width in pixels (int)
+        - method: Optional. 'minmax' (default; min and max of each pixel) or 'lttb'
+    - output: a Series of the selected points indexed by sampling_date
+    """
+    values = mask_non_positive(df['PM2.5'].to_numpy())
+    valid = ~np.isnan(values)
+    times = df.index[valid]
+    values = values[valid]
+
+    if method == 'minmax':
+        positions = decimate_min_max(values, width_px)
+    elif method == 'lttb':
+        hours = (times - times[0]) / pd.Timedelta(hours=1) if len(times) > 0 else np.array([])
+        positions = decimate_lttb(np.asarray(hours, dtype=float), values, 2 * width_px)
+    else:
+        raise ValueError(f'Unknown decimation method: {method}. Use "minmax" or "lttb"')
+
+    return pd.Series(values[positions], index=times[positions], name='PM2.5')
+
+
+def draw_continuous_pm25(ax, df, width_px, method='minmax'):
+    """Draw decimated hourly PM2.5 on an Axes"""
+    pm25 = decimate_continuous_pm25(df, width_px, method)
+    ax.plot(pm25.index, pm25.to_numpy(), label='PM$_{2.5}$', color='grey', linestyle='None', marker=',')
+    ax.set_xlabel('Time')
+    ax.set_ylabel('PM$_{2.5}$ (µg/m$^3$)')
+    ax.legend()
+
+
+def plot_continuous_pm25(site_id, df, method='minmax'):
+    """
+    Plot hourly PM2.5 of a site, downsampled to the width of the figure in pixels.
+    Values <= 0 are not plotted.
+    - inputs:
+        - site_id: NAPS site ID (int)
+        - df: a DataFrame of hourly PM2.5 indexed by sampling_date
+        - method: Optional. 'minmax' (default) or 'lttb'
+    - output: (display to screen)
+    """
+    fig, ax = plt.subplots(figsize=FIGURE_SIZE, dpi=FIGURE_DPI)
+    width_px = int(ax.get_window_extent().width)
+    draw_continuous_pm25(ax, df, width_px, method)
+    plt.gcf().autofmt_xdate()
+    plt.show()
+
+
+def render_continuous_pm25_plot(site_id, method='minmax'):
+    """
+    Render hourly PM2.5 of a site to a PNG file in CONTINUOUS_PM25_IMG_DIR without a display.
+    - inputs:
+        - site_id: NAPS site ID (int)
+        - method: Optional. 'minmax' (default) or 'lttb'
+    - output: the file path (string) of the image, or None if the site has no data
+    """
+    df = get_continuous_pm25_data(site_id, 'all')
+    if len(df) == 0:
+        logger.warning(f'No continuous PM2.5 data to plot for site {site_id}')
+        return None
+
+    # a Figure without pyplot uses the Agg canvas, so it is safe in worker processes
+    fig = Figure(figsize=FIGURE_SIZE, dpi=FIGURE_DPI)
+    ax = fig.subplots()
+    width_px = int(ax.get_position().width * FIGURE_SIZE[0] * FIGURE_DPI)
+    draw_continuous_pm25(ax, df, width_px, method)
+    ax.set_title(f'Site {site_id}')
+    fig.autofmt_xdate()
+
+    fname_to_save = str(CONTINUOUS_PM25_IMG_DIR) + '/' + str(site_id) + '.png'
+    fig.savefig(fname_to_save, bbox_inches='tight')
+    return fname_to_save
+
+
+def render_continuous_pm25_plots(sites, method='minmax', processes=None):
+    """
+    Render hourly PM2.5 plots of many sites to PNG files across a process pool.
+    - inputs:
+        - sites: a list of NAPS site IDs (int)
+        - method: Optional. 'minmax' (default) or 'lttb'
+        - processes: Optional. the number of worker processes (int); CPU count by default
+    - output: a list of the file paths (string) of the images
+    """
+    ensure_directory_exists(CONTINUOUS_PM25_IMG_DIR)
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        file_paths = list(executor.map(render_continuous_pm25_plot, sites, [method] * len(sites)))
+
+    logger.info(f'Rendered continuous PM2.5 plots of {len(sites)} sites into {CONTINUOUS_PM25_IMG_DIR}')
+    return file_paths
@@ -1,5 +1,22 @@
+import numpy as np
 import pandas as pd
-from src.config import INDEX_CSV, STATIONS_CSV
+from matplotlib.colors import ListedColormap
+from matplotlib.figure import Figure
+from matplotlib.patches import Patch
+from src.config import INDEX_CSV, OUTPUT_IMG_DIR, STATIONS_CSV
+from src.data.file_operation import ensure_directory_exists
+from src.utils.disk_cache import disk_cache
+
+COVERAGE_IMG_DIR = OUTPUT_IMG_DIR / 'coverage'
+
+# background colours of the coverage categories
+coverage_colors = {
+    'Both': '#97d8c4',
+    'WS': '#6B9ac4',
+    'NT': '#f4b942',
+    'n/a': '#999999'
+}
+
 
 def color_nt_ws(value):
     """
@@ -9,16 +26,7 @@ def color_nt_ws(value):
     blue if only Water-Soluble data exist, and
     grey if both data do not exist
     """
-    if value == 'Both':
-        color = '#97d8c4'
-    elif value == 'WS':
-        color = '#6B9ac4'
-    elif value == 'NT':
-        color = '#f4b942'
-    elif value == 'n/a':
-        color = '#999999'
-    else:
-        color = ''
+    color = coverage_colors.get(value, '') if isinstance(value, str) else ''
     return 'background-color: %s' % color
 
 
@@ -44,62 +52,167 @@ def color_percentage(value):
     return 'background-color: %s' % color
 
 
+def get_coverage_long_df(index_df, by_analyte=True):
+    """
+    Return the coverage category of every site and year (and analyte) measured by ICPMS:
+    'Both' if both Near-Total and Water-Soluble data exist, otherwise 'NT' or 'WS'.
+    - inputs:
+        - index_df: a DataFrame of the index CSV
+        - by_analyte: Optional. If False, categories are of any analyte. True by default.
+    - output: a DataFrame with columns of ('analyte'), 'site_id', 'year', and 'coverage'
+    """
+    keys = ['analyte', 'site_id', 'year'] if by_analyte else ['site_id', 'year']
+    icpms_df = index_df.loc[index_df['instrument'] == 'ICPMS', keys + ['analyte_type']]
+    unique_combinations = icpms_df.drop_duplicates()
+
+    coverage_df = unique_combinations.groupby(keys, sort=False)['analyte_type'].agg(
+        n_types='nunique', analyte_type='first').reset_index()
+    coverage_df['coverage'] = np.where(coverage_df['n_types'] > 1, 'Both', coverage_df['analyte_type'])
+    return coverage_df[keys + ['coverage']]
+
+
+def pivot_coverage(coverage_df, years, station_names):
+    """
+    Pivot the coverage categories into a matrix of sites x years.
+    - inputs:
+        - coverage_df: a DataFrame with columns of 'site_id', 'year', and 'coverage'
+        - years: all years (list of int) to show as columns
+        - station_names: a Series of station names indexed by site ID
+    - output: a DataFrame with 'station_name', 'site_id', and a column for each year
+    """
+    matrix_df = coverage_df.pivot(index='site_id', columns='year', values='coverage')
+    matrix_df = matrix_df.reindex(columns=years).fillna('n/a')
+    matrix_df.columns.name = None
+
+    # keep only sites with a station name, as an inner join with the stations
+    matrix_df = matrix_df[matrix_df.index.isin(station_names.index)].sort_index().reset_index()
+    matrix_df.insert(0, 'station_name', matrix_df['site_id'].map(station_names).to_numpy())
+    return matrix_df
+
+
+@disk_cache(inputs=lambda **_: [INDEX_CSV, STATIONS_CSV])
+def build_coverage_matrix(analyte='', index_df=None, stations_df=None, sites=None):
+    """
+    Return a table of coverage of the data set: NT, WS, Both, or n/a for each site and year.
+    - inputs:
+        - analyte: Optional. analyte or ion full name (string); all analytes by default
+        - index_df: Optional. a loaded index DataFrame to avoid reading INDEX_CSV
+        - stations_df: Optional. a loaded stations DataFrame to avoid reading STATIONS_CSV
+        - sites: Optional. a list of site IDs (int) to show, e.g. from get_sites_in_bbox()
+    - output: a DataFrame with 'station_name', 'site_id', and a column for each year
+    """
+    if index_df is None:
+        index_df = pd.read_csv(INDEX_CSV)
+    if stations_df is None:
+        stations_df = pd.read_csv(STATIONS_CSV, encoding='utf-8')
+
+    years = index_df.sort_values('year')['year'].unique().tolist()
+    if sites is not None:
+        index_df = index_df[index_df['site_id'].isin(sites)]
+    station_names = stations_df.drop_duplicates('site_id').set_index('site_id')['station_name']
+
+    if analyte != '':
+        coverage_df = get_coverage_long_df(index_df[index_df['analyte'] == analyte])
+    else:
+        coverage_df = get_coverage_long_df(index_df, by_analyte=False)
+
+    return pivot_coverage(coverage_df, years, station_names)
+
+
+@disk_cache(inputs=lambda **_: [INDEX_CSV, STATIONS_CSV])
+def build_coverage_matrices(analytes=None, index_df=None, stations_df=None, sites=None):
+    """
+    Return coverage tables of many analytes in one pass over the index.
+    - inputs:
+        - analytes: Optional. a list of analyte full names (string); all ICPMS analytes by default
+        - index_df: Optional. a loaded index DataFrame to avoid reading INDEX_CSV
+        - stations_df: Optional. a loaded stations DataFrame to avoid reading STATIONS_CSV
+        - sites: Optional. a list of site IDs (int) to show, e.g. from get_sites_in_bbox()
+    - output: a dictionary of analyte and its coverage table (see build_coverage_matrix())
+    """
+    if index_df is None:
+        index_df = pd.read_csv(INDEX_CSV)
+    if stations_df is None:
+        stations_df = pd.read_csv(STATIONS_CSV, encoding='utf-8')
+
+    years = index_df.sort_values('year')['year'].unique().tolist()
+    if sites is not None:
+        index_df = index_df[index_df['site_id'].isin(sites)]
+    station_names = stations_df.drop_duplicates('site_id').set_index('site_id')['station_name']
+
+    coverage_df = get_coverage_long_df(index_df)
+    if analytes is not None:
+        coverage_df = coverage_df[coverage_df['analyte'].isin(analytes)]
+
+    matrices = {}
+    for analyte, analyte_df in coverage_df.groupby('analyte', sort=True):
+        matrices[analyte] = pivot_coverage(analyte_df, years, station_names)
+    return matrices
+
+
+def style_coverage_matrix(matrix_df):
+    """Return a Styler of a coverage table coloured by the categories"""
+    return matrix_df.style.map(color_nt_ws)
+
+
+def save_coverage_png(matrix_df, file_path, title=''):
+    """
+    Save a coverage table as a PNG image of coloured cells, without a display.
+    - inputs:
+        - matrix_df: a coverage table returned by build_coverage_matrix()
+        - file_path: a file path (string) of the image
+        - title: Optional. a title (string) of the image
+    """
+    categories = list(coverage_colors)
+    year_columns = matrix_df.columns[2:]
+    codes = matrix_df[year_columns].apply(
+        lambda column: pd.Categorical(column, categories=categories).codes).to_numpy()
+
+    n_sites, n_years = codes.shape
+    fig = Figure(figsize=(max(6, 0.4 * n_years + 3), max(2, 0.22 * n_sites + 1)))
+    ax = fig.subplots()
+    ax.imshow(codes, cmap=ListedColormap(list(coverage_colors.values())), vmin=0,
+              vmax=len(categories) - 1, aspect='auto', interpolation='nearest')
+
+    ax.set_xticks(np.arange(n_years), labels=[str(year) for year in year_columns], rotation=90)
+    ax.set_yticks(np.arange(n_sites),
+                  labels=(matrix_df['station_name'] + ' (' + matrix_df['site_id'].astype(str) + ')').tolist())
+    ax.tick_params(labelsize=7)
+    handles = [Patch(color=color, label=category) for category, color in coverage_colors.items()]
+    ax.legend(handles=handles, loc='upper left', bbox_to_anchor=(1.01, 1), fontsize=7)
+    ax.set_title(title)
+    fig.savefig(file_path, bbox_inches='tight')
+
+
+def export_coverage_matrix(matrix_df, name, file_format='both'):
+    """
+    Save a coverage table into COVERAGE_IMG_DIR as HTML and/or PNG.
+    - inputs:
+        - matrix_df: a coverage table returned by build_coverage_matrix()
+        - name: a file name (string) without an extension, e.g. an analyte name
+        - file_format: Optional. 'html', 'png', or 'both' (default)
+    - output: a list of the file paths (string) saved
+    """
+    ensure_directory_exists(COVERAGE_IMG_DIR)
+    file_name = str(name).replace('/', '_').replace(' ', '_')
+
+    file_paths = []
+    if file_format in ['html', 'both']:
+        file_path = str(COVERAGE_IMG_DIR) + '/' + file_name + '.html'
+        style_coverage_matrix(matrix_df).to_html(file_path)
+        file_paths.append(file_path)
+    if file_format in ['png', 'both']:
+        file_path = str(COVERAGE_IMG_DIR) + '/' + file_name + '.png'
+        save_coverage_png(matrix_df, file_path, title=str(name))
+        file_paths.append(file_path)
+    return file_paths
+
+
 def visualize_coverage_by_site_and_year(analyte=''):
     """
     Display a table of coverage of the data set.
     - input: analyte (optional): analyte or ion full name (string)
     - output: (display to screen)
     """
-    index_df = pd.read_csv(INDEX_CSV)
-    stations = pd.read_csv(STATIONS_CSV, encoding='utf-8')
-    years = index_df.sort_values('year')['year'].squeeze().unique()
-    
-    # select a particular analyte if specified
-    icpms_df = pd.DataFrame()
-    if analyte != '':
-        icpms_df = index_df[(index_df['instrument'] == 'ICPMS') & (index_df['analyte'] == analyte)]
-    else:
-        icpms_df = index_df[index_df['instrument'] == 'ICPMS']
-    
-    unique_combinations = icpms_df[['year', 'site_id', 'analyte_type']].drop_duplicates()
-    unique_combinations.reset_index(drop=True, inplace=True)
-
-    all_sites = []
-    for site_id in unique_combinations['site_id'].sort_values().unique():
-        
-        years_for_one_site = unique_combinations[unique_combinations['site_id'] == site_id]
-        
-        one_row = [site_id]
-        
-        # information about each year will be concatnated to the right
-        for year in years:
-            rows = years_for_one_site[years_for_one_site['year'] == year]
-            
-            if len(rows) == 2:
-                # Both NT and WS data exist
-                one_row.append('Both')
-                
-            elif len(rows) == 1:
-                # MetalType (NT or WS) is extracted from the metainfo
-                one_row.append(rows.iloc[0, 2])
-    
-            else :
-                # Neither NT nor WS data exists
-                one_row.append('n/a')
-                
-        all_sites.append(one_row)
-        
-    new_col_header = ['site_id']
-    new_col_header.extend(years)
-    all_sites_df = pd.DataFrame(all_sites, columns=new_col_header)
-    
-    # match the station name with site ID for display
-    station_name_df = stations.loc[:, ['site_id', 'station_name']]
-    site_with_name_df = all_sites_df.merge(station_name_df, on='site_id')
-    
-    cols = site_with_name_df.columns.tolist()
-    cols = cols[-1:] + cols[:-1]
-    site_with_name_df = site_with_name_df[cols]
-    
-    table = site_with_name_df.style.map(color_nt_ws)
+    table = style_coverage_matrix(build_coverage_matrix(analyte))
     display(table)
@@ -1,5 +1,6 @@
 import pandas as pd
 from src.config import STATIONS_CSV
+from src.data.metadata_registry import get_mapping
 
 def format_float(val, n=2):
     """
@@ -26,8 +27,7 @@ def get_naps_station_name(site_id):
     - input: site_id: NAPS site ID (int)
     - output: titled_station_name: NAPS station name (string) in titled format
     """
-    stations = pd.read_csv(STATIONS_CSV)
-    station_name = stations.loc[stations['site_id'] == site_id, 'station_name'].iloc[0]
+    station_name = get_mapping(STATIONS_CSV, 'site_id', 'station_name')[site_id]
     titled_station_name = station_name.title()
     return titled_station_name
 